@@ -1,27 +1,43 @@
-from openai import AzureOpenAI
+import time
+import asyncio
+import logging
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from .AgentRegistration import AgentRegistration
 from .AgentSettings import AgentSettings
 from .ArgumentException import ArgumentExceptionError
 from .Models import ChatMessage
+from .Completions import create_completion, acreate_completion, create_stream
+from .RequestScheduler import ROUTING_PRIORITY
+from .Streaming import MESSAGES_EVENT, TOKEN_EVENT, iter_completion_text
 
 
 class AgentProxy:
     """This class is used to proxy the agent requests to the appropriate agent based on the intent."""
-    def __init__(self, settings=None, client=None, registered_agents: list[AgentRegistration] = None):
+    def __init__(self, settings=None, client=None, registered_agents: list[AgentRegistration] = None, router=None, async_client=None):
         self.settings = settings
         self.client = client
+        self.async_client = async_client
         self.registered_agents = registered_agents
+        # Optional local router (see IntentRouter) tried before the LLM
+        self.router = router
         if registered_agents is None:
             raise ArgumentExceptionError("Missing registered_agents")
         if settings is None:
             self.settings = AgentSettings()
         if client is None:
-            client = AzureOpenAI(
+            self.client = AzureOpenAI(
                 api_key=self.settings.api_key,
                 api_version=self.settings.api_version,
-                azure_endpoint=self.settings.api_endpoint)
+                azure_endpoint=self.settings.api_endpoint,
+                max_retries=0)
+        if async_client is None:
+            self.async_client = AsyncAzureOpenAI(
+                api_key=self.settings.api_key,
+                api_version=self.settings.api_version,
+                azure_endpoint=self.settings.api_endpoint,
+                max_retries=0)
 
-    def __semantic_intent(self, prompt: str) -> str:
+    def __intent_prompt(self, prompt: str) -> str:
         prompt_template = """system:
 You are an agent that can determine intent from the following list of intents and return the intent that best matches the user's question or statement.
 
@@ -38,30 +54,64 @@ Output in intent ONLY."""
         for reg_agent in self.registered_agents:
             intents += f"{reg_agent.intent}: {reg_agent.intent_desc}\n"
 
-        full_prompt = prompt_template.replace(
+        return prompt_template.replace(
             "<INTENTS>", intents).replace("<QUESTION>", prompt)
-        completion = self.client.chat.completions.create(
+
+    def __semantic_intent(self, prompt: str) -> str:
+        if self.router:
+            intent = self.router.route(prompt)
+            if intent:
+                return intent
+
+        start = time.perf_counter()
+        completion = create_completion(self.client, ROUTING_PRIORITY,
+            model=self.settings.gpt_model_deployment_name,
+            messages=[
+                {
+                    "role": "user",
+                    "content": self.__intent_prompt(prompt),
+                },
+            ],
+            max_tokens=2,
+            temperature=0.1
+        )
+        return self.__llm_intent(prompt, completion, start)
+
+    async def __asemantic_intent(self, prompt: str) -> str:
+        if self.router:
+            intent = self.router.route(prompt)
+            if intent:
+                return intent
+
+        start = time.perf_counter()
+        completion = await acreate_completion(self.async_client, ROUTING_PRIORITY,
             model=self.settings.gpt_model_deployment_name,
             messages=[
                 {
                     "role": "user",
-                    "content": full_prompt,
+                    "content": self.__intent_prompt(prompt),
                 },
             ],
             max_tokens=2,
             temperature=0.1
         )
+        return self.__llm_intent(prompt, completion, start)
+
+    def __llm_intent(self, prompt: str, completion, start: float) -> str:
         try:
             intent = completion.choices[0].message.content
-            return intent
         except:
-            return "Unknown"
+            intent = "Unknown"
+        if self.router:
+            known = intent == "OtherAgent" or any([reg_agent.intent == intent for reg_agent in self.registered_agents])
+            self.router.learn(prompt, intent if known else None, time.perf_counter() - start)
+        return intent
 
     def process(self, user_name, user_id, input: str) -> list:
         intent = self.__semantic_intent(input)
-        print(f'Intent: {intent}')
+        logging.info(f'Intent: {intent}')
         if intent is None or intent == "OtherAgent" or intent == "Unknown":
-            completion = self.client.chat.completions.create(
+            completion = create_completion(self.client,
                 model=self.settings.gpt_model_deployment_name,
                 messages=[
                     {
@@ -80,3 +130,62 @@ Output in intent ONLY."""
             for registered_agent in self.registered_agents:
                 if registered_agent.intent == intent:                    
                     return registered_agent.agent.process(user_name, user_id, input)
+
+    async def aprocess(self, user_name, user_id, input: str) -> list:
+        """Async version of process. Agents without an aprocess method run in the default executor."""
+        intent = await self.__asemantic_intent(input)
+        logging.info(f'Intent: {intent}')
+        if intent is None or intent == "OtherAgent" or intent == "Unknown":
+            completion = await acreate_completion(self.async_client,
+                model=self.settings.gpt_model_deployment_name,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": input,
+                    }
+                ]
+            )
+            result = str(completion.choices[0].message.content)
+            return [
+                ChatMessage(role='user',user_name=user_name,user_id=user_id,content=input,columns=[],rows=[]),
+                ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content=result,columns=[],rows=[])
+            ]
+        for registered_agent in self.registered_agents:
+            if registered_agent.intent == intent:
+                if hasattr(registered_agent.agent, "aprocess"):
+                    return await registered_agent.agent.aprocess(user_name, user_id, input)
+                return await asyncio.get_running_loop().run_in_executor(None, registered_agent.agent.process, user_name, user_id, input)
+
+    def process_stream(self, user_name, user_id, input: str):
+        """Streams the response of the agent selected for the intent.
+        Agents without a process_stream method are called with process and their messages are yielded at the end.
+        yields:
+            (TOKEN_EVENT, str) for each token and (MESSAGES_EVENT, list) with the ChatMessage objects at the end"""
+        intent = self.__semantic_intent(input)
+        logging.info(f'Intent: {intent}')
+        if intent is None or intent == "OtherAgent" or intent == "Unknown":
+            stream = create_stream(self.client,
+                model=self.settings.gpt_model_deployment_name,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": input,
+                    }
+                ]
+            )
+            tokens = []
+            for token in iter_completion_text(stream):
+                tokens.append(token)
+                yield TOKEN_EVENT, token
+            yield MESSAGES_EVENT, [
+                ChatMessage(role='user',user_name=user_name,user_id=user_id,content=input,columns=[],rows=[]),
+                ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content="".join(tokens),columns=[],rows=[])
+            ]
+            return
+        for registered_agent in self.registered_agents:
+            if registered_agent.intent == intent:
+                if hasattr(registered_agent.agent, "process_stream"):
+                    yield from registered_agent.agent.process_stream(user_name, user_id, input)
+                else:
+                    yield MESSAGES_EVENT, registered_agent.agent.process(user_name, user_id, input)
+                return
@@ -6,12 +6,15 @@ from .Models import BaseAgent
 
 class AgentRegistration:
     """This class is used to register an agent with the proxy."""
-    def __init__(self, settings=None, client=None, intent: str = None, intent_desc: str = None, agent: BaseAgent = None):
+    def __init__(self, settings=None, client=None, intent: str = None, intent_desc: str = None, agent: BaseAgent = None, examples: list[str] = None, keywords: list[str] = None):
         self.settings = settings
         self.client = client
         self.agent = agent
         self.intent = intent
         self.intent_desc = intent_desc
+        # Example utterances and keywords used by the local IntentRouter
+        self.examples = examples or []
+        self.keywords = keywords or []
 
         if intent is None:
             raise ArgumentExceptionError("intent parameter is missing")
@@ -23,4 +26,5 @@ class AgentRegistration:
             client = AzureOpenAI(
                 api_key=self.settings.api_key,
                 api_version=self.settings.api_version,
-                azure_endpoint=self.settings.api_endpoint)
+                azure_endpoint=self.settings.api_endpoint,
+                max_retries=0)
@@ -15,3 +15,16 @@ class AgentSettings:
         self.aisearch_endpoint = os.getenv("AISEARCH_ENDPOINT")
         self.aisearch_apikey = os.getenv("AISEARCH_APIKEY")
         self.aisearch_semantic_configuration = os.getenv("AISEARCH_SEMANTIC_CONFIG")
+        self.aisearch_timeout = float(os.getenv("AISEARCH_TIMEOUT") or 10)
+        self.aisearch_retries = int(os.getenv("AISEARCH_RETRIES") or 3)
+        self.aisearch_cache_size = int(os.getenv("AISEARCH_CACHE_SIZE") or 256)
+        self.aisearch_cache_ttl = float(os.getenv("AISEARCH_CACHE_TTL") or 300)
+        self.rag_context_tokens = int(os.getenv("RAG_CONTEXT_TOKENS") or 1500)
+        self.rag_search_candidates = int(os.getenv("RAG_SEARCH_CANDIDATES") or 8)
+        self.rag_min_reranker_score = float(os.getenv("RAG_MIN_RERANKER_SCORE") or 0)
+        self.assistant_run_timeout = float(os.getenv("ASSISTANT_RUN_TIMEOUT") or 120)
+        self.assistant_poll_interval = float(os.getenv("ASSISTANT_POLL_INTERVAL") or 0.2)
+        self.assistant_max_poll_interval = float(os.getenv("ASSISTANT_MAX_POLL_INTERVAL") or 2)
+        self.openai_tpm = int(os.getenv("OPENAI_TPM") or 0)
+        self.openai_rpm = int(os.getenv("OPENAI_RPM") or 0)
+        self.openai_max_retries = int(os.getenv("OPENAI_MAX_RETRIES") or 5)
@@ -1,13 +1,16 @@
 from typing import Iterable
 import os
 import uuid
+import hashlib
 import time
+import asyncio
 import logging
 from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from openai.types.beta.assistant import Assistant
 from openai.types.beta.threads.text_content_block import TextContentBlock
 from openai.types.beta.threads.image_file_content_block import ImageFileContentBlock
@@ -17,11 +20,19 @@ from openai.types import FileObject
 from .AgentSettings import AgentSettings
 from .ArgumentException import ArgumentExceptionError
 from .Models import ChatMessage
+from .Completions import scheduler, DEFAULT_COMPLETION_TOKENS
+from .RequestScheduler import ASSISTANT_PRIORITY
+from .Tokens import estimate_tokens
+
+# a run in one of these states will not change anymore
+RUN_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# the events stream stops at these states, requires_action waits for a tool output
+RUN_STOPPED_STATUSES = RUN_FINAL_STATUSES + ("requires_action",)
 
 
 class AssistantAgent:
     """This class is used to create an assistant agent."""
-    def __init__(self, settings:AgentSettings, client:AzureOpenAI, name :str, instructions:str, data_folder:str, tools_list: list, keep_state: bool = False, fn_calling_delegate=None, assistant=None):
+    def __init__(self, settings:AgentSettings, client:AzureOpenAI, name :str, instructions:str, data_folder:str, tools_list: list, keep_state: bool = False, fn_calling_delegate=None, assistant=None, async_client:AsyncAzureOpenAI=None, file_sync=None, thread_cleanup=None, download_workers: int = 4, image_store=None):
         if name is None:
             raise ArgumentExceptionError("name parameter missing")
         if instructions is None:
@@ -31,17 +42,36 @@ class AssistantAgent:
         self.assistant :Assistant = assistant
         self.settings : AgentSettings= settings
         self.client : AzureOpenAI = client
+        if async_client is None:
+            async_client = AsyncAzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
+        self.async_client : AsyncAzureOpenAI = async_client
         self.name = name
         self.instructions = instructions
         self.data_folder = data_folder
         self.tools_list = tools_list
         self.fn_calling_delegate = fn_calling_delegate
         self.keep_state = keep_state
+        # Optional FileSync that uploads only new or changed data files
+        self.file_sync = file_sync
+        # Optional ThreadCleanup queue that deletes the threads in the background
+        self.thread_cleanup = thread_cleanup
+        self.download_workers = download_workers
+        # Optional ImageStore that keeps the chart images within a size and age budget
+        self.image_store = image_store
         self.ai_threads = []
         self.ai_files = []
         self.file_ids = []
         self.get_agent()
 
+    @staticmethod
+    def __call(fn):
+        """Sends an Assistants API request through the scheduler, behind the routing and chat requests."""
+        return scheduler.call(ASSISTANT_PRIORITY, 0, fn)
+
+    @staticmethod
+    async def __acall(fn):
+        return await scheduler.acall(ASSISTANT_PRIORITY, 0, fn)
+
     def upload_file(self, path: str) -> FileObject:
         """Uploads a file to the assistant.
            Args:
@@ -50,14 +80,22 @@ class AssistantAgent:
 
         """
         logging.info(f"Uploading file: {path}")            
-        with Path(path).open("rb") as f:
-            return self.client.files.create(file=f, purpose="assistants")
+        def create():
+            # opened for each attempt, a retried upload sends the whole file again
+            with Path(path).open("rb") as f:
+                return self.client.files.create(file=f, purpose="assistants")
+        return self.__call(create)
 
     def upload_all_files(self):
         """Uploads all files in the data folder to the assistant.
            Args:
               data_folder (str): The path to the data folder.
         """
+        if self.file_sync is not None:
+            # the synced files are shared, so they are not added to ai_files and cleanup keeps them
+            self.file_ids = self.file_sync.sync(self.data_folder)
+            return
+
         files_in_folder = os.listdir(self.data_folder)
         local_file_list = []
 
@@ -84,38 +122,195 @@ class AssistantAgent:
         
         if self.data_folder is not None:
             self.upload_all_files()
-            self.assistant = self.client.beta.assistants.create(
-                name=self.name,  # "Sales Assistant",
-                # "You are a sales assistant. You can answer questions related to customer orders.",
-                instructions=self.instructions,                
-                model=self.settings.gpt_model_deployment_name,
-                tools=self.tools_list,
-                file_ids=self.file_ids,
-            )
+            try:
+                self.assistant = self.__create_with_files()
+            except Exception as e:
+                if self.file_sync is None:
+                    raise
+                # a file in the manifest may have been deleted remotely, upload everything again
+                logging.warning(f"Error creating the assistant with the synced files, uploading them again: {str(e)}")
+                self.file_sync.clear()
+                self.upload_all_files()
+                self.assistant = self.__create_with_files()
         else:
-            self.assistant = self.client.beta.assistants.create(
+            self.assistant = self.__call(lambda: self.client.beta.assistants.create(
                 name=self.name,  # "Sales Assistant",
                 # "You are a sales assistant. You can answer questions related to customer orders.",
                 instructions=self.instructions,
                 tools=self.tools_list,
                 model=self.settings.gpt_model_deployment_name
-            )
+            ))
+
+    def __create_with_files(self) -> Assistant:
+        return self.__call(lambda: self.client.beta.assistants.create(
+            name=self.name,  # "Sales Assistant",
+            # "You are a sales assistant. You can answer questions related to customer orders.",
+            instructions=self.instructions,
+            model=self.settings.gpt_model_deployment_name,
+            tools=self.tools_list,
+            file_ids=self.file_ids,
+        ))
 
     def delete_thread(self,thread_id:str):
-        """Deletes a thread.
+        """Deletes a thread, in the background when a thread_cleanup queue is set.
            Args:
               thread_id (str): The ID of the thread to delete.
         """
         if not self.keep_state:
+            if self.thread_cleanup is not None:
+                self.thread_cleanup.delete(thread_id)
+                return
             try:
                 logging.info(f"Deleted thread: {thread_id}")
-                self.client.beta.threads.delete(thread_id)
+                self.__call(lambda: self.client.beta.threads.delete(thread_id))
             except:
                 pass            
 
 
+    async def __adelete_thread(self, thread_id: str):
+        if self.thread_cleanup is not None:
+            self.delete_thread(thread_id)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.delete_thread, thread_id)
+
+    def __instructions(self) -> str:
+        return "The current date and time is: " + datetime.now().strftime("%x %X") + "."
+
+    def __cancel_run(self, thread_id: str, run):
+        logging.warning(f"Run {run.id} did not finish in {self.settings.assistant_run_timeout}s, cancelling it")
+        try:
+            return self.__call(lambda: self.client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id))
+        except Exception as e:
+            logging.error(f"Error cancelling run {run.id}: {str(e)}")
+            return run
+
+    async def __acancel_run(self, thread_id: str, run):
+        logging.warning(f"Run {run.id} did not finish in {self.settings.assistant_run_timeout}s, cancelling it")
+        try:
+            return await self.__acall(lambda: self.async_client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id))
+        except Exception as e:
+            logging.error(f"Error cancelling run {run.id}: {str(e)}")
+            return run
+
+    def __stream_run(self, thread_id: str, deadline: float):
+        """Creates a run and follows its events until it stops or needs a tool output.
+           When the stream fails after the run was created the run is looked up, so it can be polled.
+           Returns:
+              Run: The last run seen, or None if the stream did not create a run.
+        """
+        run = None
+        try:
+            with self.client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=self.assistant.id,
+                instructions=self.__instructions(),
+                timeout=max(deadline - time.monotonic(), 1),
+            ) as stream:
+                for event in stream:
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                        run = event.data
+                        if run.status in RUN_STOPPED_STATUSES:
+                            break
+                    if time.monotonic() >= deadline:
+                        break
+        except Exception as e:
+            logging.warning(f"Run events stream stopped, polling instead: {str(e)}")
+            run = self.__created_run(thread_id, run)
+        return run
+
+    def __created_run(self, thread_id: str, run):
+        """Finds the run a failed stream created, so it is polled instead of creating a second run on the thread.
+           Returns:
+              Run: The run, or None if the stream did not create one.
+        """
+        try:
+            if run is not None:
+                return self.__call(lambda: self.client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id))
+            # the stream can fail before the thread.run.created event arrives, the thread is new so any run is ours
+            runs = self.__call(lambda: self.client.beta.threads.runs.list(thread_id=thread_id, limit=1))
+            return runs.data[0] if runs.data else None
+        except Exception as e:
+            logging.error(f"Error looking up the run of thread {thread_id}: {str(e)}")
+            return run
+
+    async def __acreated_run(self, thread_id: str, run):
+        """Async version of __created_run."""
+        try:
+            if run is not None:
+                return await self.__acall(lambda: self.async_client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id))
+            runs = await self.__acall(lambda: self.async_client.beta.threads.runs.list(thread_id=thread_id, limit=1))
+            return runs.data[0] if runs.data else None
+        except Exception as e:
+            logging.error(f"Error looking up the run of thread {thread_id}: {str(e)}")
+            return run
+
+    async def __astream_run(self, thread_id: str, deadline: float):
+        """Async version of __stream_run."""
+        run = None
+        try:
+            async with self.async_client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=self.assistant.id,
+                instructions=self.__instructions(),
+                timeout=max(deadline - time.monotonic(), 1),
+            ) as stream:
+                async for event in stream:
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                        run = event.data
+                        if run.status in RUN_STOPPED_STATUSES:
+                            break
+                    if time.monotonic() >= deadline:
+                        break
+        except Exception as e:
+            logging.warning(f"Run events stream stopped, polling instead: {str(e)}")
+            run = await self.__acreated_run(thread_id, run)
+        return run
+
+    def wait_for_run(self, thread, run, deadline: float):
+        """Waits for a run to finish, polling with a backoff that starts at assistant_poll_interval.
+           Runs that need a tool output are handed to fn_calling_delegate, runs past the deadline are cancelled.
+           Returns:
+              Run: The finished run.
+        """
+        interval = self.settings.assistant_poll_interval
+        while run.status not in RUN_FINAL_STATUSES:
+            if time.monotonic() >= deadline:
+                return self.__cancel_run(thread.id, run)
+            if run.status == "requires_action":
+                if not self.fn_calling_delegate:
+                    logging.error(f"Run {run.id} requires an action and there is no fn_calling_delegate")
+                    return self.__cancel_run(thread.id, run)
+                self.fn_calling_delegate(self.client, thread, run)
+                interval = self.settings.assistant_poll_interval
+            else:
+                time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+                interval = min(interval * 1.5, self.settings.assistant_max_poll_interval)
+            run = self.__call(lambda: self.client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id))
+        return run
+
+    async def await_for_run(self, thread, run, deadline: float):
+        """Async version of wait_for_run. The fn_calling_delegate runs in the default executor."""
+        loop = asyncio.get_running_loop()
+        interval = self.settings.assistant_poll_interval
+        while run.status not in RUN_FINAL_STATUSES:
+            if time.monotonic() >= deadline:
+                return await self.__acancel_run(thread.id, run)
+            if run.status == "requires_action":
+                if not self.fn_calling_delegate:
+                    logging.error(f"Run {run.id} requires an action and there is no fn_calling_delegate")
+                    return await self.__acancel_run(thread.id, run)
+                await loop.run_in_executor(None, self.fn_calling_delegate, self.client, thread, run)
+                interval = self.settings.assistant_poll_interval
+            else:
+                await asyncio.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+                interval = min(interval * 1.5, self.settings.assistant_max_poll_interval)
+            run = await self.__acall(lambda: self.async_client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id))
+        return run
+
     def process(self, user_name: str, user_id: str, prompt: str) -> list:
         """Processes a prompt with the assistant.
+           The run is followed with the run events stream, the poller is only used after a tool call
+           or when the stream is not available.
            Args:
               user_name (str): The name of the user.
               user_id (str): The ID of the user.
@@ -123,52 +318,64 @@ class AssistantAgent:
            Returns:
               list: The messages from the assistant.
         """
-        thread = self.client.beta.threads.create()
-
-        self.client.beta.threads.messages.create(
-            thread_id=thread.id, role="user", content=prompt)
-
-        run = self.client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=self.assistant.id,
-            instructions= "The current date and time is: " + datetime.now().strftime("%x %X") + ".",
-        )
-
-        #print("processing ...")
-        while True:
-            run = self.client.beta.threads.runs.retrieve(
-                thread_id=thread.id, run_id=run.id)
-            if run.status == "completed":
-                # Handle completed
-                messages = self.client.beta.threads.messages.list(
-                    thread_id=thread.id)
-                items= self.print_messages(user_name, messages)                
-                self.delete_thread(thread.id)
-                return items
-            if run.status == "failed":
-                messages = self.client.beta.threads.messages.list(
-                    thread_id=thread.id)
-                items = self.print_messages(user_name, messages)
-                self.delete_thread(thread.id)
-                return items
-                # Handle failed                
-            if run.status == "expired":
-                # Handle expired
-                self.delete_thread(thread.id)
-                return
-            if run.status == "cancelled":
-                # Handle cancelled
-                self.delete_thread(thread.id)
-                return
-            if run.status == "requires_action":
-                if self.fn_calling_delegate:
-                    self.fn_calling_delegate(self.client, thread, run)
-            else:
-                time.sleep(5)
+        deadline = time.monotonic() + self.settings.assistant_run_timeout
+        thread = self.__call(self.client.beta.threads.create)
 
-        if not self.keep_state:
-            self.client.beta.threads.delete(thread.id)
-            print("Deleted thread: ", thread.id)
+        self.__call(lambda: self.client.beta.threads.messages.create(
+            thread_id=thread.id, role="user", content=prompt))
+
+        # runs wait behind the routing and chat requests when the rate limits are reached,
+        # the run is admitted once, the fallback create is the same request
+        tokens = estimate_tokens(prompt) + DEFAULT_COMPLETION_TOKENS
+        scheduler.admit(ASSISTANT_PRIORITY, tokens)
+        run = self.__stream_run(thread.id, deadline)
+        if run is None:
+            run = self.client.beta.threads.runs.create(
+                thread_id=thread.id,
+                assistant_id=self.assistant.id,
+                instructions=self.__instructions(),
+            )
+        run = self.wait_for_run(thread, run, deadline)
+
+        if run.status == "completed" or run.status == "failed":
+            messages = self.__call(lambda: self.client.beta.threads.messages.list(
+                thread_id=thread.id))
+            items = self.print_messages(user_name, messages)
+            self.delete_thread(thread.id)
+            return items
+        # expired or cancelled
+        self.delete_thread(thread.id)
+
+    async def aprocess(self, user_name: str, user_id: str, prompt: str) -> list:
+        """Async version of process using the AsyncAzureOpenAI client.
+        The file downloads and the thread deletion without a thread_cleanup queue run in the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.settings.assistant_run_timeout
+        thread = await self.__acall(self.async_client.beta.threads.create)
+
+        await self.__acall(lambda: self.async_client.beta.threads.messages.create(
+            thread_id=thread.id, role="user", content=prompt))
+
+        tokens = estimate_tokens(prompt) + DEFAULT_COMPLETION_TOKENS
+        await scheduler.aadmit(ASSISTANT_PRIORITY, tokens)
+        run = await self.__astream_run(thread.id, deadline)
+        if run is None:
+            run = await self.async_client.beta.threads.runs.create(
+                thread_id=thread.id,
+                assistant_id=self.assistant.id,
+                instructions=self.__instructions(),
+            )
+        run = await self.await_for_run(thread, run, deadline)
+
+        if run.status == "completed" or run.status == "failed":
+            messages = await self.__acall(lambda: self.async_client.beta.threads.messages.list(
+                thread_id=thread.id))
+            items = await loop.run_in_executor(None, self.print_messages, user_name, messages.data)
+            await self.__adelete_thread(thread.id)
+            return items
+        # expired or cancelled
+        await self.__adelete_thread(thread.id)
 
     def read_assistant_file(self, file_id: str):
         """Reads the content of a file from the assistant.
@@ -177,11 +384,50 @@ class AssistantAgent:
            Returns:
               bytes: The content of the file.
         """
-        response_content = self.client.files.content(file_id)
+        response_content = self.__call(lambda: self.client.files.content(file_id))
         return response_content.read()
 
+    def download_files(self, file_ids: list[str]) -> dict:
+        """Reads the content of several files from the assistant concurrently.
+           Args:
+              file_ids (list[str]): The IDs of the files to read.
+           Returns:
+              dict: The content of each file by ID.
+        """
+        file_ids = list(dict.fromkeys(file_ids))
+        if len(file_ids) <= 1:
+            return {file_id: self.read_assistant_file(file_id) for file_id in file_ids}
+        with ThreadPoolExecutor(max_workers=min(len(file_ids), self.download_workers)) as executor:
+            return dict(zip(file_ids, executor.map(self.read_assistant_file, file_ids)))
+
+    def save_image(self, data_in_bytes: bytes) -> str:
+        """Saves an image named after its content, so the same chart is stored once.
+           Args:
+              data_in_bytes (bytes): The PNG image.
+           Returns:
+              str: The URL of the image.
+        """
+        if self.image_store is not None:
+            return self.image_store.save(data_in_bytes)
+
+        # create a folder if it does not exit
+        image_folder_path = "wwwroot/images"
+        if not os.path.exists(image_folder_path):
+            os.makedirs(image_folder_path)
+
+        file_name = hashlib.sha256(data_in_bytes).hexdigest() + ".png"
+        fullFilePath = os.path.join(image_folder_path, file_name)
+        if not os.path.exists(fullFilePath):
+            temp_path = f"{fullFilePath}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data_in_bytes)
+            os.replace(temp_path, fullFilePath)
+
+        return f"/images/{file_name}"
+
     def print_messages(self, name: str, messages: Iterable[any]) -> list:
         """Prints the messages from the assistant.
+           The images and annotation files of the messages are downloaded concurrently.
            Args:
               messages (Iterable[MessageFile]): The messages from the assistant.
         """
@@ -197,6 +443,15 @@ class AssistantAgent:
         message_list.reverse()
         output_list = []
 
+        file_ids = []
+        for message in message_list:
+            for item in message.content:
+                if isinstance(item, TextContentBlock):
+                    file_ids += [annotation.file_path.file_id for annotation in item.text.annotations or [] if getattr(annotation, "file_path", None)]
+                elif isinstance(item, ImageFileContentBlock):
+                    file_ids.append(item.image_file.file_id)
+        files = self.download_files(file_ids)
+
         # Print the user or Assistant messages or images
         for message in message_list:
             for item in message.content:
@@ -214,31 +469,11 @@ class AssistantAgent:
                     file_annotations = item.text.annotations
                     if file_annotations:
                         for annotation in file_annotations:
-                            file_id = annotation.file_path.file_id
-                            content = self.read_assistant_file(file_id)
-                            print(f"Annotation Content:\n{str(content)}\n")
+                            if getattr(annotation, "file_path", None):
+                                content = files[annotation.file_path.file_id]
+                                print(f"Annotation Content:\n{str(content)}\n")
                 elif isinstance(item, ImageFileContentBlock):
-                    # Retrieve image from file id
-                    data_in_bytes = self.read_assistant_file(
-                        item.image_file.file_id)
-                    # Convert bytes to image
-                    #readable_buffer = io.BytesIO(data_in_bytes)
-                    # write bytes to file
-
-                    # create a folder if it does not exit
-                    image_folder_path = "wwwroot/images"
-                    if not os.path.exists(image_folder_path):
-                        os.makedirs(image_folder_path)
-
-                    # create a file
-                    file_name = uuid.uuid4().hex + ".png"
-                    fullFilePath = os.path.join(image_folder_path, file_name)
-                    
-                    with open(fullFilePath, "wb") as f:
-                        f.write(data_in_bytes)
-
-                    url_content = f"/images/{file_name}"
-                    
+                    url_content = self.save_image(files[item.image_file.file_id])
                     output_list.append(ChatMessage(role='image', user_name='', user_id='', content=url_content, columns=[], rows=[]))
 
         return output_list
@@ -0,0 +1,56 @@
+import json
+import hashlib
+
+from singleflight import SingleFlight
+from .AgentSettings import AgentSettings
+from .RequestScheduler import RequestScheduler, CHAT_PRIORITY
+from .Tokens import estimate_tokens
+
+# identical completion requests running at the same time share one call
+completion_flight = SingleFlight("completions")
+
+# every Azure OpenAI request of the agents goes through this scheduler
+scheduler = RequestScheduler.from_settings(AgentSettings())
+
+# completion tokens counted when a request sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+
+def completion_key(**kwargs) -> str:
+    return hashlib.sha256(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def estimate_request_tokens(**kwargs) -> int:
+    """Estimates the prompt and completion tokens of a chat completion request."""
+    prompt = sum([estimate_tokens(message.get("content") or "") for message in kwargs.get("messages", [])])
+    return prompt + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+def _settle(tokens: int, completion):
+    usage = getattr(completion, "usage", None)
+    if usage is not None and usage.total_tokens:
+        scheduler.settle(tokens, usage.total_tokens)
+    return completion
+
+
+def create_completion(client, priority: int = CHAT_PRIORITY, **kwargs):
+    """Calls client.chat.completions.create through the scheduler, coalescing identical concurrent requests.
+    Coalesced callers do not use the rate limits."""
+    tokens = estimate_request_tokens(**kwargs)
+    return completion_flight.do(completion_key(**kwargs), lambda: _settle(tokens, scheduler.call(
+        priority, tokens, lambda: client.chat.completions.create(**kwargs))))
+
+
+async def acreate_completion(async_client, priority: int = CHAT_PRIORITY, **kwargs):
+    """Async version of create_completion."""
+    tokens = estimate_request_tokens(**kwargs)
+
+    async def call():
+        return _settle(tokens, await scheduler.acall(priority, tokens, lambda: async_client.chat.completions.create(**kwargs)))
+
+    return await completion_flight.ado(completion_key(**kwargs), call)
+
+
+def create_stream(client, priority: int = CHAT_PRIORITY, **kwargs):
+    """Calls client.chat.completions.create with stream=True through the scheduler, streams are not coalesced."""
+    return scheduler.call(priority, estimate_request_tokens(**kwargs), lambda: client.chat.completions.create(stream=True, **kwargs))
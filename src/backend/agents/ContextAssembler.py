@@ -0,0 +1,48 @@
+import logging
+
+from .Models import AISearchResult
+from .Tokens import estimate_tokens
+
+
+class ContextAssembler:
+    """Packs the best AI Search chunks into a token budget.
+
+    Chunks are taken in reranker score order, at most per_parent chunks of the same
+    parent document, and a chunk that does not fit the remaining budget is skipped so a
+    smaller one further down can still be used.
+    """
+    def __init__(self, token_budget: int = 1500, max_chunks: int = 5, min_score: float = 0.0, per_parent: int = 1):
+        self.token_budget = token_budget
+        self.max_chunks = max_chunks
+        self.min_score = min_score
+        self.per_parent = per_parent
+
+    @staticmethod
+    def format(result: AISearchResult) -> str:
+        return f"[{result.title}]\n{result.chunk}\n"
+
+    def select(self, results: list[AISearchResult]) -> list[AISearchResult]:
+        """Returns the chunks that go in the context, best first."""
+        ranked = sorted(results, key=lambda result: result.rerankerScore or 0.0, reverse=True)
+        selected = []
+        parents = {}
+        used = 0
+        for result in ranked:
+            if len(selected) >= self.max_chunks:
+                break
+            if (result.rerankerScore or 0.0) < self.min_score:
+                break
+            if parents.get(result.parent_id, 0) >= self.per_parent:
+                continue
+            tokens = estimate_tokens(self.format(result))
+            if used + tokens > self.token_budget:
+                continue
+            selected.append(result)
+            parents[result.parent_id] = parents.get(result.parent_id, 0) + 1
+            used += tokens
+        logging.info(f"Context assembled from {len(selected)} of {len(results)} chunks, {used} of {self.token_budget} tokens")
+        return selected
+
+    def assemble(self, results: list[AISearchResult]) -> str:
+        """Builds the context text from the selected chunks."""
+        return "\n".join([self.format(result) for result in self.select(results)])
@@ -0,0 +1,128 @@
+import math
+import logging
+import threading
+from collections import Counter
+
+from .Tokens import estimate_tokens, terms
+
+
+class ContextSelector:
+    """Selects the context rows relevant to a question within a token budget.
+
+    The text values of each row (names, cities, categories, models, descriptions) are indexed
+    locally. Rows that share terms with the question go first, best match first, then the
+    budget is filled with the leading rows of the tables the question is about, which are
+    the top customers and products by total. The index is rebuilt only when the tables change.
+    """
+    def __init__(self, get_tables, token_budget: int = 1500, full_context: bool = False):
+        """args:
+            get_tables: returns a list of (title, {'columns', 'rows'}) tuples
+            token_budget: the tokens of context sent with the question
+            full_context: send the full context, used to compare answers
+        """
+        self.get_tables = get_tables
+        self.token_budget = token_budget
+        self.full_context = full_context
+        self._lock = threading.Lock()
+        self._tables = None
+        self._index = []
+        self._idf = {}
+        self._selections = 0
+        self._full_tokens = 0
+        self._selected_tokens = 0
+
+    @staticmethod
+    def __row_line(keys: list, row: dict) -> str:
+        return ",".join([str(row[key]) for key in keys])
+
+    def __build(self, tables: list):
+        """Indexes the text values of every row and the column names of every table."""
+        index = []
+        frequencies = Counter()
+        for title, colsandrows in tables:
+            keys = [column['key'] for column in colsandrows['columns']]
+            table_terms = set(terms(title + " " + " ".join(keys)))
+            rows = []
+            for row in colsandrows['rows']:
+                row_terms = set(terms(" ".join([str(value) for value in row.values() if isinstance(value, str)])))
+                frequencies.update(row_terms)
+                rows.append((self.__row_line(keys, row), row_terms))
+            index.append((title, ",".join(keys), table_terms, rows))
+        documents = sum([len(rows) for _, _, _, rows in index]) or 1
+        self._idf = {term: math.log((1 + documents) / (1 + count)) + 1 for term, count in frequencies.items()}
+        self._index = index
+
+    def __current_index(self, tables: list = None) -> list:
+        if tables is None:
+            tables = self.get_tables()
+        with self._lock:
+            # the snapshot hands back the same row objects until the data changes
+            if self._tables is None or len(tables) != len(self._tables) or any(new[1] is not old[1] for new, old in zip(tables, self._tables)):
+                self.__build(tables)
+                self._tables = tables
+            return self._index, self._idf
+
+    def select(self, question: str, context: str = "", tables: list = None) -> str:
+        """Builds the CSV context for a question with the relevant rows only.
+        args:
+            question: the question
+            context: the full context, returned as is in full_context mode
+            tables: the tables to select from instead of get_tables(), to answer several questions from the same snapshot
+        returns:
+            the selected context"""
+        if self.full_context:
+            return context
+        index, idf = self.__current_index(tables)
+        question_terms = set(terms(question))
+
+        # tables the question names, or all tables when it names none
+        about_numbers = [number for number, table in enumerate(index) if table[2] & question_terms] or list(range(len(index)))
+        scored = []
+        for table_number, (title, header, table_terms, rows) in enumerate(index):
+            for row_number, (line, row_terms) in enumerate(rows):
+                score = sum([idf.get(term, 0.0) for term in row_terms & question_terms])
+                if score > 0:
+                    scored.append((score, table_number, row_number))
+        scored.sort(key=lambda item: (-item[0], item[1], item[2]))
+
+        used = 0
+        selected = {table_number: set() for table_number in range(len(index))}
+        candidates = [(table_number, row_number) for _, table_number, row_number in scored]
+        # then the leading rows of the tables the question is about, in turns
+        longest = max([len(index[number][3]) for number in about_numbers] or [0])
+        candidates += [(number, row_number) for row_number in range(longest) for number in about_numbers if row_number < len(index[number][3])]
+        for table_number, row_number in candidates:
+            if row_number in selected[table_number]:
+                continue
+            tokens = estimate_tokens(index[table_number][3][row_number][0]) + 1
+            if not selected[table_number]:
+                title, header, _, _ = index[table_number]
+                tokens += estimate_tokens(f"{title}\n{header}\n")
+            if used + tokens > self.token_budget:
+                break
+            selected[table_number].add(row_number)
+            used += tokens
+
+        blocks = []
+        for table_number, (title, header, _, rows) in enumerate(index):
+            if selected[table_number]:
+                lines = [title, header] + [rows[row_number][0] for row_number in sorted(selected[table_number])]
+                blocks.append("\n".join(lines) + "\n")
+        text = "".join(blocks)
+
+        full_tokens = estimate_tokens(context) if context else 0
+        selected_tokens = estimate_tokens(text)
+        with self._lock:
+            self._selections += 1
+            self._full_tokens += full_tokens
+            self._selected_tokens += selected_tokens
+        logging.info(f"Selected {sum([len(rows) for rows in selected.values()])} context rows, {selected_tokens} tokens instead of {full_tokens}")
+        return text
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'selections': self._selections,
+                'avgSelectedTokens': round(self._selected_tokens / self._selections) if self._selections else 0,
+                'avgFullTokens': round(self._full_tokens / self._selections) if self._selections else 0,
+            }
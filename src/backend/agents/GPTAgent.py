@@ -1,20 +1,27 @@
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from .AgentSettings import AgentSettings
 from .Models import ChatMessage
+from .Completions import create_completion, acreate_completion, create_stream
+from .Streaming import MESSAGES_EVENT, TOKEN_EVENT, iter_completion_text
 #import database as rep
 
 class GPTAgent:
     """This class is used to connect to a GPT model to submit a Prompt for Completion."""
-    def __init__(self, settings = None, client = None):
+    def __init__(self, settings = None, client = None, async_client = None):
         if settings is None:
             settings = AgentSettings()
         if client is None:
-            client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version)
+            client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
+        if async_client is None:
+            async_client = AsyncAzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
         self.settings : AgentSettings = settings
         self.client : AzureOpenAI = client
+        self.async_client : AsyncAzureOpenAI = async_client
         self.get_context_delegate = None
+        # Optional ContextSelector that keeps only the context rows relevant to the prompt
+        self.context_selector = None
 
-    def process(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str="") -> list:
+    def process(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str="",context_tables:list=None) -> list:
         """This method is used to process the prompt and return the completion.
         args:
             user_name: str - The name of the user
@@ -23,26 +30,14 @@ class GPTAgent:
             max_tokens: int - The max tokens to use in the completion
             temperature: float - The temperature to use in the completion
             context: str - The context to use in the completion
+            context_tables: list - The tables of the context, the context selector uses them instead of reading the snapshot
         returns:
             list - A list of ChatMessage objects"""
 
-        # Get the context from the delegate, mainly used in multiagent mode
-        if self.get_context_delegate:
-            context = self.get_context_delegate()
-
         # Get the completion
-        completion = self.client.chat.completions.create(
+        completion = create_completion(self.client,
                 model=self.settings.gpt_model_deployment_name,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an agent that can help answer questions about customers, products, and customer orders." ,
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt +"Text: \"\"\"" + context + "\"\"\"",
-                    }
-                ],
+                messages=self.__messages(prompt, context, context_tables),
                 max_tokens=max_tokens,
                 temperature=temperature
             )
@@ -54,4 +49,56 @@ class GPTAgent:
             ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content=result,columns=[],rows=[])            
         ]
 
+    async def aprocess(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str="",context_tables:list=None) -> list:
+        """Async version of process using the AsyncAzureOpenAI client."""
+        completion = await acreate_completion(self.async_client,
+                model=self.settings.gpt_model_deployment_name,
+                messages=self.__messages(prompt, context, context_tables),
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+        result = str(completion.choices[0].message.content)
+        return [
+            ChatMessage(role='user',user_name=user_name,user_id=user_id,content=prompt,columns=[],rows=[]),
+            ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content=result,columns=[],rows=[])
+        ]
+
+    def process_stream(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str="",context_tables:list=None):
+        """This method is used to stream the completion as it is generated.
+        args:
+            same as process
+        yields:
+            (TOKEN_EVENT, str) for each token and (MESSAGES_EVENT, list) with the ChatMessage objects at the end"""
+        stream = create_stream(self.client,
+                model=self.settings.gpt_model_deployment_name,
+                messages=self.__messages(prompt, context, context_tables),
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+        tokens = []
+        for token in iter_completion_text(stream):
+            tokens.append(token)
+            yield TOKEN_EVENT, token
+        yield MESSAGES_EVENT, [
+            ChatMessage(role='user',user_name=user_name,user_id=user_id,content=prompt,columns=[],rows=[]),
+            ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content="".join(tokens),columns=[],rows=[])
+        ]
+
+    def __messages(self, prompt: str, context: str, context_tables: list = None) -> list:
+        # Get the context from the delegate, mainly used in multiagent mode
+        if self.get_context_delegate:
+            context = self.get_context_delegate()
+        if self.context_selector:
+            context = self.context_selector.select(prompt, context, context_tables)
+        return [
+            {
+                "role": "system",
+                "content": "You are an agent that can help answer questions about customers, products, and customer orders." ,
+            },
+            {
+                "role": "user",
+                "content": prompt +"Text: \"\"\"" + context + "\"\"\"",
+            }
+        ]
+
     
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+
+
+class ImageStore:
+    """Stores the chart images generated by the assistant within a size and age budget.
+
+    Images are named after the sha256 of their content. A small index file keeps the size
+    and last use of each image, so startup does not scan the folder, and the least recently
+    used images are evicted when the budget is exceeded.
+    """
+    def __init__(self, folder: str = "wwwroot/images", max_bytes: int = 200 * 1024 * 1024, max_age: float = 7 * 24 * 3600, index_name: str = ".index.json"):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.index_path = os.path.join(folder, index_name)
+        self._lock = threading.Lock()
+        self._index = {}
+        self._bytes = 0
+        self._writes = 0
+        self._hits = 0
+        self._evictions = 0
+        self._bytes_evicted = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.__load_index()
+        with self._lock:
+            self.__evict()
+            self.__save_index()
+
+    def __load_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            # drop the entries of files removed outside the store
+            self._index = {name: entry for name, entry in index.items() if os.path.exists(os.path.join(self.folder, name))}
+        except (OSError, ValueError):
+            logging.info(f"Rebuilding the image index of {self.folder}")
+            self._index = {}
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and entry.name.endswith(".png"):
+                    stat = entry.stat()
+                    self._index[entry.name] = {'size': stat.st_size, 'last_used': stat.st_mtime}
+        self._bytes = sum([entry['size'] for entry in self._index.values()])
+
+    def __save_index(self):
+        temp_path = f"{self.index_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(temp_path, self.index_path)
+
+    def __remove(self, name: str):
+        entry = self._index.pop(name)
+        self._bytes -= entry['size']
+        self._evictions += 1
+        self._bytes_evicted += entry['size']
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            pass
+
+    def __evict(self, keep: str = None):
+        expired = time.time() - self.max_age
+        for name in [name for name, entry in self._index.items() if entry['last_used'] < expired and name != keep]:
+            self.__remove(name)
+        if self._bytes > self.max_bytes:
+            for name in sorted(self._index, key=lambda name: self._index[name]['last_used']):
+                if self._bytes <= self.max_bytes:
+                    break
+                if name != keep:
+                    self.__remove(name)
+
+    def save(self, data: bytes) -> str:
+        """Saves an image and returns its URL. A repeated image only refreshes its last use."""
+        name = hashlib.sha256(data).hexdigest() + ".png"
+        path = os.path.join(self.folder, name)
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is not None and os.path.exists(path):
+                self._hits += 1
+                entry['last_used'] = time.time()
+            else:
+                temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+                if entry is not None:
+                    self._bytes -= entry['size']
+                self._index[name] = {'size': len(data), 'last_used': time.time()}
+                self._bytes += len(data)
+                self._writes += 1
+                self.__evict(keep=name)
+            self.__save_index()
+        return f"/images/{name}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'files': len(self._index),
+                'bytesStored': self._bytes,
+                'maxBytes': self.max_bytes,
+                'writes': self._writes,
+                'hits': self._hits,
+                'evictions': self._evictions,
+                'bytesEvicted': self._bytes_evicted,
+            }
@@ -0,0 +1,144 @@
+import re
+import math
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+from .AgentRegistration import AgentRegistration
+from .Tokens import STOP_WORDS, terms
+
+# words like list or all tell a SQL request apart from a question
+# generic verbs and adjectives appear in any kind of request, off-topic ones included
+GENERIC_WORDS = {"write", "create", "generate", "make", "show", "best", "compose", "draft", "new", "good"}
+ROUTER_STOP_WORDS = (STOP_WORDS - {"list", "all", "get", "find", "many", "much"}) | GENERIC_WORDS
+
+
+class IntentRouter:
+    """Routes a prompt to an intent locally before falling back to the LLM.
+
+    The first stage matches the keywords of each registration, the second stage is a
+    nearest neighbour classifier over TF-IDF vectors of the example utterances and the
+    intent description of each registration. The second stage abstains unless the prompt
+    shares at least min_overlap domain terms with the nearest example, so off-topic prompts
+    fall through to the LLM. Decisions, including the ones made by the LLM, are cached per
+    normalized input.
+    """
+    def __init__(self, registered_agents: list[AgentRegistration], threshold: float = 0.35, margin: float = 0.05, cache_size: int = 1024, min_overlap: int = 2):
+        self.threshold = threshold
+        self.margin = margin
+        self.min_overlap = min_overlap
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.keyword_rules = {}
+        self.examples = []
+        for reg_agent in registered_agents:
+            if reg_agent.keywords:
+                self.keyword_rules[reg_agent.intent] = re.compile(
+                    r"\b(" + "|".join([re.escape(keyword) for keyword in reg_agent.keywords]) + r")\b", re.IGNORECASE)
+            for utterance in [reg_agent.intent_desc] + list(reg_agent.examples or []):
+                self.examples.append((reg_agent.intent, Counter(terms(utterance, ROUTER_STOP_WORDS))))
+        documents = len(self.examples)
+        frequencies = Counter()
+        for _, example_terms in self.examples:
+            frequencies.update(example_terms.keys())
+        self.idf = {term: math.log((1 + documents) / (1 + count)) + 1 for term, count in frequencies.items()}
+        self.vectors = [(intent, self.__vector(example_terms)) for intent, example_terms in self.examples]
+        # stats
+        self.cache_hits = 0
+        self.keyword_hits = 0
+        self.neighbour_hits = 0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+    @staticmethod
+    def normalize(prompt: str) -> str:
+        return " ".join(re.sub(r"[^\w\s]", " ", prompt.lower()).split())
+
+    def __vector(self, prompt_terms: Counter) -> dict:
+        vector = {term: count * self.idf.get(term, 0.0) for term, count in prompt_terms.items()}
+        norm = math.sqrt(sum([value * value for value in vector.values()]))
+        return {term: value / norm for term, value in vector.items()} if norm else {}
+
+    def __nearest(self, prompt: str, candidates: set = None) -> tuple[str, float, float, int]:
+        """Returns the best intent, its similarity, the similarity of the runner up and
+        the number of terms the prompt shares with the nearest example of the best intent."""
+        query = self.__vector(Counter(terms(prompt, ROUTER_STOP_WORDS)))
+        best = {}
+        overlaps = {}
+        for intent, vector in self.vectors:
+            if candidates and intent not in candidates:
+                continue
+            score = sum([value * vector.get(term, 0.0) for term, value in query.items()])
+            if score > best.get(intent, 0.0) or intent not in best:
+                best[intent] = score
+                overlaps[intent] = len([term for term in query if term in vector])
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        if not ranked:
+            return None, 0.0, 0.0, 0
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return ranked[0][0], ranked[0][1], runner_up, overlaps[ranked[0][0]]
+
+    def __remember(self, key: str, intent: str):
+        with self._lock:
+            self._cache[key] = intent
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def route(self, prompt: str) -> str:
+        """Returns the intent for a prompt or None when the local stages are not confident."""
+        key = self.normalize(prompt)
+        with self._lock:
+            intent = self._cache.get(key)
+            if intent is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+        if intent is not None:
+            self.__log("cache", intent)
+            return intent
+
+        matched = {intent for intent, rule in self.keyword_rules.items() if rule.search(prompt)}
+        if len(matched) == 1:
+            intent = matched.pop()
+            with self._lock:
+                self.keyword_hits += 1
+            self.__remember(key, intent)
+            self.__log("keyword", intent)
+            return intent
+
+        intent, score, runner_up, overlap = self.__nearest(prompt, matched)
+        if intent is not None and score >= self.threshold and score - runner_up >= self.margin and overlap >= self.min_overlap:
+            with self._lock:
+                self.neighbour_hits += 1
+            self.__remember(key, intent)
+            self.__log(f"neighbour {score:.2f}", intent)
+            return intent
+        return None
+
+    def learn(self, prompt: str, intent: str, seconds: float):
+        """Records the decision made by the LLM and how long it took."""
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+        if intent:
+            self.__remember(self.normalize(prompt), intent)
+
+    def stats(self) -> dict:
+        with self._lock:
+            local = self.cache_hits + self.keyword_hits + self.neighbour_hits
+            total = local + self.llm_calls
+            avg_llm = self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+            return {
+                'cacheHits': self.cache_hits,
+                'keywordHits': self.keyword_hits,
+                'neighbourHits': self.neighbour_hits,
+                'llmCalls': self.llm_calls,
+                'hitRate': round(local / total, 4) if total else 0.0,
+                'avgLlmSeconds': round(avg_llm, 3),
+                'savedSeconds': round(local * avg_llm, 3),
+            }
+
+    def __log(self, stage: str, intent: str):
+        stats = self.stats()
+        logging.info(f"Routed to {intent} by {stage}, local hit rate {stats['hitRate']:.0%}, saved about {stats['savedSeconds']:.1f}s")
@@ -12,6 +12,8 @@ class BaseAgent:
         self.get_context_delegate
     def process(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str=None) -> list:
         pass
+    async def aprocess(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str=None) -> list:
+        pass
 class ChatRequest(BaseModel):
     user_name:str = 'user'
     user_id: str = 'user'
@@ -19,6 +21,10 @@ class ChatRequest(BaseModel):
     max_tokens: int = 500
     temperature: float = 0.3
 
+class BatchRequest(BaseModel):
+    mode: str = 'chatbot'
+    requests: list[ChatRequest]
+
 class ChatMessage(BaseModel):
     role:str
     user_name:str = ''
@@ -26,11 +32,14 @@ class ChatMessage(BaseModel):
     content:str
     columns:list = []
     rows:list = []
+    truncated:bool = False
+    error:str|None = None
+    is_sql:bool = False
 
 class AISearchResult:
     def __init__(self, row:dict):
         self.searchScore = row['@search.score']
-        self.rerankerScore = row['@search.rerankerScore']
+        self.rerankerScore = row.get('@search.rerankerScore')
         self.ckunk_id = row['chunk_id']
         self.parent_id = row['parent_id']
         self.chunk = row['chunk']
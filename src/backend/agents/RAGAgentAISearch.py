@@ -1,55 +1,128 @@
 import json
 import os
+import hashlib
+import logging
+import asyncio
+import tempfile
 import requests
-import database as rep
+from datetime import datetime
 
-from openai import AzureOpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ttlcache import TTLCache
+
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from .AgentSettings import AgentSettings
 from .Models import AISearchResult, ChatMessage
+from .Completions import create_completion, acreate_completion, create_stream
+from .ContextAssembler import ContextAssembler
+from .Streaming import MESSAGES_EVENT, TOKEN_EVENT, iter_completion_text
 
 class RAGAgentAISearch:
     """This class is used to connect to a GPT model to submit a Prompt for Completion."""
-    def __init__(self, settings = None, client = None):
+    def __init__(self, settings = None, client = None, async_client = None):
         if settings is None:
             settings = AgentSettings()
         if client is None:
-            client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version)
+            client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
+        if async_client is None:
+            async_client = AsyncAzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
         self.settings : AgentSettings = settings
         self.client : AzureOpenAI = client
+        self.async_client : AsyncAzureOpenAI = async_client
         self.get_context_delegate = None
+        self.session = self.__create_session()
+        # search hits by normalized query and limit
+        self.search_cache = TTLCache(max_size=settings.aisearch_cache_size, default_ttl=settings.aisearch_cache_ttl)
+        # Optional local retrieval backend with a search(input, limit) method, like VectorIndex
+        self.retriever = None
+        self.context_assembler = ContextAssembler(token_budget=settings.rag_context_tokens, min_score=settings.rag_min_reranker_score)
+
+    def __create_session(self) -> requests.Session:
+        """Creates a keep-alive session that retries throttled and failed search calls."""
+        retry = Retry(total=self.settings.aisearch_retries,
+                      backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset(['POST']),
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'api-key':self.settings.aisearch_apikey or ''})
+        return session
     
     @staticmethod
-    def write_file(file_name:str, data:str):
-        # Check file exists
-        if not os.path.exists(file_name):
-            with open(file_name, 'w') as f:
-                f.write(data)
+    def write_jsonl(file_name:str, records, previous:dict=None) -> dict:
+        """Streams (id, record) pairs to a JSONL file through a temp file that replaces it atomically.
+        The file is only replaced when a record hash, or the order of the records, changed.
+        args:
+            file_name: str - The JSONL file
+            records: iterable - The (id, dict) pairs to write
+            previous: dict - The record hashes by id of the last write
+        returns:
+            dict - The record hashes by id and the ids added, changed and removed"""
+        previous = previous or {}
+        hashes = {}
+        # a unique temp file in the same folder, so concurrent writers do not share it and os.replace stays atomic
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(file_name) or '.', suffix='.tmp', delete=False) as f:
+            temp_name = f.name
+            try:
+                for id, record in records:
+                    line = json.dumps(record)
+                    hashes[str(id)] = hashlib.sha256(line.encode('utf-8')).hexdigest()
+                    f.write(line + '\n')
+            except BaseException:
+                f.close()
+                os.remove(temp_name)
+                raise
+        added = [id for id in hashes if id not in previous]
+        changed = [id for id in hashes if id in previous and previous[id] != hashes[id]]
+        removed = [id for id in previous if id not in hashes]
+        written = list(hashes.items()) != list(previous.items()) or not os.path.exists(file_name)
+        if written:
+            os.replace(temp_name, file_name)
+        else:
+            os.remove(temp_name)
+        return {'records':hashes,'added':added,'changed':changed,'removed':removed,'written':written}
 
-    def generate_docs(self):        
+    def generate_docs(self, customer_rows, product_rows, folder:str='rag_docs') -> dict:
+        """Writes the top customers and products as JSONL documents streamed from the database.
+        manifest.json keeps the record hashes of each document and the delta of the last run,
+        so downstream indexers can process only the added, changed and removed records.
+        args:
+            customer_rows: iterable - The top customer rows, like database.iter_top_customers_rag()
+            product_rows: iterable - The top product rows, like database.iter_top_products_rag()
+            folder: str - The folder of the documents
+        returns:
+            dict - The manifest"""
         # Check directory
-        if not os.path.exists('rag_docs'):
-            os.makedirs('rag_docs')
-
-        customers = rep.get_top_customers_rag()
-        content = ''
-        for row in customers:
-            # convert Row to JSON string
-            json_str ={'CustomerID':row['CustomerID'],'FirstName':row['FirstName'],'LastName':row['LastName'],'City':row['City'],'StateProvince':row['StateProvince'],'CountryRegion':row['CountryRegion'],'Total':float(str(row['Total']))}            
-            # append the records
-            content += json.dumps(json_str) + '\n'
-        # Write to json_str to a file
-        self.write_file(f'rag_docs/Customers.txt',content)
-            
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        manifest_name = os.path.join(folder, 'manifest.json')
+        manifest = {'version':0,'files':{}}
+        if os.path.exists(manifest_name):
+            with open(manifest_name) as f:
+                manifest = json.load(f)
+
+        customers = ((row['CustomerID'], {'CustomerID':row['CustomerID'],'FirstName':row['FirstName'],'LastName':row['LastName'],'City':row['City'],'StateProvince':row['StateProvince'],'CountryRegion':row['CountryRegion'],'Total':float(str(row['Total']))})
+                     for row in customer_rows)
+        products = ((row['ProductId'], {'ProductId':row['ProductId'],'category':row['category'],'model':row['model'],'description':row['description'],'TotalQty':float(str(row['TotalQty']))})
+                    for row in product_rows)
+
+        files = {}
+        for name, records in [('Customers.txt', customers), ('Producs.txt', products)]:
+            previous = manifest['files'].get(name, {}).get('records')
+            files[name] = self.write_jsonl(os.path.join(folder, name), records, previous)
+            logging.info(f"{name}: {len(files[name]['added'])} added, {len(files[name]['changed'])} changed, "
+                         f"{len(files[name]['removed'])} removed, {'rewritten' if files[name]['written'] else 'unchanged'}")
 
-        content = ''                
-        products = rep.get_top_products_rag()
-        for row in products:
-            # convert Row to JSON string
-            json_str ={'ProductId':row['ProductId'],'category':row['category'],'model':row['model'],'description':row['description'],'TotalQty':float(str(row['TotalQty']))}
-            # Append ther ecords
-            content += json.dumps(json_str) + '\n'
-        # Write to json_str to a file
-        self.write_file(f'rag_docs/Producs.txt',content)
+        manifest = {'version':manifest['version'] + 1,'generated':datetime.now().isoformat(),'files':files}
+        with tempfile.NamedTemporaryFile('w', dir=folder, suffix='.tmp', delete=False) as f:
+            json.dump(manifest, f)
+        os.replace(f.name, manifest_name)
+        return manifest
             
     def __call_ai_search(self,input:str,limit:int=3):
         payload = {'search':input,
@@ -67,10 +140,34 @@ class RAGAgentAISearch:
                    'select':'chunk_id,parent_id,chunk,title',
                    'queryLanguage':'en-US'                   
         }        
-        req = requests.post(self.settings.aisearch_endpoint, json=payload, headers={'api-key':self.settings.aisearch_apikey})
+        # connect and read timeouts
+        req = self.session.post(self.settings.aisearch_endpoint, json=payload, timeout=(3.05, self.settings.aisearch_timeout))
         req.raise_for_status()
         return req.json()['value']
 
+    def search(self, input:str, limit:int=3) -> list:
+        """Returns the AI Search hits for a query, from the cache when the same query was searched recently.
+        The hits come from the retriever instead of AI Search when one is set, empty retriever hits are not cached.
+        args:
+            input: str - The query
+            limit: int - The number of hits
+        returns:
+            list - The hits as returned by AI Search"""
+        key = ('aisearch', " ".join(input.lower().split()), limit)
+        hits = self.search_cache.get(key)
+        if hits is None:
+            hits = self.retriever.search(input, limit) if self.retriever else self.__call_ai_search(input, limit)
+            # an empty retriever, still syncing its first index, is asked again next time
+            if hits or not self.retriever:
+                self.search_cache.set(key, hits)
+        return hits
+
+    def stats(self) -> dict:
+        stats = self.search_cache.stats()
+        if self.retriever:
+            stats['retriever'] = self.retriever.stats()
+        return stats
+
     def process(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str="") -> list:
         """This method is used to process the prompt and return the completion.
         args:
@@ -83,23 +180,10 @@ class RAGAgentAISearch:
         returns:
             list - A list of ChatMessage objects"""
         
-        if self.get_context_delegate:
-            context = self.get_context_delegate()
-
-        ai_results = self.__call_ai_search(prompt)        
-        for ai_result in ai_results:
-            line = AISearchResult(ai_result)
-            context = f"{line.chunk}\n"
-
         # Get the completion
-        completion = self.client.chat.completions.create(
+        completion = create_completion(self.client,
                 model=self.settings.gpt_model_deployment_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt +"Text: \"\"\"" + context + "\"\"\"",
-                    }
-                ],
+                messages=self.__messages(prompt, self.__search_context(prompt, context)),
                 temperature=temperature
             )
         
@@ -110,4 +194,57 @@ class RAGAgentAISearch:
             ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content=result,columns=[],rows=[])            
         ]
 
+    async def aprocess(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str="") -> list:
+        """Async version of process using the AsyncAzureOpenAI client. The search call runs in the default executor."""
+        context = await asyncio.get_running_loop().run_in_executor(None, self.__search_context, prompt, context)
+        completion = await acreate_completion(self.async_client,
+                model=self.settings.gpt_model_deployment_name,
+                messages=self.__messages(prompt, context),
+                temperature=temperature
+            )
+        result = str(completion.choices[0].message.content)
+        return [
+            ChatMessage(role='user',user_name=user_name,user_id=user_id,content=prompt,columns=[],rows=[]),
+            ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content=result,columns=[],rows=[])
+        ]
+
+    def process_stream(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str=""):
+        """This method is used to stream the completion as it is generated.
+        args:
+            same as process
+        yields:
+            (TOKEN_EVENT, str) for each token and (MESSAGES_EVENT, list) with the ChatMessage objects at the end"""
+        stream = create_stream(self.client,
+                model=self.settings.gpt_model_deployment_name,
+                messages=self.__messages(prompt, self.__search_context(prompt, context)),
+                temperature=temperature
+            )
+        tokens = []
+        for token in iter_completion_text(stream):
+            tokens.append(token)
+            yield TOKEN_EVENT, token
+        yield MESSAGES_EVENT, [
+            ChatMessage(role='user',user_name=user_name,user_id=user_id,content=prompt,columns=[],rows=[]),
+            ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content="".join(tokens),columns=[],rows=[])
+        ]
+
+    def __search_context(self, prompt: str, context: str) -> str:
+        if self.get_context_delegate:
+            context = self.get_context_delegate()
+
+        # search more chunks than needed, the assembler keeps the best ones that fit the budget
+        ai_results = [AISearchResult(ai_result) for ai_result in self.search(prompt, self.settings.rag_search_candidates)]
+        if ai_results:
+            context = self.context_assembler.assemble(ai_results)
+        return context
+
+    @staticmethod
+    def __messages(prompt: str, context: str) -> list:
+        return [
+            {
+                "role": "user",
+                "content": prompt +"Text: \"\"\"" + context + "\"\"\"",
+            }
+        ]
+
     
\ No newline at end of file
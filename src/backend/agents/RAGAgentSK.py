@@ -1,15 +1,22 @@
 import json
+import time
+import asyncio
+import hashlib
+import logging
 import database as rep
 
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from agents import AgentSettings
 from agents import ChatMessage
+from agents.Completions import create_completion, scheduler
+from agents.RequestScheduler import ASSISTANT_PRIORITY
 
 from semantic_kernel import Kernel
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion, AzureTextEmbedding
 from semantic_kernel.core_plugins import TextMemoryPlugin
 from semantic_kernel.functions import KernelFunction
 from semantic_kernel.memory import SemanticTextMemory, VolatileMemoryStore
+from semantic_kernel.memory.memory_record import MemoryRecord
 
 COLLECTION_ID="AdventureWorksAI"
 
@@ -19,7 +26,7 @@ class RAGAgentSK:
         if settings is None:
             settings = AgentSettings()
         if client is None:
-            client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version)
+            client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
         self.settings : AgentSettings = settings
         self.client : AzureOpenAI = client
         self.get_context_delegate = None
@@ -36,8 +43,9 @@ class RAGAgentSK:
             service_id="ada",
             deployment_name=settings.ada_model_deployment_name,
             endpoint=settings.api_endpoint,
-            api_key=settings.api_key
-
+            api_key=settings.api_key,
+            # the scheduler retries the rate limited requests
+            async_client=AsyncAzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
         )
         self.kernel.add_service(self.embedding_gen)
 
@@ -47,26 +55,75 @@ class RAGAgentSK:
         
         self.memory=SemanticTextMemory(self.storage, embeddings_generator=self.embedding_gen)
         self.kernel.add_plugin(TextMemoryPlugin(self.memory), "TextMemoryPlugin")
+        # content hash of each ingested row by record id, so a re-ingest only embeds the changed rows
+        self.ingested = {}
+
+    async def ingest_customer_and_products(self, batch_size: int = 16, concurrency: int = 4) -> dict:
+        """Embeds the top products into the memory store.
+        Only the rows whose content hash changed since the last ingest are embedded, many rows per
+        embedding request with at most concurrency requests in flight, and rows that are gone are removed.
+        args:
+            batch_size: int - The rows embedded per request
+            concurrency: int - The embedding requests in flight
+        returns:
+            dict - A report with the rows embedded, unchanged and removed and the throughput"""
+        start = time.perf_counter()
+        if not await self.storage.does_collection_exist(COLLECTION_ID):
+            await self.storage.create_collection(COLLECTION_ID)
+        
+        # customers = rep.get_top_customers_rag()
+        # for row in customers:
+        #     # convert Row to JSON string
+        #     json_str ={'CustomerID':row['CustomerID'],'FirstName':row['FirstName'],'LastName':row['LastName'],'Total':float(str(row['Total']))}
+        #     await self.populate_memory("CustomerID-"+str(row['CustomerID']),json.dumps(json_str),'Top Customers')
+        
+        products = await asyncio.to_thread(rep.get_top_products_rag)
+        records = {}
+        for row in products:
+            # convert Row to JSON string
+            json_str ={'ProductId':row['ProductId'],'category':row['category'],'model':row['model'],'description':row['description'],'TotalQty':float(str(row['TotalQty']))}
+            text = json.dumps(json_str)
+            records["ProductId"+str(row['ProductId'])] = (text, hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+        changed = [(id, text, digest) for id, (text, digest) in records.items() if self.ingested.get(id) != digest]
+        removed = [id for id in self.ingested if id not in records]
+        if removed:
+            await self.storage.remove_batch(COLLECTION_ID, removed)
+            for id in removed:
+                del self.ingested[id]
+
+        batches = [changed[index:index + batch_size] for index in range(0, len(changed), batch_size)]
+        semaphore = asyncio.Semaphore(concurrency)
+        done = 0
+
+        async def embed_batch(batch: list):
+            nonlocal done
+            async with semaphore:
+                # the ingest runs in the background, behind the user requests
+                embeddings = await scheduler.acall(ASSISTANT_PRIORITY, 0, lambda: self.embedding_gen.generate_embeddings([text for _, text, _ in batch]))
+            await self.storage.upsert_batch(COLLECTION_ID, [
+                MemoryRecord.local_record(id=id, text=text, description='Top Products', additional_metadata=digest, embedding=embedding)
+                for (id, text, digest), embedding in zip(batch, embeddings)])
+            for id, _, digest in batch:
+                self.ingested[id] = digest
+            done += len(batch)
+            elapsed = time.perf_counter() - start
+            logging.info(f"Embedded {done}/{len(changed)} rows, {done / elapsed:.1f} rows/s")
 
-    async def ingest_customer_and_products(self):
-        try:
-            if await self.storage.does_collection_exist(COLLECTION_ID):
-                await self.storage.delete_collection(COLLECTION_ID)
-            
-            # customers = rep.get_top_customers_rag()
-            # for row in customers:
-            #     # convert Row to JSON string
-            #     json_str ={'CustomerID':row['CustomerID'],'FirstName':row['FirstName'],'LastName':row['LastName'],'Total':float(str(row['Total']))}
-            #     await self.populate_memory("CustomerID-"+str(row['CustomerID']),json.dumps(json_str),'Top Customers')
-            
-            products = rep.get_top_products_rag()
-            for row in products:
-                # convert Row to JSON string
-                json_str ={'ProductId':row['ProductId'],'category':row['category'],'model':row['model'],'description':row['description'],'TotalQty':float(str(row['TotalQty']))}
-                await self.populate_memory("ProductId"+str(row['ProductId']),json.dumps(json_str),'Top Products')
-        finally:
-            pass
+        await asyncio.gather(*[embed_batch(batch) for batch in batches])
 
+        elapsed = time.perf_counter() - start
+        report = {
+            'rows': len(records),
+            'embedded': len(changed),
+            'unchanged': len(records) - len(changed),
+            'removed': len(removed),
+            'batches': len(batches),
+            'seconds': round(elapsed, 3),
+            'rowsPerSecond': round(len(changed) / elapsed, 1) if elapsed else 0.0,
+        }
+        logging.info(f"Ingested the top products: {report}")
+        return report
 
     async def populate_memory(self, id:str, text:str,description:str) -> None:
         await self.memory.save_information(collection=COLLECTION_ID, id=id, text=text, description=description)
@@ -93,7 +150,7 @@ class RAGAgentSK:
             context = self.get_context_delegate()
 
         # Get the completion
-        completion = self.client.chat.completions.create(
+        completion = create_completion(self.client,
                 model=self.settings.gpt_model_deployment_name,
                 messages=[
                     {
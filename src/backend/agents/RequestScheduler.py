@@ -0,0 +1,236 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import threading
+
+from openai import RateLimitError, APIConnectionError, InternalServerError
+
+# priority classes, lower goes first
+ROUTING_PRIORITY = 0
+CHAT_PRIORITY = 1
+ASSISTANT_PRIORITY = 2
+PRIORITY_NAMES = {ROUTING_PRIORITY: "routing", CHAT_PRIORITY: "chat", ASSISTANT_PRIORITY: "assistant"}
+# the clients are built with max_retries=0, these errors are retried by the scheduler instead
+RETRY_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+# waiters behind the head of the queue are woken when it changes, this only bounds a missed wake up
+QUEUE_WAIT = 1.0
+
+
+class TokenBucket:
+    """A bucket that refills limit units per minute, a limit of 0 or less never runs out."""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.level = float(limit)
+        self.updated = time.monotonic()
+
+    def __refill(self, now: float):
+        self.level = min(self.limit, self.level + (now - self.updated) * self.limit / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available, amounts above the limit only wait for a full bucket."""
+        if self.limit <= 0:
+            return 0.0
+        self.__refill(now)
+        amount = min(amount, self.limit)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.limit
+
+    def take(self, amount: float):
+        if self.limit > 0:
+            self.level -= amount
+
+
+class RequestScheduler:
+    """Schedules the Azure OpenAI requests of every agent.
+
+    Requests wait in one priority queue (routing, then chat, then assistant, first come first
+    served within a class) until the requests per minute and tokens per minute buckets allow
+    them. A 429 is retried with exponential backoff that honors the Retry-After headers, as are
+    connection errors and 5xx responses, so the clients must not retry on their own (max_retries=0).
+    """
+    def __init__(self, tpm: int = 0, rpm: int = 0, max_retries: int = 5, backoff: float = 1.0):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._tokens = TokenBucket(tpm)
+        self._requests = TokenBucket(rpm)
+        self._lock = threading.Condition()
+        # (loop, future) of the coroutines waiting in aadmit
+        self._async_waiters = set()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self._max_depth = 0
+        self._admitted = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wait_seconds = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._rate_limited = 0
+        self._retries = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.openai_tpm, settings.openai_rpm, settings.openai_max_retries)
+
+    def __enqueue(self, priority: int) -> tuple:
+        with self._lock:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            self._depth[priority] += 1
+            self._max_depth = max(self._max_depth, len(self._queue))
+            return ticket
+
+    @staticmethod
+    def __wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    def __notify(self):
+        """Wakes the threads and the coroutines waiting for admission, called with the lock held."""
+        self._lock.notify_all()
+        for loop, future in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(self.__wake, future)
+            except RuntimeError:
+                # the loop of the waiter is closed
+                pass
+
+    def __try_admit(self, ticket: tuple, tokens: int) -> float:
+        """Admits the ticket when it is at the head of the queue and the buckets allow it.
+        returns:
+            0 when admitted, otherwise the seconds to wait before trying again"""
+        with self._lock:
+            if self._queue[0] != ticket:
+                return QUEUE_WAIT
+            now = time.monotonic()
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            heapq.heappop(self._queue)
+            self._depth[ticket[0]] -= 1
+            self._admitted[ticket[0]] += 1
+            self.__notify()
+            return 0.0
+
+    def __remove(self, ticket: tuple):
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._depth[ticket[0]] -= 1
+                self.__notify()
+
+    def __waited(self, priority: int, start: float):
+        with self._lock:
+            self._wait_seconds[priority] += time.monotonic() - start
+
+    def admit(self, priority: int, tokens: int):
+        """Blocks until a request of the given priority and estimated tokens can be sent."""
+        start = time.monotonic()
+        ticket = self.__enqueue(priority)
+        try:
+            while True:
+                # tried and waited under one hold of the lock, so no notification is missed in between
+                with self._lock:
+                    wait = self.__try_admit(ticket, tokens)
+                    if wait == 0:
+                        break
+                    self._lock.wait(wait)
+        except BaseException:
+            self.__remove(ticket)
+            raise
+        self.__waited(priority, start)
+
+    async def aadmit(self, priority: int, tokens: int):
+        """Async version of admit, the coroutine is woken like the threads instead of polling."""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        ticket = self.__enqueue(priority)
+        try:
+            while True:
+                # registered before trying, so a change made in between still wakes it
+                waiter = (loop, loop.create_future())
+                with self._lock:
+                    self._async_waiters.add(waiter)
+                try:
+                    wait = self.__try_admit(ticket, tokens)
+                    if wait == 0:
+                        break
+                    await asyncio.wait([waiter[1]], timeout=wait)
+                finally:
+                    with self._lock:
+                        self._async_waiters.discard(waiter)
+        except BaseException:
+            self.__remove(ticket)
+            raise
+        self.__waited(priority, start)
+
+    def settle(self, estimated: int, used: int):
+        """Corrects the tokens bucket with the tokens a request actually used."""
+        with self._lock:
+            self._tokens.take(used - estimated)
+            if used < estimated:
+                self.__notify()
+
+    def __retry_delay(self, error: Exception, attempt: int) -> float:
+        delay = self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else {}
+        try:
+            if headers.get("retry-after-ms"):
+                return max(delay, float(headers["retry-after-ms"]) / 1000)
+            if headers.get("retry-after"):
+                return max(delay, float(headers["retry-after"]))
+        except ValueError:
+            pass
+        return delay
+
+    def __failed(self, error: Exception, attempt: int, priority: int) -> float:
+        """Counts a failed attempt and returns the delay before the next one, or raises the error after the last one."""
+        rate_limited = isinstance(error, RateLimitError)
+        with self._lock:
+            if rate_limited:
+                self._rate_limited += 1
+            if attempt >= self.max_retries:
+                raise error
+            self._retries += 1
+        delay = self.__retry_delay(error, attempt)
+        reason = "rate limited" if rate_limited else f"failed ({type(error).__name__})"
+        logging.warning(f"Azure OpenAI {reason} a {PRIORITY_NAMES[priority]} request, retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, priority: int, tokens: int, fn):
+        """Runs fn() once admitted and retries it when it is rate limited or fails with a transient error."""
+        for attempt in itertools.count():
+            self.admit(priority, tokens)
+            try:
+                return fn()
+            except RETRY_ERRORS as e:
+                time.sleep(self.__failed(e, attempt, priority))
+
+    async def acall(self, priority: int, tokens: int, fn):
+        """Async version of call, fn() returns an awaitable."""
+        for attempt in itertools.count():
+            await self.aadmit(priority, tokens)
+            try:
+                return await fn()
+            except RETRY_ERRORS as e:
+                await asyncio.sleep(self.__failed(e, attempt, priority))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'queueDepth': {PRIORITY_NAMES[priority]: depth for priority, depth in self._depth.items()},
+                'maxQueueDepth': self._max_depth,
+                'admitted': {PRIORITY_NAMES[priority]: count for priority, count in self._admitted.items()},
+                'avgWaitMs': {PRIORITY_NAMES[priority]: round(1000 * self._wait_seconds[priority] / self._admitted[priority], 2) if self._admitted[priority] else 0.0
+                              for priority in PRIORITY_NAMES},
+                'rateLimited': self._rate_limited,
+                'retries': self._retries,
+                'tpm': self._tokens.limit,
+                'rpm': self._requests.limit,
+            }
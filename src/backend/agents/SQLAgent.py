@@ -1,19 +1,29 @@
-from openai import AzureOpenAI
+import asyncio
+import logging
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from .AgentSettings import AgentSettings
 from .Models import ChatMessage
+from .Completions import create_completion, acreate_completion
 #import database as rep
 
 class SQLAgent:
     """This class is used to connect to a GPT model to submit a Prompt for Completion. The completion is then executed as a SQL statement."""
-    def __init__(self, settings = None, client = None):
+    def __init__(self, settings = None, client = None, async_client = None):
         if settings is None:
             settings = AgentSettings()
         if client is None:
-            client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version)
+            client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
+        if async_client is None:
+            async_client = AsyncAzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
         self.settings : AgentSettings = settings
         self.client : AzureOpenAI = client
+        self.async_client : AsyncAzureOpenAI = async_client
         # Used in multi-agent mode to get addtional context
         self.get_context_delegate = None
+        # Optional cache of the SQL generated for a question, see plancache.SQLPlanCache
+        self.plan_cache = None
+        # Optional SchemaSelector used to send only the relevant part of the schema
+        self.schema_selector = None
 
     def process(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str=None) -> list[ChatMessage]:
         """This method is used to process the prompt and return the SQL statement. The SQL statement is then executed and the results are returned.
@@ -30,40 +40,84 @@ class SQLAgent:
         # Get additional context when in multi-agent mode
         if self.get_context_delegate:
             context = self.get_context_delegate()
-        
+
+        # Skip the completion when the question was answered before
+        sql_statement = self.__cached_statement(prompt, context)
+        if sql_statement is not None:
+            return self.__messages(user_name, user_id, prompt, sql_statement)
+
         # Configure and exectue the completion
-        completion = self.client.chat.completions.create(
+        completion = create_completion(self.client,
                 model=self.settings.gpt_model_deployment_name,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an agent that can help generate sql statements based on the schema provided. Here is the schema:\n" + context,
-                    },
-                    {
-                        "role": "user",
-                        "content": f"What is the SQL statement to:\n{prompt}\nOutput the SQL statement ONLY."
-                    }
-                ],
+                messages=self.__prompt(prompt, context),
                 max_tokens=max_tokens,
                 temperature=temperature
             )
         
         # Get the SQL statement from GPT
-        sql_statement = str(completion.choices[0].message.content)
+        sql_statement = self.__clean_statement(prompt, context, str(completion.choices[0].message.content))
+        return self.__messages(user_name, user_id, prompt, sql_statement)
+
+    async def aprocess(self, user_name: str, user_id: str, prompt: str,max_tokens:int=500,temperature:float=0.3,context:str=None) -> list[ChatMessage]:
+        """Async version of process using the AsyncAzureOpenAI client.
+        The plan cache reads and writes go to SQLite, they run in a worker thread."""
+        if self.get_context_delegate:
+            context = self.get_context_delegate()
+
+        sql_statement = await asyncio.to_thread(self.__cached_statement, prompt, context)
+        if sql_statement is not None:
+            return self.__messages(user_name, user_id, prompt, sql_statement)
+
+        completion = await acreate_completion(self.async_client,
+                model=self.settings.gpt_model_deployment_name,
+                messages=self.__prompt(prompt, context),
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+
+        sql_statement = await asyncio.to_thread(self.__clean_statement, prompt, context, str(completion.choices[0].message.content))
+        return self.__messages(user_name, user_id, prompt, sql_statement)
+
+    def __cached_statement(self, prompt: str, context: str) -> str:
+        if self.plan_cache:
+            sql_statement = self.plan_cache.get(prompt, context)
+            if sql_statement is not None:
+                logging.info("SQL plan cache hit")
+                return sql_statement
+        return None
+
+    def __prompt(self, prompt: str, context: str) -> list:
+        # Prune the schema to the views relevant to the question
+        schema = context
+        if self.schema_selector:
+            schema = self.schema_selector.prune(prompt, context)
+        return [
+            {
+                "role": "system",
+                "content": "You are an agent that can help generate sql statements based on the schema provided. Here is the schema:\n" + schema,
+            },
+            {
+                "role": "user",
+                "content": f"What is the SQL statement to:\n{prompt}\nOutput the SQL statement ONLY."
+            }
+        ]
 
+    def __clean_statement(self, prompt: str, context: str, sql_statement: str) -> str:
         # Remove the system message
         sql_statement = sql_statement.replace("```","")
         sql_statement = sql_statement.replace("\n"," ")
         sql_statement = sql_statement.replace("sql","") 
         sql_statement = sql_statement.replace(";","")
 
-        # Execute the SQL statement
-        #row_and_cols= rep.sql_executor(sql_statement)
+        if self.plan_cache:
+            self.plan_cache.set(prompt, sql_statement, context)
+        return sql_statement
 
-        # Return the columns and rows
-        columns = [] #row_and_cols['columns']
-        rows = [] #row_and_cols['rows']
+    @staticmethod
+    def __messages(user_name: str, user_id: str, prompt: str, sql_statement: str) -> list[ChatMessage]:
+        # The SQL statement is executed by the caller (see database.sql_executor),
+        # is_sql tells it apart from the answers of the other agents of the multiagent
         return [
             ChatMessage(role='user',user_name=user_name,user_id=user_id,content=prompt,columns=[],rows=[]),
-            ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content=sql_statement,columns=columns,rows=rows)
+            ChatMessage(role='assistant',user_name=user_name,user_id=user_id,content=sql_statement,columns=[],rows=[],is_sql=True)
         ]
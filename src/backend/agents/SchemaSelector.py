@@ -0,0 +1,144 @@
+import re
+from collections import Counter
+
+from .Tokens import terms
+
+VIEW_PATTERN = re.compile(r"SELECT\s+TOP\s*\(\d+\)\s*(?P<columns>.*?)\s*FROM\s+(?P<view>\[\w+\]\.\[(?P<name>\w+)\])", re.IGNORECASE | re.DOTALL)
+COLUMN_PATTERN = re.compile(r"\[(\w+)\]")
+SAMPLE_PATTERN = re.compile(r"^Q:\s*(?P<question>.*?)\nA:\s*(?P<answer>.*?)$", re.MULTILINE)
+
+# a few words users use for the columns in the AdventureWorks views
+SYNONYMS = {
+    "country": ["united", "kingdom", "nation", "countries"],
+    "province": ["state", "states"],
+    "total": ["revenue", "sales", "spent", "spend", "purchase", "bought", "top", "best", "biggest"],
+    "order": ["ordered", "purchase", "bought", "sold"],
+    "qty": ["quantity", "sold", "units", "top", "best"],
+    "email": ["mail", "contact"],
+    "sales": ["salesperson", "rep", "representative"],
+    "category": ["type", "kind"],
+    "model": ["bike", "bikes"],
+    "description": ["describe", "about"],
+    "line": ["amount"],
+}
+
+
+class SchemaView:
+    """A view parsed from the schema text."""
+    def __init__(self, name: str, definition: str, columns: list[str], description: str = ""):
+        self.name = name
+        self.definition = definition
+        self.columns = columns
+        self.description = description
+        self.name_terms = set(terms(name))
+        self.description_terms = set(terms(description))
+        self.column_terms = {column: set(terms(column)) for column in columns}
+
+
+class SchemaSelector:
+    """Selects the views and columns of the SQL schema that are relevant to a question.
+    The selector builds a local keyword index from the view names, column names and
+    descriptions in the schema text, so no model call is needed to prune the prompt.
+    """
+    def __init__(self, schema: str, prune_columns: bool = False, min_score: float = 1.0):
+        self.schema = schema
+        self.prune_columns = prune_columns
+        self.min_score = min_score
+        self.views: list[SchemaView] = []
+        self.samples: list[tuple[str, str]] = []
+        self.__parse(schema)
+        # selectors of the other schemas passed to prune, by schema text
+        self._other_selectors: dict[str, "SchemaSelector"] = {}
+
+    def __parse(self, schema: str):
+        descriptions = {}
+        tables_section = schema.split("Schemas:")[0]
+        for line in tables_section.splitlines():
+            if ":" in line and not line.startswith("Tables"):
+                name, description = line.split(":", 1)
+                descriptions[name.strip()] = description.strip()
+
+        for match in VIEW_PATTERN.finditer(schema):
+            name = match.group('name')
+            columns = COLUMN_PATTERN.findall(match.group('columns'))
+            # the table list uses short names like vCustomer for vCustomers
+            description = next((desc for short, desc in descriptions.items() if name.rstrip('s') == short.rstrip('s')), "")
+            self.views.append(SchemaView(name, match.group(0), columns, description))
+
+        for match in SAMPLE_PATTERN.finditer(schema):
+            self.samples.append((match.group('question').strip(), match.group('answer').strip()))
+
+    @staticmethod
+    def __expand(question: str) -> Counter:
+        question_terms = Counter(terms(question))
+        for term, synonyms in SYNONYMS.items():
+            if any(synonym in question_terms for synonym in synonyms):
+                question_terms[term] += 1
+        return question_terms
+
+    def score(self, question: str) -> dict:
+        """Scores each view for a question. View name hits weigh the most, then columns, then descriptions."""
+        question_terms = self.__expand(question)
+        scores = {}
+        for view in self.views:
+            score = 0.0
+            for term in question_terms:
+                if term in view.name_terms:
+                    score += 3
+                if any(term in column_terms for column_terms in view.column_terms.values()):
+                    score += 2
+                if term in view.description_terms:
+                    score += 1
+            scores[view.name] = score
+        return scores
+
+    def select(self, question: str) -> list[SchemaView]:
+        """Returns the views relevant to a question, or all views when nothing matches."""
+        scores = self.score(question)
+        best = max(scores.values()) if scores else 0
+        if best < self.min_score:
+            return list(self.views)
+        # keep the views that score close to the best one
+        return [view for view in self.views if scores[view.name] >= max(self.min_score, best / 2)]
+
+    def __view_definition(self, view: SchemaView, question_terms: Counter) -> str:
+        if not self.prune_columns:
+            return view.definition
+        columns = [column for column, column_terms in view.column_terms.items()
+                   if column.lower().endswith("id") or column_terms & set(question_terms)]
+        if not columns:
+            return view.definition
+        table = view.definition[view.definition.upper().rindex("FROM"):]
+        return "SELECT TOP (1000) " + "\n,".join([f"[{column}]" for column in columns]) + "\n" + table
+
+    def prune(self, question: str, schema: str = None) -> str:
+        """Builds a schema prompt with only the views, columns and sample queries relevant to a question.
+        args:
+            question: the question
+            schema: the schema to prune, defaults to the schema of the selector
+        returns:
+            the pruned schema"""
+        if schema is not None and schema != self.schema:
+            selector = self._other_selectors.get(schema)
+            if selector is None:
+                if len(self._other_selectors) >= 8:
+                    self._other_selectors.clear()
+                selector = self._other_selectors[schema] = SchemaSelector(schema, self.prune_columns, self.min_score)
+            return selector.prune(question)
+        views = self.select(question)
+        if len(views) == len(self.views) and not self.prune_columns:
+            return self.schema
+        question_terms = self.__expand(question)
+        names = [view.name for view in views]
+        tables = "\n".join([f"{view.name}: {view.description}" for view in views if view.description])
+        schemas = "\n\n".join([self.__view_definition(view, question_terms) for view in views])
+        samples = []
+        for sample_question, answer in self.samples:
+            referenced = {view.name for view in self.views if re.search(rf"\b{view.name}\b", answer)}
+            if referenced and referenced <= set(names):
+                samples.append(f"Q: {sample_question}\nA: {answer}")
+        samples = "\n".join(samples)
+        text = f"\nTables:\n{tables}\n\nSchemas:\n{schemas}\n"
+        if samples:
+            text += f"\nSample queries:\n{samples}\n"
+        return text
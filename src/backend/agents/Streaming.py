@@ -0,0 +1,18 @@
+from typing import Iterator
+
+# Events yielded by the process_stream methods of the agents:
+# (TOKEN_EVENT, str) for each piece of the completion as it arrives and
+# (MESSAGES_EVENT, list[ChatMessage]) once at the end with the same messages process returns.
+TOKEN_EVENT = "token"
+MESSAGES_EVENT = "messages"
+
+
+def iter_completion_text(stream) -> Iterator[str]:
+    """Yields the text deltas of a streamed chat completion.
+    Azure OpenAI sends chunks without choices (content filter results), those are skipped."""
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta is not None and delta.content:
+            yield delta.content
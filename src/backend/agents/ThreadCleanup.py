@@ -0,0 +1,69 @@
+import time
+import queue
+import logging
+import threading
+
+from openai import AzureOpenAI
+
+from .Completions import scheduler
+from .RequestScheduler import ASSISTANT_PRIORITY
+
+
+class ThreadCleanup:
+    """Deletes assistant threads from a background queue so responses do not wait on it.
+    A failed delete is retried with a growing delay before it is given up.
+    """
+    def __init__(self, client: AzureOpenAI, max_retries: int = 3, retry_delay: float = 2.0):
+        self.client = client
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._deleted = 0
+        self._retries = 0
+        self._failures = 0
+        self._thread = threading.Thread(target=self.__run, name="thread-cleanup", daemon=True)
+        self._thread.start()
+
+    def delete(self, thread_id: str):
+        """Queues a thread for deletion."""
+        self._queue.put((thread_id, 0, 0.0))
+
+    def __run(self):
+        while True:
+            thread_id, attempt, not_before = self._queue.get()
+            wait = not_before - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                # counted in the request limits, failures are retried by this queue
+                scheduler.admit(ASSISTANT_PRIORITY, 0)
+                self.client.beta.threads.delete(thread_id)
+                logging.info(f"Deleted thread: {thread_id}")
+                with self._lock:
+                    self._deleted += 1
+            except Exception as e:
+                if attempt + 1 < self.max_retries:
+                    with self._lock:
+                        self._retries += 1
+                    delay = self.retry_delay * (2 ** attempt)
+                    self._queue.put((thread_id, attempt + 1, time.monotonic() + delay))
+                else:
+                    with self._lock:
+                        self._failures += 1
+                    logging.warning(f"Error deleting thread {thread_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Waits until the queued threads are deleted or given up."""
+        self._queue.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'deleted': self._deleted,
+                'retries': self._retries,
+                'failures': self._failures,
+            }
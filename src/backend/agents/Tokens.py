@@ -0,0 +1,47 @@
+import re
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+WORD_PATTERN = re.compile(r"[A-Za-z]+|\d+")
+CAMEL_CASE_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "do", "does", "for", "from", "give", "how", "i", "in",
+    "is", "it", "list", "me", "my", "of", "on", "or", "show", "that", "the", "their", "there", "these", "this",
+    "to", "was", "what", "when", "where", "which", "who", "whose", "with", "all", "any", "get", "find", "tell",
+    "about", "have", "has", "many", "much", "can", "you", "please", "table", "tables",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Counts the tokens in a text with tiktoken when it is installed, otherwise estimates about 4 characters per token."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def stem(word: str) -> str:
+    """A very small stemmer that folds plurals so customer and customers match."""
+    word = word.lower()
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def terms(text: str, stop_words: set = STOP_WORDS) -> list[str]:
+    """Splits a text, including CamelCase identifiers, into stemmed terms without stop words."""
+    output = []
+    for word in WORD_PATTERN.findall(text or ""):
+        for part in CAMEL_CASE_PATTERN.findall(word) or [word]:
+            part = part.lower()
+            if part in stop_words or len(part) < 2:
+                continue
+            output.append(stem(part))
+    return output
@@ -0,0 +1,240 @@
+import os
+import json
+import glob
+import time
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VectorIndex:
+    """A local vector index over the rag_docs content.
+
+    The normalized embeddings are stored as a float32 matrix in a memory-mapped file next to a
+    JSON file with the chunks, so a restart opens the index without embedding anything again and
+    only new or changed chunks are embedded on sync. Search is a vectorized cosine top-k over the
+    matrix, or over the closest inverted lists (IVF) when the approximate index is enabled for
+    bigger corpora. Hits use the Azure AI Search shape, so the index can replace the search
+    service behind RAGAgentAISearch.
+    """
+    def __init__(self, path: str, embed, approximate: bool = False, nprobe: int = 4, batch_size: int = 16):
+        """args:
+            path: the path prefix of the index files
+            embed: a function that returns the embeddings of a list of texts
+            approximate: use an IVF index instead of the exact search
+            nprobe: the inverted lists searched by the IVF index
+            batch_size: texts embedded per request
+        """
+        self.path = path
+        self.embed = embed
+        self.approximate = approximate
+        self.nprobe = nprobe
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._vectors = None
+        self._chunks = []
+        self._centroids = None
+        self._lists = []
+        self._searches = 0
+        self._search_seconds = 0.0
+        self._embedded = 0
+        self._reused = 0
+        # Optional function called after a sync changed the index, to drop cached hits
+        self.on_change = None
+        self.load()
+
+    @property
+    def vectors_path(self) -> str:
+        return f"{self.path}.vectors.f32"
+
+    @property
+    def chunks_path(self) -> str:
+        return f"{self.path}.chunks.json"
+
+    @property
+    def ivf_path(self) -> str:
+        return f"{self.path}.ivf.npz"
+
+    def load(self) -> bool:
+        """Opens the index files when they exist."""
+        try:
+            with open(self.chunks_path) as f:
+                header = json.load(f)
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(header['count'], header['dim'])) if header['count'] else None
+        except (OSError, ValueError, KeyError) as e:
+            logging.info(f"No local vector index at {self.path}: {str(e)}")
+            return False
+        centroids, lists = None, []
+        if self.approximate and vectors is not None:
+            centroids, lists = self.__load_ivf(header['count'])
+        with self._lock:
+            self._vectors = vectors
+            self._chunks = header['chunks']
+            self._centroids = centroids
+            self._lists = lists
+        logging.info(f"Loaded the local vector index {self.path} with {header['count']} chunks")
+        return True
+
+    @staticmethod
+    def read_chunks(folder: str) -> list[dict]:
+        """Splits the rag_docs files into chunks, one per non empty line."""
+        chunks = []
+        for file in sorted(glob.glob(os.path.join(folder, "*.txt"))):
+            title = os.path.splitext(os.path.basename(file))[0]
+            with open(file) as f:
+                for number, line in enumerate(f):
+                    line = line.strip()
+                    if line:
+                        chunk_id = f"{title}_{number}"
+                        chunks.append({'chunk_id': chunk_id, 'parent_id': chunk_id, 'title': title, 'chunk': line})
+        return chunks
+
+    def sync(self, folder: str) -> dict:
+        """Indexes the chunks of a folder, embedding only the chunks that are not in the index yet.
+        returns:
+            a report with the chunks embedded and reused, whether the index changed and the time it took
+        """
+        with self._sync_lock:
+            start = time.perf_counter()
+            chunks = self.read_chunks(folder)
+            with self._lock:
+                old_vectors, old_chunks = self._vectors, self._chunks
+            known = {chunk['hash']: row for row, chunk in enumerate(old_chunks)}
+
+            missing = []
+            for chunk in chunks:
+                chunk['hash'] = text_hash(chunk['chunk'])
+                if chunk['hash'] not in known:
+                    missing.append(chunk['chunk'])
+            missing = list(dict.fromkeys(missing))
+            embedded = {}
+            for index in range(0, len(missing), self.batch_size):
+                batch = missing[index:index + self.batch_size]
+                for text, vector in zip(batch, self.embed(batch)):
+                    embedded[text_hash(text)] = vector
+
+            report = {'chunks': len(chunks), 'embedded': len(missing), 'reused': len(chunks) - len(missing)}
+            unchanged = len(missing) == 0 and [chunk['hash'] for chunk in chunks] == [chunk['hash'] for chunk in old_chunks]
+            report['changed'] = not unchanged
+            if not unchanged:
+                self.__write(chunks, old_vectors, known, embedded)
+                self.load()
+            elif self.approximate and self._centroids is None and old_vectors is not None:
+                self.__write_ivf(np.asarray(old_vectors))
+                self.load()
+            self._embedded += report['embedded']
+            self._reused += report['reused']
+            report['seconds'] = round(time.perf_counter() - start, 3)
+            logging.info(f"Synced the local vector index {self.path}: {report}")
+            if report['changed'] and self.on_change:
+                self.on_change()
+            return report
+
+    def __write(self, chunks: list[dict], old_vectors, known: dict, embedded: dict):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        dim = len(next(iter(embedded.values()))) if embedded else (old_vectors.shape[1] if old_vectors is not None else 0)
+        temp_path = f"{self.vectors_path}.tmp"
+        vectors = None
+        if chunks:
+            vectors = np.memmap(temp_path, dtype=np.float32, mode="w+", shape=(len(chunks), dim))
+            for row, chunk in enumerate(chunks):
+                vector = embedded.get(chunk['hash'])
+                vectors[row] = old_vectors[known[chunk['hash']]] if vector is None else vector
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms == 0, 1, norms)
+            vectors.flush()
+            if self.approximate:
+                self.__write_ivf(np.asarray(vectors))
+            del vectors
+            os.replace(temp_path, self.vectors_path)
+        temp_chunks = f"{self.chunks_path}.tmp"
+        with open(temp_chunks, "w") as f:
+            json.dump({'count': len(chunks), 'dim': dim, 'chunks': chunks}, f)
+        os.replace(temp_chunks, self.chunks_path)
+
+    def __write_ivf(self, vectors: np.ndarray, iterations: int = 10):
+        """Clusters the vectors with k-means into about sqrt(n) inverted lists."""
+        count = vectors.shape[0]
+        nlist = max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(count, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = vectors[assignments == cluster]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1)
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        np.savez(f"{self.ivf_path}.tmp.npz", centroids=centroids, assignments=assignments, count=count)
+        os.replace(f"{self.ivf_path}.tmp.npz", self.ivf_path)
+
+    def __load_ivf(self, count: int):
+        try:
+            data = np.load(self.ivf_path)
+            if int(data['count']) != count:
+                raise ValueError("the IVF index is out of date")
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Using the exact search, no IVF index at {self.ivf_path}: {str(e)}")
+            return None, []
+        centroids, assignments = data['centroids'], data['assignments']
+        return centroids, [np.flatnonzero(assignments == cluster) for cluster in range(len(centroids))]
+
+    def search_vector(self, vector, k: int = 3) -> list[tuple[int, float]]:
+        """Returns the rows and cosine scores of the k closest chunks."""
+        with self._lock:
+            vectors, centroids, lists = self._vectors, self._centroids, self._lists
+        if vectors is None:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        if centroids is not None:
+            probes = np.argsort(centroids @ query)[::-1][:self.nprobe]
+            rows = np.concatenate([lists[probe] for probe in probes])
+            scores = vectors[rows] @ query
+        else:
+            rows = None
+            scores = vectors @ query
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i] if rows is not None else i), float(scores[i])) for i in top]
+
+    def search(self, text: str, k: int = 3) -> list[dict]:
+        """Returns the k closest chunks to a text in the Azure AI Search hit shape."""
+        start = time.perf_counter()
+        results = self.search_vector(self.embed([text])[0], k)
+        with self._lock:
+            chunks = self._chunks
+            self._searches += 1
+            self._search_seconds += time.perf_counter() - start
+        return [{
+            '@search.score': score,
+            '@search.rerankerScore': score,
+            'chunk_id': chunks[row]['chunk_id'],
+            'parent_id': chunks[row]['parent_id'],
+            'chunk': chunks[row]['chunk'],
+            'title': chunks[row]['title'],
+        } for row, score in results]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'chunks': len(self._chunks),
+                'approximate': self._centroids is not None,
+                'searches': self._searches,
+                'avgSearchMs': round(1000 * self._search_seconds / self._searches, 2) if self._searches else 0.0,
+                'embedded': self._embedded,
+                'reused': self._reused,
+            }
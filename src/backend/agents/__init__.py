@@ -7,11 +7,18 @@ __author__ = "Alex Morales"
 from .AgentProxy import AgentProxy
 from .AgentRegistration import AgentRegistration
 from .AgentSettings import AgentSettings
+from .IntentRouter import IntentRouter
 from .ArgumentException import ArgumentExceptionError
 from .AssistantAgent import AssistantAgent
 from .GPTAgent import GPTAgent
 from .SQLAgent import SQLAgent
 from .RAGAgentAISearch import RAGAgentAISearch
+from .SchemaSelector import SchemaSelector
+from .ThreadCleanup import ThreadCleanup
+from .ImageStore import ImageStore
+from .ContextAssembler import ContextAssembler
+from .ContextSelector import ContextSelector
+from .VectorIndex import VectorIndex
 from .Models import BaseAgent, ChatMessage, ChatRequest
 
-__ALL__ = [ "AgentProxy", "AgentRegistration", "AgentSettings", "ArgumentExceptionError", "AssistantAgent", "GPTAgent", "SQLAgent", "RAGAgentAISearch", "BaseAgent", "ChatMessage", "ChatRequest" ]
\ No newline at end of file
+__ALL__ = [ "AgentProxy", "AgentRegistration", "AgentSettings", "IntentRouter", "ArgumentExceptionError", "AssistantAgent", "GPTAgent", "SQLAgent", "RAGAgentAISearch", "SchemaSelector", "ThreadCleanup", "ImageStore", "ContextAssembler", "ContextSelector", "VectorIndex", "BaseAgent", "ChatMessage", "ChatRequest" ]
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The shape of an Azure AI Search semantic query response with the fields RAGAgentAISearch selects
+SAMPLE_CHUNKS = [
+    ("Bike maintenance", "Clean and lubricate the chain every 200 miles or after riding in the rain."),
+    ("Brakes", "Adjust the brake pads so they touch the rim evenly, replace them when the grooves are worn."),
+    ("Tires", "Inflate road tires to 80-130 psi and mountain tires to 25-35 psi, check the pressure weekly."),
+    ("Warranty", "Frames have a lifetime warranty, components are covered for two years from purchase."),
+    ("Bike maintenance", "Check that the quick release levers are closed before every ride."),
+]
+
+
+def search_response(search: str, top: int) -> dict:
+    """Replays the response shape of Azure AI Search, with the chunks that share words with the query first."""
+    words = set(search.lower().split())
+    ranked = sorted(enumerate(SAMPLE_CHUNKS), key=lambda item: -len(words & set(item[1][1].lower().split())))
+    value = []
+    for rank, (index, (title, chunk)) in enumerate(ranked[:top]):
+        value.append({
+            '@search.score': round(1.0 / (rank + 1), 4),
+            '@search.rerankerScore': round(3.0 - rank * 0.5, 4),
+            'chunk_id': f'chunk_{index}',
+            'parent_id': f'parent_{title.lower().replace(" ", "_")}',
+            'chunk': chunk,
+            'title': title,
+        })
+    return {'@odata.context': 'standin', 'value': value}
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+    requests = 0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StandinHandler.lock:
+            StandinHandler.connections += 1
+
+    def do_POST(self):
+        with StandinHandler.lock:
+            StandinHandler.requests += 1
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.delay:
+            time.sleep(self.delay)
+        body = json.dumps(search_response(payload.get('search', ''), int(payload.get('top', 3)))).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = 8090, delay: float = 0.0) -> ThreadingHTTPServer:
+    """Starts the stand-in server in a daemon thread."""
+    StandinHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandinHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# A local stand-in for Azure AI Search
+# python aisearch_standin.py [--port 8090] [--delay 0.05]
+#   serves the stand-in, point AISEARCH_ENDPOINT at http://127.0.0.1:8090/
+# python aisearch_standin.py --check
+#   also runs RAGAgentAISearch.search against it and reports connections, requests and cache hits
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure AI Search query API")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to each response")
+    parser.add_argument("--check", action="store_true", help="query the stand-in with RAGAgentAISearch and exit")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.delay)
+    print(f"AI Search stand-in listening on http://127.0.0.1:{args.port}/")
+    if not args.check:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        os.environ['AISEARCH_ENDPOINT'] = f"http://127.0.0.1:{args.port}/"
+        from agents import AgentSettings, RAGAgentAISearch
+        settings = AgentSettings()
+        settings.aisearch_endpoint = os.environ['AISEARCH_ENDPOINT']
+        agent = RAGAgentAISearch(settings, client=object(), async_client=object())
+        questions = ["How do I maintain the bike chain?", "What tire pressure should I use?", "How do I maintain the bike chain?"]
+        start = time.perf_counter()
+        for _ in range(3):
+            for question in questions:
+                hits = agent.search(question)
+                assert len(hits) == 3 and hits[0]['@search.rerankerScore'] >= hits[-1]['@search.rerankerScore']
+        elapsed = time.perf_counter() - start
+        print(f"{3 * len(questions)} searches in {elapsed:.3f}s, "
+              f"{StandinHandler.requests} requests over {StandinHandler.connections} connections, cache {agent.stats()}")
+        server.shutdown()
@@ -1,6 +1,8 @@
 import uvicorn
 import logging
 
+import database as rep
+
 from openai import AzureOpenAI
 from agents.Models import AISearchResult
 from agents import RAGAgentAISearch, AgentSettings
@@ -12,9 +14,9 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)    
     
     settings = AgentSettings()
-    client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version)
+    client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
     rag_agent = RAGAgentAISearch(settings, client)
-    rag_agent.generate_docs()
+    rag_agent.generate_docs(rep.iter_top_customers_rag(), rep.iter_top_products_rag())
     #rag_agent.process('user','user','What is the corporate location?')
 
     # Start the server
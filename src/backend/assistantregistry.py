@@ -0,0 +1,109 @@
+import time
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger("repo")
+
+
+class AssistantRegistry:
+    """Keeps one hydrated AssistantAgent per process.
+
+    The agent is rebuilt lazily when its TTL expires or when the assistant id in the store
+    changes (another worker reset the assistant). reset swaps in a new assistant under the
+    same lock get uses, so a request never sees a half reset assistant.
+    The registry can be registered with the AgentProxy in place of the agent.
+    """
+    def __init__(self, store, create, load, ttl: float = 600.0):
+        """args:
+            store: the KCVStore holding the assistant id
+            create: returns a new AssistantAgent with a new assistant
+            load: returns an AssistantAgent for an existing assistant id
+            ttl: seconds before the assistant is retrieved again
+        """
+        self.store = store
+        self.create = create
+        self.load = load
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._agent = None
+        self._loaded_at = 0.0
+        self._hits = 0
+        self._loads = 0
+        self._creates = 0
+        self._resets = 0
+
+    def __stored_id(self) -> str:
+        return self.store.get('assistant', 'id')
+
+    def __swap(self, agent):
+        self._agent = agent
+        self._loaded_at = time.monotonic()
+
+    def __create(self):
+        agent = self.create()
+        self.store.set('assistant', 'id', agent.assistant.id)
+        self._creates += 1
+        logger.info(f"Created assistant {agent.assistant.id}")
+        return agent
+
+    def get(self):
+        """Returns the assistant agent, loading or creating it when needed."""
+        with self._lock:
+            assistant_id = self.__stored_id()
+            agent = self._agent
+            if agent is not None and agent.assistant.id == assistant_id and time.monotonic() - self._loaded_at < self.ttl:
+                self._hits += 1
+                return agent
+            if assistant_id:
+                try:
+                    agent = self.load(assistant_id)
+                    self._loads += 1
+                    logger.info(f"Reloaded assistant {assistant_id}")
+                except Exception as e:
+                    logger.warning(f"Error loading assistant {assistant_id}, creating a new one: {str(e)}")
+                    agent = self.__create()
+            else:
+                agent = self.__create()
+            self.__swap(agent)
+            return agent
+
+    def reset(self):
+        """Deletes the current assistant and its files and creates a new one."""
+        with self._lock:
+            old_agent = self._agent
+            assistant_id = self.__stored_id()
+            if old_agent is None or old_agent.assistant.id != assistant_id:
+                old_agent = None
+                if assistant_id:
+                    try:
+                        old_agent = self.load(assistant_id)
+                    except Exception as e:
+                        logger.warning(f"Error loading assistant {assistant_id} for cleanup: {str(e)}")
+            self.store.delete('assistant', 'id')
+            self._agent = None
+            self._resets += 1
+            if old_agent is not None:
+                old_agent.cleanup()
+            agent = self.__create()
+            self.__swap(agent)
+            return agent
+
+    def process(self, user_name: str, user_id: str, prompt: str) -> list:
+        return self.get().process(user_name, user_id, prompt)
+
+    async def aprocess(self, user_name: str, user_id: str, prompt: str) -> list:
+        # get may wait on a reset or a reload, keep it off the event loop
+        agent = await asyncio.to_thread(self.get)
+        return await agent.aprocess(user_name, user_id, prompt)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'assistantId': self._agent.assistant.id if self._agent else None,
+                'age': round(time.monotonic() - self._loaded_at, 1) if self._agent else None,
+                'hits': self._hits,
+                'loads': self._loads,
+                'creates': self._creates,
+                'resets': self._resets,
+            }
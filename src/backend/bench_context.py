@@ -0,0 +1,71 @@
+import time
+import argparse
+import logging
+
+from openai import AzureOpenAI
+from agents import AgentSettings, GPTAgent, ContextSelector
+from agents.Tokens import estimate_tokens
+
+import database as rep
+
+QUESTIONS = [
+    "Who are the top 5 customers?",
+    "Which customers are from Toronto?",
+    "How much did the customers in the United Kingdom spend?",
+    "Which mountain bike models sold the most?",
+    "What is the best selling product in the Helmets category?",
+    "Which sales person has the best customers?",
+]
+
+
+def run_gpt_agent(agent: GPTAgent, question: str, context: str) -> tuple[str, float]:
+    start = time.perf_counter()
+    results = agent.process('bench', 'bench', question, context=context)
+    return results[-1].content, time.perf_counter() - start
+
+
+# Compares the prompt size, latency and answers of the chatbot with the full and the selected context
+# python bench_context.py [--live] [--questions questions.txt] [--tokens 1500]
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Compare selected and full context prompts for the chatbot")
+    parser.add_argument("--live", action="store_true", help="call the model and print the answers and latency of each mode")
+    parser.add_argument("--questions", help="a file with one question per line")
+    parser.add_argument("--tokens", type=int, default=1500, help="the token budget of the selected context")
+    args = parser.parse_args()
+
+    questions = QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    selector = ContextSelector(rep.get_context_tables, token_budget=args.tokens)
+    full_context = rep.get_context_text()
+    full_tokens = estimate_tokens(full_context)
+
+    if args.live:
+        settings = AgentSettings()
+        client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
+        agent = GPTAgent(settings, client)
+
+    total_selected = 0
+    latency_full = latency_selected = 0.0
+    for question in questions:
+        selected_context = selector.select(question, full_context)
+        selected_tokens = estimate_tokens(selected_context)
+        total_selected += selected_tokens
+        rows = len(selected_context.splitlines())
+        print(f"{question}\n  context tokens: full={full_tokens} selected={selected_tokens} ({rows} lines)")
+        if args.live:
+            full_answer, full_time = run_gpt_agent(agent, question, full_context)
+            selected_answer, selected_time = run_gpt_agent(agent, question, selected_context)
+            latency_full += full_time
+            latency_selected += selected_time
+            print(f"  latency: full={full_time:.2f}s selected={selected_time:.2f}s")
+            print(f"  full answer:     {full_answer.strip()}\n  selected answer: {selected_answer.strip()}")
+
+    count = len(questions)
+    print(f"\nAverage context tokens: full={full_tokens} selected={total_selected / count:.0f} "
+          f"({100 * (1 - total_selected / count / full_tokens):.0f}% smaller)")
+    if args.live:
+        print(f"Average latency: full={latency_full / count:.2f}s selected={latency_selected / count:.2f}s")
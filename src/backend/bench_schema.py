@@ -0,0 +1,74 @@
+import time
+import argparse
+import logging
+
+from openai import AzureOpenAI
+from agents import AgentSettings, SQLAgent, SchemaSelector
+from agents.Tokens import estimate_tokens
+
+import database as rep
+
+QUESTIONS = [
+    "What customers are in the United States?",
+    "In what countries are there customers who have bought products?",
+    "List the top 10 customers by total purchases.",
+    "What are the top 5 products sold by quantity?",
+    "Show the order details for customer 29485.",
+    "Which products have a description that mentions aluminum?",
+    "How many orders does each sales person have?",
+]
+
+
+def run_sql_agent(agent: SQLAgent, question: str) -> tuple[str, float]:
+    start = time.perf_counter()
+    results = agent.process('bench', 'bench', question, context=rep.sql_schema)
+    return results[-1].content, time.perf_counter() - start
+
+
+# Compares the prompt size and latency of the SQL agent with the full and the pruned schema
+# python bench_schema.py [--live] [--questions questions.txt]
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Compare pruned and full schema prompts for the SQL agent")
+    parser.add_argument("--live", action="store_true", help="call the model and measure the latency of each mode")
+    parser.add_argument("--questions", help="a file with one question per line")
+    parser.add_argument("--prune-columns", action="store_true", help="also prune the columns of the selected views")
+    args = parser.parse_args()
+
+    questions = QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    selector = SchemaSelector(rep.sql_schema, prune_columns=args.prune_columns)
+    full_tokens = estimate_tokens(rep.sql_schema)
+
+    if args.live:
+        settings = AgentSettings()
+        client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
+        full_agent = SQLAgent(settings, client)
+        pruned_agent = SQLAgent(settings, client)
+        pruned_agent.schema_selector = selector
+
+    total_full = total_pruned = 0
+    latency_full = latency_pruned = 0.0
+    for question in questions:
+        pruned = selector.prune(question)
+        pruned_tokens = estimate_tokens(pruned)
+        total_full += full_tokens
+        total_pruned += pruned_tokens
+        views = ",".join([view.name for view in selector.select(question)])
+        print(f"{question}\n  views: {views}\n  schema tokens: full={full_tokens} pruned={pruned_tokens}")
+        if args.live:
+            full_sql, full_time = run_sql_agent(full_agent, question)
+            pruned_sql, pruned_time = run_sql_agent(pruned_agent, question)
+            latency_full += full_time
+            latency_pruned += pruned_time
+            print(f"  latency: full={full_time:.2f}s pruned={pruned_time:.2f}s")
+            print(f"  full sql:   {full_sql.strip()}\n  pruned sql: {pruned_sql.strip()}")
+
+    count = len(questions)
+    print(f"\nAverage schema tokens: full={total_full / count:.0f} pruned={total_pruned / count:.0f} "
+          f"({100 * (1 - total_pruned / total_full):.0f}% smaller)")
+    if args.live:
+        print(f"Average latency: full={latency_full / count:.2f}s pruned={latency_pruned / count:.2f}s")
@@ -1,7 +1,19 @@
 import os
-import pymssql
+import re
+import asyncio
+import functools
+import json
+import threading
+import base64
+import hashlib
 import dotenv
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from dbpool import ConnectionPool
+from ttlcache import TTLCache
+from snapshot import Snapshot, VersionedSnapshot
+from singleflight import SingleFlight
+import sqlguard
 logger = logging.getLogger("repo")
 
 dotenv.load_dotenv()
@@ -15,13 +27,53 @@ DB_DATABASE = os.getenv('DB_DATABASE')
 if DB_HOST is None or DB_USER is None or DB_PASSWORD is None or DB_DATABASE is None:
     raise ValueError("Missing environment variables DB_HOST, DB_USER, DB_PASSWORD, DB_DATABASE")
 
-conn = pymssql.connect(
-    server=DB_HOST,
-    user=DB_USER,
-    password=DB_PASSWORD,
-    database=DB_DATABASE,
-    as_dict=True    
-)  
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN') or 1)
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX') or 10)
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT') or 30)
+DB_POOL_PING_INTERVAL = float(os.getenv('DB_POOL_PING_INTERVAL') or 30)
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS') or DB_POOL_MAX)
+DB_PAGE_SIZE = int(os.getenv('DB_PAGE_SIZE') or 500)
+DB_MAX_PAGE_SIZE = int(os.getenv('DB_MAX_PAGE_SIZE') or 5000)
+DB_STREAM_BATCH_SIZE = int(os.getenv('DB_STREAM_BATCH_SIZE') or 500)
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE') or 128)
+# per-query time to live in seconds, 0 disables caching
+DB_CACHE_TTL_COUNTS = float(os.getenv('DB_CACHE_TTL_COUNTS') or 60)
+DB_CACHE_TTL_GRIDS = float(os.getenv('DB_CACHE_TTL_GRIDS') or 300)
+DB_CACHE_TTL_TOP = float(os.getenv('DB_CACHE_TTL_TOP') or 600)
+DB_COUNTS_REFRESH_INTERVAL = float(os.getenv('DB_COUNTS_REFRESH_INTERVAL') or 60)
+DB_CONTEXT_REFRESH_INTERVAL = float(os.getenv('DB_CONTEXT_REFRESH_INTERVAL') or 300)
+SQL_GUARD_MAX_ROWS = int(os.getenv('SQL_GUARD_MAX_ROWS') or 1000)
+SQL_GUARD_TIMEOUT = float(os.getenv('SQL_GUARD_TIMEOUT') or 30)
+# estimated plan cost above which generated statements are rejected, 0 disables the check
+SQL_GUARD_MAX_COST = float(os.getenv('SQL_GUARD_MAX_COST') or 0)
+# seconds the results of generated SQL are cached by statement text, 0 disables the cache
+SQL_RESULT_CACHE_TTL = float(os.getenv('SQL_RESULT_CACHE_TTL') or 120)
+
+pool = ConnectionPool(
+    {
+        'server':DB_HOST,
+        'user':DB_USER,
+        'password':DB_PASSWORD,
+        'database':DB_DATABASE,
+        'as_dict':True
+    },
+    min_size=DB_POOL_MIN,
+    max_size=DB_POOL_MAX,
+    timeout=DB_POOL_TIMEOUT,
+    ping_interval=DB_POOL_PING_INTERVAL
+)
+
+cache = TTLCache(max_size=DB_CACHE_SIZE)
+
+# identical queries running at the same time share one execution
+flight = SingleFlight("db")
+
+# blocking database calls from async routes run here, sized to the connection pool
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+async def run_db(fn, *args, **kwargs):
+    """Runs a blocking database function in the bounded database executor."""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
 
 sql_schema = """
 Tables:
@@ -88,97 +140,265 @@ Q: In what countries are there customers who have bought products?
 A: SELECT DISTINCT vCustomers.CountryRegion FROM SalesLT.vCustomers INNER JOIN SalesLT.vOrderDetails ON vCustomers.CustomerID = vOrderDetails.CustomerID
 """
 
-def __getcount(sql_cmd:str)->int:
-    cursor = conn.cursor()
-    cursor.execute(sql_cmd)
-    row = cursor.fetchone()
-    return row['count']
-
-def __get_rows_and_cols(sql_cmd:str):
-    cursor = conn.cursor()
-    cursor.execute(sql_cmd)
-    columns = [{'key':column[0],'name':column[0],'resizable':True} for column in cursor.description]
-    rows = cursor.fetchall()
-    return {'columns':columns,'rows':rows}
+def __cached(key, ttl:float, loader):
+    if not ttl:
+        return flight.do(key, loader)
+    return cache.get_or_load(key, lambda: flight.do(key, loader), ttl)
+
+def __getcount(sql_cmd:str, ttl:float=0)->int:
+    def load():
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_cmd)
+            row = cursor.fetchone()
+            return row['count']
+    return __cached(('count', sql_cmd), ttl, load)
+
+def __get_rows_and_cols(sql_cmd:str, ttl:float=0, fresh:bool=False):
+    """Runs a query through the cache, fresh drops the cached result first so the query runs again."""
+    def load():
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_cmd)
+            columns = [{'key':column[0],'name':column[0],'resizable':True} for column in cursor.description]
+            rows = cursor.fetchall()
+            return {'columns':columns,'rows':rows}
+    if fresh:
+        cache.delete(('rows_and_cols', sql_cmd))
+    return __cached(('rows_and_cols', sql_cmd), ttl, load)
+
+def __get_rows_rag(sql_cmd:str, ttl:float=0):
+    def load():
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_cmd)
+            return cursor.fetchall()
+    return __cached(('rows', sql_cmd), ttl, load)
+
+def __encode_cursor(values:list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode('utf-8')).decode('ascii')
+
+def __decode_cursor(token:str, size:int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+def __keyset_query(view:str, keys:list, limit:int, after:str=None):
+    """Builds a keyset paginated select over a view ordered by the given keys.
+    args:
+        view: the view to select from
+        keys: the ordering columns, the last one must make the order unique
+        limit: the page size or None for no limit
+        after: the cursor returned with the previous page
+    returns:
+        the sql statement and its parameters
+    """
+    top = "top (%d) " % limit if limit else ""
+    where = ""
+    params = []
+    if after:
+        values = __decode_cursor(after, len(keys))
+        # (k1 > v1) or (k1 = v1 and k2 > v2) or ...
+        clauses = []
+        for i, key in enumerate(keys):
+            terms = [f"[{k}] = %s" for k in keys[:i]] + [f"[{key}] > %s"]
+            clauses.append("(" + " and ".join(terms) + ")")
+            params.extend(values[:i + 1])
+        where = "where " + " or ".join(clauses) + "\n"
+    order_by = ",".join([f"[{key}]" for key in keys])
+    sql_cmd = f"select {top}* from {view}\n{where}order by {order_by}"
+    return sql_cmd, tuple(params) or None
+
+def __page_size(limit:int) -> int:
+    if limit is None or limit <= 0:
+        return DB_PAGE_SIZE
+    return min(limit, DB_MAX_PAGE_SIZE)
+
+def __get_page(view:str, keys:list, limit:int, after:str=None, ttl:float=0) -> dict:
+    limit = __page_size(limit)
+    sql_cmd, params = __keyset_query(view, keys, limit, after)
+    def load():
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_cmd, params)
+            columns = [{'key':column[0],'name':column[0],'resizable':True} for column in cursor.description]
+            rows = cursor.fetchall()
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = __encode_cursor([rows[-1][key] for key in keys])
+        return {'columns':columns,'rows':rows,'next':next_cursor}
+    return __cached(('page', sql_cmd, params), ttl, load)
+
+def __iter_ndjson(sql_cmd:str, params:tuple=None, keys:list=None, limit:int=None):
+    conn = pool.acquire()
+    completed = False
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql_cmd, params)
+        columns = [{'key':column[0],'name':column[0],'resizable':True} for column in cursor.description]
+        yield json.dumps({'columns':columns}) + "\n"
+        count = 0
+        last = None
+        while True:
+            rows = cursor.fetchmany(DB_STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            count += len(rows)
+            last = rows[-1]
+            yield "".join([json.dumps(row, default=str) + "\n" for row in rows])
+        completed = True
+        if limit:
+            # a full page ends with the cursor of the next one, like the JSON pages
+            next_cursor = __encode_cursor([last[key] for key in keys]) if count == limit else None
+            yield json.dumps({'next':next_cursor}) + "\n"
+    finally:
+        # a partially read result set leaves the connection busy, drop it
+        pool.release(conn, discard=not completed)
+
+def __iter_rows(sql_cmd:str):
+    """Yields the rows of a statement, fetched from the cursor in batches."""
+    conn = pool.acquire()
+    completed = False
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql_cmd)
+        while True:
+            rows = cursor.fetchmany(DB_STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+        completed = True
+    finally:
+        pool.release(conn, discard=not completed)
+
+def __stream_ndjson(view:str, keys:list, limit:int=None, after:str=None):
+    """Streams a view as NDJSON. The first line holds the columns, every other line is a row.
+    With a limit the last line is {"next": cursor}, null after the last page.
+    Rows are fetched from the cursor in batches so the full result is never held in memory.
+    """
+    limit = limit and __page_size(limit)
+    # build the statement eagerly so an invalid cursor fails before the response starts
+    sql_cmd, params = __keyset_query(view, keys, limit, after)
+    return __iter_ndjson(sql_cmd, params, keys, limit)
 
-def __get_rows_rag(sql_cmd:str):
-    cursor = conn.cursor()
-    cursor.execute(sql_cmd)
-    return cursor.fetchall()
+CUSTOMER_KEYS = ['LastName','FirstName','CustomerID']
+# an order can list a product twice, SalesOrderDetailID makes the order unique
+ORDER_DETAIL_KEYS = ['CustomerID','SalesOrderID','SalesOrderDetailID']
 
+def get_customers(limit:int=None, after:str=None):
+    if limit is None and after is None:
+        sql_cmd = """select * from SalesLT.vCustomers order by LastName,FirstName"""
+        return __get_rows_and_cols(sql_cmd, DB_CACHE_TTL_GRIDS)
+    return __get_page("SalesLT.vCustomers", CUSTOMER_KEYS, limit, after, DB_CACHE_TTL_GRIDS)
 
-def get_customers():
-    sql_cmd = """select * from SalesLT.vCustomers order by LastName,FirstName"""
-    return __get_rows_and_cols(sql_cmd)
+def stream_customers(limit:int=None, after:str=None):
+    return __stream_ndjson("SalesLT.vCustomers", CUSTOMER_KEYS, limit, after)
 
 def get_customer_count() -> int:
     sql_cmd = """select count(*) as count from SalesLT.vCustomers"""
-    return __getcount(sql_cmd)
+    return __getcount(sql_cmd, DB_CACHE_TTL_COUNTS)
 
-def get_top_customers():
+def get_top_customers(fresh:bool=False):
     sql_cmd = """select CustomerID,LastName,FirstName,EmailAddress,SalesPerson,City,StateProvince,CountryRegion,Total 
 from [SalesLT].[vTopCustomers]
 order by total desc"""
-    return __get_rows_and_cols(sql_cmd)
+    return __get_rows_and_cols(sql_cmd, DB_CACHE_TTL_TOP, fresh)
 
-def get_top_customers_rag()->list:
-    sql_cmd = """select CustomerID,LastName,FirstName,EmailAddress,SalesPerson,City,StateProvince,CountryRegion,Total 
+TOP_CUSTOMERS_RAG_SQL = """select CustomerID,LastName,FirstName,EmailAddress,SalesPerson,City,StateProvince,CountryRegion,Total 
 from [SalesLT].[vTopCustomers]
 order by total desc"""
-    return __get_rows_rag(sql_cmd)
+
+def get_top_customers_rag()->list:
+    return __get_rows_rag(TOP_CUSTOMERS_RAG_SQL, DB_CACHE_TTL_TOP)
+
+def iter_top_customers_rag():
+    """Streams the rows of get_top_customers_rag without loading them all."""
+    return __iter_rows(TOP_CUSTOMERS_RAG_SQL)
 
 def get_top_customers_count() -> int:
     sql_cmd = """select count(*) as count from [SalesLT].[vTopCustomers]"""
-    return __getcount(sql_cmd)
+    return __getcount(sql_cmd, DB_CACHE_TTL_COUNTS)
+
+def __csv_text(title:str, colsandrows:dict) -> str:
+    """Builds a titled CSV block from the columns and rows of a query."""
+    keys = [column['key'] for column in colsandrows['columns']]
+    lines = [title, ",".join(keys)]
+    lines.extend([",".join([str(row[key]) for key in keys]) for row in colsandrows['rows']])
+    return "\n".join(lines) + "\n"
 
 def get_top_customers_csv_as_text():
     logger.info("Getting top customers as text")
-    colsandrows =get_top_customers()    
-    rows = colsandrows['rows']
-    columns = colsandrows['columns']
-    text = "Customer data\n"
-    #text += "CustomerID,LastName,FirstName,EmailAddress,SalesPerson,City,StateProvince,CountryRegion,Total\n"
-    text += ",".join([column['key'] for column in columns]) + "\n"
-    for row in rows:
-        text += f"{row['CustomerID']},{row['LastName']},{row['FirstName']},{row['EmailAddress']},{row['SalesPerson']},{row['City']},{row['StateProvince']},{row['CountryRegion']},{row['Total']}\n"
-    return text
+    return __csv_text("Customer data", get_top_customers())
 
 def get_products():
     sql_cmd = """select ProductId,Name,ProductModel,[Description] from [SalesLT].[vProductAndDescription]
 where culture='en' order by description"""
-    return __get_rows_and_cols(sql_cmd)
+    return __get_rows_and_cols(sql_cmd, DB_CACHE_TTL_GRIDS)
 
 def get_products_count() -> int:    
     sql_cmd = """select count(*) as count from [SalesLT].[vProductAndDescription]
 where culture='en'"""
-    return __getcount(sql_cmd)
+    return __getcount(sql_cmd, DB_CACHE_TTL_COUNTS)
 
-def get_top_products():
+def get_top_products(fresh:bool=False):
     sql_cmd = """select * from [SalesLT].[vTopProductsSold] order by TotalQty desc"""
-    return __get_rows_and_cols(sql_cmd)
+    return __get_rows_and_cols(sql_cmd, DB_CACHE_TTL_TOP, fresh)
+
+TOP_PRODUCTS_RAG_SQL = """select * from [SalesLT].[vTopProductsSold] order by TotalQty desc"""
 
 def get_top_products_rag():
-    sql_cmd = """select * from [SalesLT].[vTopProductsSold] order by TotalQty desc"""
-    return __get_rows_rag(sql_cmd)
+    return __get_rows_rag(TOP_PRODUCTS_RAG_SQL, DB_CACHE_TTL_TOP)
+
+def iter_top_products_rag():
+    """Streams the rows of get_top_products_rag without loading them all."""
+    return __iter_rows(TOP_PRODUCTS_RAG_SQL)
 
 def get_top_products_count() -> int:    
     sql_cmd = """select count(*) as count from [SalesLT].[vTopProductsSold]"""
-    return __getcount(sql_cmd)
+    return __getcount(sql_cmd, DB_CACHE_TTL_COUNTS)
 
 def get_top_products_csv_text():
     logger.info("Getting top products as text")
-    colsandrows = get_top_products()
-    columns = colsandrows['columns']
-    rows = colsandrows['rows']
-    text = "Product data\n"    
-    text += ",".join([column['key'] for column in columns]) + "\n"
-    for row in rows:
-        text += f"{row['ProductId']},{row['category']},{row['model']},{row['description']},{row['TotalQty']}\n"
-    return text
-
-def get_order_details():
-    sql_cmd = """select * from [SalesLT].[vOrderDetails] order by CustomerID,SalesOrderID,OrderQty desc"""
-    return __get_rows_and_cols(sql_cmd)
+    return __csv_text("Product data", get_top_products())
+
+def build_context() -> dict:
+    """Builds the top customers and top products context used by the chatbot.
+    The queries run again on every build, a cached result would hide the changes from the snapshot."""
+    customers = get_top_customers(fresh=True)
+    products = get_top_products(fresh=True)
+    text = __csv_text("Customer data", customers) + __csv_text("Product data", products)
+    return {'customers':customers,'products':products,'text':text}
+
+context_snapshot = VersionedSnapshot("context", build_context, DB_CONTEXT_REFRESH_INTERVAL, hasher=lambda value: hashlib.sha256(value['text'].encode('utf-8')).hexdigest())
+
+def get_context_text() -> str:
+    """Gets the chatbot context from the snapshot, it is only rebuilt when the data changes."""
+    return context_snapshot.get()['text']
+
+def get_context_tables() -> list:
+    """Gets the titled tables of the chatbot context from the snapshot."""
+    return __context_tables(context_snapshot.get())
+
+def __context_tables(context: dict) -> list:
+    return [("Customer data", context['customers']), ("Product data", context['products'])]
+
+def get_context_text_and_tables() -> tuple[str, list]:
+    """Gets the chatbot context text and its tables from the same snapshot, used to answer several questions with the same data."""
+    context = context_snapshot.get()
+    return context['text'], __context_tables(context)
+
+def get_order_details(limit:int=None, after:str=None):
+    if limit is None and after is None:
+        sql_cmd = """select * from [SalesLT].[vOrderDetails] order by CustomerID,SalesOrderID,OrderQty desc"""
+        return __get_rows_and_cols(sql_cmd, DB_CACHE_TTL_GRIDS)
+    return __get_page("[SalesLT].[vOrderDetails]", ORDER_DETAIL_KEYS, limit, after, DB_CACHE_TTL_GRIDS)
+
+def stream_order_details(limit:int=None, after:str=None):
+    return __stream_ndjson("[SalesLT].[vOrderDetails]", ORDER_DETAIL_KEYS, limit, after)
 
 # def get_order_details():
 #     cursor = conn.cursor()
@@ -190,18 +410,33 @@ def get_order_details():
 
 def get_order_details_count():
     sql_cmd = """select count(*) as count from [SalesLT].[vOrderDetails]"""
-    return __getcount(sql_cmd)
+    return __getcount(sql_cmd, DB_CACHE_TTL_COUNTS)
+
+
+def get_all_counts_from_db() -> dict:
+    """Gets all the counts in a single round trip."""
+    sql_cmd = """select
+(select count(*) from SalesLT.vCustomers) as customers,
+(select count(*) from [SalesLT].[vTopCustomers]) as topCustomers,
+(select count(*) from [SalesLT].[vProductAndDescription] where culture='en') as products,
+(select count(*) from [SalesLT].[vTopProductsSold]) as topProducts,
+(select count(*) from [SalesLT].[vOrderDetails]) as orderDetails"""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql_cmd)
+        row = cursor.fetchone()
+    return {
+        'customers':row['customers'],
+        'topCustomers':row['topCustomers'],
+        'products':row['products'],
+        'topProducts':row['topProducts'],
+        'orderDetails':row['orderDetails'],
+    }
 
+counts_snapshot = Snapshot("counts", get_all_counts_from_db, DB_COUNTS_REFRESH_INTERVAL)
 
 def get_all_counts():
-    results = {
-        'customers':get_customer_count(),
-        'topCustomers':get_top_customers_count(),
-        'products':get_products_count(),
-        'topProducts':get_top_products_count(),
-        'orderDetails':get_order_details_count(),        
-    }
-    return results
+    return counts_snapshot.get()
 
 def create_directory(folder:str):
     """Create a directory if it does not exist.
@@ -232,9 +467,10 @@ def export_top_products_csv():
 def get_db_status() -> int:
     try:
         # try to execute the statement
-        cursor = conn.cursor()    
-        cursor.execute("select 1 as status")
-        row = cursor.fetchone()
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("select 1 as status")
+            row = cursor.fetchone()
         return 1
     except Exception as e:
         logging.warning(f"Error connecting to database: {str(e)}")
@@ -247,15 +483,111 @@ def get_files_status() -> int:
     else:
         return 0
 
-def sql_executor(sql_cmd:str) -> dict:
+def __cancel(conn) -> bool:
+    """Cancels the running statement and flushes pending results on a connection."""
+    try:
+        conn._conn.cancel()
+        return True
+    except Exception as e:
+        logging.warning(f"Error cancelling sql statement: {str(e)}")
+        return False
+
+def normalize_sql(sql_cmd:str) -> str:
+    """Collapses whitespace outside of string literals so equivalent statements share a cache key."""
+    parts = re.split(r"('(?:[^']|'')*')", sql_cmd.strip().rstrip(";"))
+    return "".join([part if part.startswith("'") else " ".join(part.split()) for part in parts]).strip()
+
+def sql_executor(sql_cmd:str, max_rows:int=SQL_GUARD_MAX_ROWS, timeout:float=SQL_GUARD_TIMEOUT, max_cost:float=SQL_GUARD_MAX_COST, cache_ttl:float=SQL_RESULT_CACHE_TTL) -> dict:
+    """Executes a generated SQL statement with guards.
+    The statement must be a single read only query, its TOP is injected or capped to max_rows,
+    it is cancelled after timeout seconds, optionally rejected when its estimated plan cost is
+    above max_cost, and at most max_rows rows are fetched.
+    args:
+        sql_cmd: the statement to execute
+        max_rows: the maximum number of rows to return
+        timeout: seconds before the statement is cancelled, 0 for no timeout
+        max_cost: the maximum estimated plan cost, 0 to skip the estimate
+        cache_ttl: seconds successful results are cached by normalized statement, 0 to skip the cache
+    returns:
+        the columns, rows and a truncated flag when more rows were available
+    """
+    try:
+        guarded_cmd = sqlguard.cap_top(sqlguard.check_statement(sql_cmd), max_rows + 1)
+    except sqlguard.SQLGuardError as e:
+        logging.warning(f"Rejected sql statement: {sql_cmd} - {str(e)}")
+        return {'columns':[],'rows':[],'truncated':False,'error':str(e)}
+
+    cache_key = ('sql', normalize_sql(sql_cmd), max_rows)
+    if cache_ttl:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    result = flight.do(cache_key, lambda: __sql_executor(guarded_cmd, max_rows, timeout, max_cost))
+    if cache_ttl and 'error' not in result:
+        cache.set(cache_key, result, cache_ttl)
+    return result
+
+def __sql_executor(guarded_cmd:str, max_rows:int, timeout:float, max_cost:float) -> dict:
+    timed_out = threading.Event()
+    def on_timeout(conn):
+        timed_out.set()
+        __cancel(conn)
+
     try:
         # try to execute the statement
-        cursor = conn.cursor()    
-        cursor.execute(sql_cmd)
-        rows = cursor.fetchall()    
+        conn = pool.acquire()
+    except Exception as e:
+        logging.warning(f"Error executing sql statement: {guarded_cmd} - {str(e)}")
+        return {'columns':[],'rows':[],'truncated':False,'error':str(e)}
+    reusable = False
+    timer = None
+    try:
+        if max_cost > 0:
+            cost = sqlguard.estimate_cost(conn, guarded_cmd)
+            if cost > max_cost:
+                reusable = True
+                raise sqlguard.SQLGuardError(f"Estimated cost {cost:.2f} is above the limit of {max_cost:.2f}")
+        if timeout > 0:
+            timer = threading.Timer(timeout, on_timeout, args=(conn,))
+            timer.start()
+        cursor = conn.cursor()
+        cursor.execute(guarded_cmd)
         columns = [{'key':column[0],'name':column[0],'resizable':True} for column in cursor.description]
-        return {'columns':columns,'rows':rows}
-    except:
-        logging.warning(f"Error executing sql statement: {sql_cmd}")
-        return {'columns':[],'rows':[]}
-    
\ No newline at end of file
+        rows = cursor.fetchmany(max_rows + 1)
+        if timer is not None:
+            timer.cancel()
+        if timed_out.is_set():
+            raise sqlguard.SQLGuardError(f"Statement cancelled after {timeout} seconds")
+        truncated = len(rows) > max_rows
+        # drop the rows left on the server instead of reading them
+        reusable = __cancel(conn) if truncated else True
+        return {'columns':columns,'rows':rows[:max_rows],'truncated':truncated}
+    except Exception as e:
+        if timed_out.is_set():
+            e = sqlguard.SQLGuardError(f"Statement cancelled after {timeout} seconds")
+        logging.warning(f"Error executing sql statement: {guarded_cmd} - {str(e)}")
+        return {'columns':[],'rows':[],'truncated':False,'error':str(e)}
+    finally:
+        if timer is not None:
+            timer.cancel()
+        pool.release(conn, discard=not reusable)
+
+def get_pool_stats() -> dict:
+    return pool.stats()
+
+def get_cache_stats() -> dict:
+    return cache.stats()
+
+def get_counts_stats() -> dict:
+    return counts_snapshot.stats()
+
+def get_context_stats() -> dict:
+    return context_snapshot.stats()
+
+def get_flight_stats() -> dict:
+    return flight.stats()
+
+def invalidate_cache():
+    """Drops all cached query results so the next reads go to the database."""
+    cache.clear()
+    logger.info("Query cache invalidated")
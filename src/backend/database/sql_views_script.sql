@@ -79,9 +79,9 @@ AS
 GO
 
 
-CREATE VIEW [SalesLT].[vOrderDetails]
+CREATE OR ALTER VIEW [SalesLT].[vOrderDetails]
 AS
-    select b.CustomerID, A.SalesOrderID, A.ProductID, D.Name Category, E.Name Model, G.[Description], A.OrderQty, A.UnitPrice, A.UnitPriceDiscount, A.LineTotal
+    select b.CustomerID, A.SalesOrderID, A.SalesOrderDetailID, A.ProductID, D.Name Category, E.Name Model, G.[Description], A.OrderQty, A.UnitPrice, A.UnitPriceDiscount, A.LineTotal
     from SalesLT.SalesOrderDetail A
         inner join
         SalesLT.SalesOrderHeader B
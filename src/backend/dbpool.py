@@ -0,0 +1,171 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import pymssql
+
+logger = logging.getLogger("repo")
+
+
+class PoolTimeoutError(Exception):
+    """Exception raised when a connection could not be checked out in time."""
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of pymssql connections.
+
+    Connections are health-checked on checkout when they have been idle for
+    longer than ping_interval seconds and are replaced when the check fails or
+    when a caller drops them because of a connection error.
+    """
+    def __init__(self, connect_args: dict, min_size: int = 1, max_size: int = 10, timeout: float = 30.0, ping_interval: float = 30.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min_size must be between 0 and max_size and max_size at least 1")
+        self.connect_args = connect_args
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        # list of (connection, last_used) tuples
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._waiters = 0
+        # stats
+        self._checkouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._reconnects = 0
+        self._timeouts = 0
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        return pymssql.connect(**self.connect_args)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _ping(conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("select 1 as status")
+            cursor.fetchone()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Checks out a connection, waiting up to timeout seconds for one to free up.
+        returns:
+            a live pymssql connection
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            self._waiters += 1
+            try:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(f"Timed out after {self.timeout}s waiting for a database connection")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                conn, last_used = None, 0.0
+                # reserve the slot before connecting outside the lock
+                self._size += 1
+            self._in_use += 1
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif time.monotonic() - last_used > self.ping_interval and not self._ping(conn):
+                logger.warning("Dropped database connection detected, reconnecting")
+                self._close(conn)
+                conn = self._connect()
+                with self._cond:
+                    self._reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        """Returns a connection to the pool.
+        args:
+            conn: the connection to return
+            discard: close the connection instead of reusing it
+        """
+        if discard:
+            self._close(conn)
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out a connection and returns it afterwards.
+        Connections that fail with a connection level error are discarded.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except (pymssql.OperationalError, pymssql.InterfaceError):
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'inUse': self._in_use,
+                'waiters': self._waiters,
+                'minSize': self.min_size,
+                'maxSize': self.max_size,
+                'checkouts': self._checkouts,
+                'avgWaitMs': round(self._wait_time_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'maxWaitMs': round(self._wait_time_max * 1000, 3),
+                'reconnects': self._reconnects,
+                'timeouts': self._timeouts,
+            }
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from agents.Completions import scheduler
+from agents.RequestScheduler import ASSISTANT_PRIORITY
+
+logger = logging.getLogger("repo")
+
+
+def file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class FileSync:
+    """Keeps the files of a folder uploaded to Azure OpenAI for the assistants.
+
+    Files are addressed by their sha256. The manifest, a map of file name to hash and
+    file id, is kept in the KCVStore so only new or changed files are uploaded, in
+    parallel, and the remote files they replace are deleted in the background.
+    The synced files are owned by FileSync and shared by every assistant created from them.
+    """
+    def __init__(self, client, store, key: str = 'assistantfiles', max_workers: int = 4):
+        self.client = client
+        self.store = store
+        self.key = key
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="filesync")
+        self._uploads = 0
+        self._reused = 0
+        self._deletes = 0
+        self._delete_failures = 0
+        self._last_sync_ms = 0.0
+
+    def __load_manifest(self) -> dict:
+        value = self.store.get(self.key, 'manifest')
+        if not value:
+            return {}
+        try:
+            return json.loads(value)
+        except ValueError:
+            logger.warning("Ignoring an invalid file sync manifest")
+            return {}
+
+    def __save_manifest(self, manifest: dict):
+        self.store.set(self.key, 'manifest', json.dumps(manifest))
+
+    def __upload(self, path: str) -> str:
+        logger.info(f"Uploading file: {path}")
+
+        def create():
+            # opened for each attempt, a retried upload sends the whole file again
+            with Path(path).open("rb") as f:
+                return self.client.files.create(file=f, purpose="assistants").id
+        return scheduler.call(ASSISTANT_PRIORITY, 0, create)
+
+    def __delete(self, file_id: str):
+        try:
+            scheduler.call(ASSISTANT_PRIORITY, 0, lambda: self.client.files.delete(file_id))
+            logger.info(f"Deleted superseded file: {file_id}")
+            with self._lock:
+                self._deletes += 1
+        except Exception as e:
+            logger.warning(f"Error deleting superseded file {file_id}: {str(e)}")
+            with self._lock:
+                self._delete_failures += 1
+
+    def sync(self, folder: str) -> list[str]:
+        """Uploads the new and changed files of a folder.
+        args:
+            folder: the folder with the data files
+        returns:
+            the file ids of the files in the folder
+        """
+        with self._lock:
+            start = time.perf_counter()
+            manifest = self.__load_manifest()
+            hashes = {}
+            for name in sorted(os.listdir(folder)):
+                path = os.path.join(folder, name)
+                if os.path.isfile(path):
+                    hashes[name] = file_hash(path)
+
+            synced = {}
+            uploads = {}
+            for name, digest in hashes.items():
+                entry = manifest.get(name)
+                if entry and entry['hash'] == digest:
+                    synced[name] = entry
+                else:
+                    uploads[name] = self._executor.submit(self.__upload, os.path.join(folder, name))
+            for name, future in uploads.items():
+                synced[name] = {'hash': hashes[name], 'file_id': future.result()}
+
+            # remote files replaced by a new version or removed from the folder
+            kept = {entry['file_id'] for entry in synced.values()}
+            superseded = [entry['file_id'] for entry in manifest.values() if entry['file_id'] not in kept]
+            self.__save_manifest(synced)
+            for file_id in superseded:
+                self._executor.submit(self.__delete, file_id)
+
+            self._uploads += len(uploads)
+            self._reused += len(synced) - len(uploads)
+            self._last_sync_ms = (time.perf_counter() - start) * 1000
+            logger.info(f"Synced {folder}: {len(uploads)} uploaded, {len(synced) - len(uploads)} unchanged, "
+                        f"{len(superseded)} superseded in {self._last_sync_ms:.0f}ms")
+            return [synced[name]['file_id'] for name in hashes]
+
+    def clear(self):
+        """Forgets the manifest, the next sync uploads every file again."""
+        with self._lock:
+            self.store.delete(self.key, 'manifest')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'uploads': self._uploads,
+                'reused': self._reused,
+                'deletes': self._deletes,
+                'deleteFailures': self._delete_failures,
+                'lastSyncMs': round(self._last_sync_ms, 2),
+            }
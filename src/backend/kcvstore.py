@@ -1,9 +1,12 @@
 import sqlite3
+import threading
 
 class KCVStore:
     def __init__(self, dbpath):
         self.dbpath = dbpath
         self.conn = sqlite3.connect(self.dbpath, check_same_thread=False)
+        # the connection is shared by the request threads
+        self.lock = threading.RLock()
         self.cursor = self.conn.cursor()
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS kcvstore (
@@ -15,24 +18,27 @@ class KCVStore:
         self.conn.commit()
 
     def set(self, key, category, value):
-        self.cursor.execute('''
-            INSERT OR REPLACE INTO kcvstore (key, category, value)
-            VALUES (?, ?, ?)
-        ''', (key, category,value))
-        self.conn.commit()
+        with self.lock:
+            self.cursor.execute('''
+                INSERT OR REPLACE INTO kcvstore (key, category, value)
+                VALUES (?, ?, ?)
+            ''', (key, category,value))
+            self.conn.commit()
 
     def get(self, key, category):
-        self.cursor.execute('''
-            SELECT value FROM kcvstore WHERE key = ? and category = ?
-        ''', (key,category))
-        row = self.cursor.fetchone()
-        return row[0] if row else None
+        with self.lock:
+            self.cursor.execute('''
+                SELECT value FROM kcvstore WHERE key = ? and category = ?
+            ''', (key,category))
+            row = self.cursor.fetchone()
+            return row[0] if row else None
 
     def delete(self, key,category):
-        self.cursor.execute('''
-            DELETE FROM kcvstore WHERE key = ? and category = ?
-        ''', (key,category))
-        self.conn.commit()
+        with self.lock:
+            self.cursor.execute('''
+                DELETE FROM kcvstore WHERE key = ? and category = ?
+            ''', (key,category))
+            self.conn.commit()
 
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        self.conn.close()
@@ -1,17 +1,25 @@
 import logging
 import os
+import json
 import asyncio
 import requests
 import threading
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from kcvstore import KCVStore
-from agents import AgentSettings, AgentRegistration, AgentProxy, AssistantAgent, GPTAgent, SQLAgent, RAGAgentAISearch, SQLAgent 
-from agents.Models import ChatRequest
+from plancache import SQLPlanCache
+from assistantregistry import AssistantRegistry
+from filesync import FileSync
+from agents import AgentSettings, AgentRegistration, AgentProxy, IntentRouter, AssistantAgent, GPTAgent, SQLAgent, RAGAgentAISearch, SQLAgent, SchemaSelector, ThreadCleanup, ImageStore, VectorIndex, ContextSelector
+from agents.Models import ChatRequest, BatchRequest
+from agents.Streaming import MESSAGES_EVENT
+from agents.Completions import completion_flight, scheduler
+from agents.RequestScheduler import CHAT_PRIORITY, ASSISTANT_PRIORITY
 
 import database as rep
 import dotenv
@@ -31,10 +39,27 @@ CORS_ORIGINS = os.getenv("CORS_ORIGINS") or "*"
 
 #region: Initialize the agents and the store
 settings = AgentSettings()
-client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version)
-gpt_agent = GPTAgent(settings, client)
-rag_agent = RAGAgentAISearch(settings, client)
-#rag_agent.generate_docs()
+client = AzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
+async_client = AsyncAzureOpenAI(azure_endpoint=settings.api_endpoint, api_key=settings.api_key, api_version=settings.api_version, max_retries=0)
+gpt_agent = GPTAgent(settings, client, async_client)
+context_selector = None
+if (os.getenv("CHATBOT_CONTEXT_SELECTION") or "Yes") == "Yes":
+    context_selector = ContextSelector(rep.get_context_tables, token_budget=int(os.getenv("CHATBOT_CONTEXT_TOKENS") or 1500))
+    gpt_agent.context_selector = context_selector
+rag_agent = RAGAgentAISearch(settings, client, async_client)
+if (os.getenv("RAG_BACKEND") or "aisearch") == "local":
+    # search a local vector index over rag_docs instead of Azure AI Search
+    def embed(texts: list[str]) -> list:
+        # the embeddings deployment has its own token quota, only the request is counted
+        response = scheduler.call(CHAT_PRIORITY, 0, lambda: client.embeddings.create(model=settings.ada_model_deployment_name, input=texts))
+        return [item.embedding for item in response.data]
+    rag_index = VectorIndex(os.getenv("RAG_INDEX_PATH") or "rag_index/rag_docs", embed,
+                            approximate=(os.getenv("RAG_INDEX_APPROXIMATE") or "No") == "Yes")
+    rag_agent.retriever = rag_index
+    # hits cached before a sync changed the index are stale
+    rag_index.on_change = rag_agent.search_cache.clear
+    threading.Thread(target=rag_index.sync, args=('rag_docs',), name="rag-index-sync", daemon=True).start()
+#rag_agent.generate_docs(rep.iter_top_customers_rag(), rep.iter_top_products_rag())
 # def wrap_ingest():
 #     asyncio.run(rag_agent.ingest_customer_and_products())
 
@@ -42,12 +67,18 @@ rag_agent = RAGAgentAISearch(settings, client)
 # _thread.start()
 # _thread.join()
 
-sql_agent = SQLAgent(settings, client)
 store = KCVStore('settings.db')
+plan_cache = SQLPlanCache(store, max_entries=int(os.getenv("SQL_PLAN_CACHE_SIZE") or 1000), ttl=float(os.getenv("SQL_PLAN_CACHE_TTL") or 7*24*3600))
+schema_selector = SchemaSelector(rep.sql_schema) if (os.getenv("SQL_SCHEMA_PRUNING") or "Yes") == "Yes" else None
+sql_agent = SQLAgent(settings, client, async_client)
+sql_agent.plan_cache = plan_cache
+sql_agent.schema_selector = schema_selector
 #endregion
 
 #region: FastAPI App
 rep.create_directory('wwwroot/assets/data')
+rep.counts_snapshot.start()
+rep.context_snapshot.start()
 app = FastAPI(openapi_url=OPENAPI_URL, title="AdventureWorks API", version="0.1.0")
 #endregion
 
@@ -62,8 +93,46 @@ app.add_middleware(
 #endregion
 
 #region: FastAPI APIs
+def execute_sql_results(results: list, question: str) -> list:
+    """Executes the SQL statement in the messages of the SQL agent and attaches the columns and rows.
+    The answers of the other agents of the multiagent are left unchanged."""
+    for result in results:
+        if result.role == "assistant" and result.is_sql:
+            sql_statement = result.content
+            row_and_cols= rep.sql_executor(sql_statement)
+            if 'error' in row_and_cols:
+                # do not reuse a statement that failed
+                plan_cache.delete(question, rep.sql_schema)
+            columns = row_and_cols['columns']
+            rows = row_and_cols['rows']
+            result.columns = columns
+            result.rows = rows
+            result.truncated = row_and_cols.get('truncated', False)
+            result.error = row_and_cols.get('error')
+    return results
+
+def to_sse(events, question: str = None, execute_sql: bool = False):
+    """Converts the events of an agent process_stream into Server-Sent Events.
+    The final messages event carries the same ChatMessage list the POST routes return."""
+    try:
+        for event, data in events:
+            if event == MESSAGES_EVENT:
+                if execute_sql:
+                    data = execute_sql_results(data, question)
+                data = [message.model_dump() for message in data]
+            else:
+                data = {"content": data}
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    except Exception as e:
+        logger.error(f"Error streaming response: {str(e)}")
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
 @app.post("/api/reindex")
 def reindex():    
+    rep.invalidate_cache()
+    rep.counts_snapshot.refresh()
+    rep.context_snapshot.refresh()
     rep.export_top_customers_csv()
     logger.info("reindexed the top customers csv file")    
     rep.export_top_products_csv()
@@ -71,84 +140,96 @@ def reindex():
     return {"status": "CSV files recreated"}
 
 @app.get("/api/counts")
-def read_data():
-    return rep.get_all_counts()
+async def read_data():
+    return await rep.run_db(rep.get_all_counts)
 
 @app.get("/api/customers")
-def read_data():
-    return rep.get_customers()
+async def read_data(limit: int | None = None, after: str | None = None, stream: bool = False):
+    try:
+        if stream:
+            return StreamingResponse(rep.stream_customers(limit, after), media_type="application/x-ndjson")
+        return await rep.run_db(rep.get_customers, limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/customers/top")
-def read_data():
-    return rep.get_top_customers()
+async def read_data():
+    return await rep.run_db(rep.get_top_customers)
 
 @app.get("/api/products")
-def read_data():
-    return rep.get_products()
+async def read_data():
+    return await rep.run_db(rep.get_products)
 
 @app.get("/api/products/top")
-def read_data():
-    return rep.get_top_products()
+async def read_data():
+    return await rep.run_db(rep.get_top_products)
 
 @app.get("/api/orders")
-def read_data():
-    return rep.get_order_details()
+async def read_data(limit: int | None = None, after: str | None = None, stream: bool = False):
+    try:
+        if stream:
+            return StreamingResponse(rep.stream_order_details(limit, after), media_type="application/x-ndjson")
+        return await rep.run_db(rep.get_order_details, limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post('/api/chatbot')
-def chatbot(request: ChatRequest):
-    return gpt_agent.process('user','user',request.input,context=rep.get_top_customers_csv_as_text()+rep.get_top_products_csv_text())
+async def chatbot(request: ChatRequest):
+    context, context_tables = await rep.run_db(rep.get_context_text_and_tables)
+    return await gpt_agent.aprocess('user','user',request.input,context=context,context_tables=context_tables)
+
+@app.post('/api/chatbot/stream')
+def chatbot_stream(request: ChatRequest):
+    # one snapshot read, so the selected rows come from the same context as the text
+    context, context_tables = rep.get_context_text_and_tables()
+    events = gpt_agent.process_stream('user','user',request.input,context=context,context_tables=context_tables)
+    return StreamingResponse(to_sse(events), media_type="text/event-stream")
 
 @app.post('/api/sqlbot')
-def sqlbot(request: ChatRequest):
-    results = sql_agent.process('user','user',request.input, context=rep.sql_schema)
+async def sqlbot(request: ChatRequest):
+    results = await sql_agent.aprocess('user','user',request.input, context=rep.sql_schema)
     # Find the assistant message
-    for result in results:
-        if result.role == "assistant":
-            sql_statement = result.content
-            row_and_cols= rep.sql_executor(sql_statement)
-            columns = row_and_cols['columns']
-            rows = row_and_cols['rows']
-            result.columns = columns
-            result.rows = rows
-    return results
+    return await rep.run_db(execute_sql_results, results, request.input)
 
 @app.post('/api/rag')
-def ragbot(request: ChatRequest):
-    return rag_agent.process('user','user',request.input, context=rep.sql_schema)
+async def ragbot(request: ChatRequest):
+    return await rag_agent.aprocess('user','user',request.input, context=rep.sql_schema)
+
+@app.post('/api/rag/stream')
+def ragbot_stream(request: ChatRequest):
+    events = rag_agent.process_stream('user','user',request.input, context=rep.sql_schema)
+    return StreamingResponse(to_sse(events), media_type="text/event-stream")
 #endregion
 
 #region: Assistants
-def reset_assistant() -> AssistantAgent:    
-    store.delete('assistant','id')
-    try:
-        val = store.get('assistant','id')
-        agent = client.beta.assistants.retrieve(val)
-        assistant_agent = AssistantAgent(settings, client, "", "", "", tools_list=[], assistant=agent)
-        assistant_agent.cleanup()
-    except:
-        pass
-
-    assistant_agent = AssistantAgent(settings, client, 
+file_sync = FileSync(client, store, max_workers=int(os.getenv("ASSISTANT_UPLOAD_WORKERS") or 4))
+thread_cleanup = ThreadCleanup(client)
+image_store = ImageStore("wwwroot/images",
+                         max_bytes=int(float(os.getenv("IMAGE_STORE_MAX_MB") or 200) * 1024 * 1024),
+                         max_age=float(os.getenv("IMAGE_STORE_MAX_AGE_DAYS") or 7) * 24 * 3600)
+
+def create_assistant() -> AssistantAgent:
+    return AssistantAgent(settings, client, 
                                     "AdventureWorks Assistant",
                                     "You are a friendly asssitant that can help answer questions about customers, orders and products using the provided information.",
                                     "wwwroot/assets/data/",
-                                    [{"type": "code_interpreter"}])
-    
-    store.set('assistant','id',assistant_agent.assistant.id)
+                                    [{"type": "code_interpreter"}],
+                                    async_client=async_client,
+                                    file_sync=file_sync,
+                                    thread_cleanup=thread_cleanup,
+                                    image_store=image_store)
 
-    #return {'status':f'assistant created {assistant_agent.assistant.id}'}
-    return assistant_agent
+def load_assistant(assistant_id: str) -> AssistantAgent:
+    agent = scheduler.call(ASSISTANT_PRIORITY, 0, lambda: client.beta.assistants.retrieve(assistant_id))
+    return AssistantAgent(settings, client, "", "", "", tools_list=[], assistant=agent, async_client=async_client, thread_cleanup=thread_cleanup, image_store=image_store)
+
+assistant_registry = AssistantRegistry(store, create_assistant, load_assistant, ttl=float(os.getenv("ASSISTANT_REGISTRY_TTL") or 600))
+
+def reset_assistant() -> AssistantAgent:
+    return assistant_registry.reset()
 
 def get_assistant_agent()->AssistantAgent:
-    val = store.get('assistant','id')
-    if val:
-        agent = client.beta.assistants.retrieve(val)
-        assistant_agent = AssistantAgent(settings, client, "", "", "", tools_list=[], assistant=agent)
-        logger.info(f"Reloaded assistant {assistant_agent.assistant.id}")
-    else:
-        # send a bad request
-        assistant_agent = reset_assistant()
-    return assistant_agent
+    return assistant_registry.get()
 
 @app.delete('/api/assistants')
 def delete_state():    
@@ -156,8 +237,8 @@ def delete_state():
     return {"status":"assistant reset"}
 
 @app.post('/api/assistants')
-def chatbot(request: ChatRequest):    
-    return get_assistant_agent().process(request.user_name,request.user_id,request.input)
+async def chatbot(request: ChatRequest):    
+    return await assistant_registry.aprocess(request.user_name,request.user_id,request.input)
 
 @app.get("/api/assistants")
 def get_assistant_id():
@@ -165,11 +246,12 @@ def get_assistant_id():
     return {"assistant_id":val or "None"}
 
 @app.get("/api/status")
-def get_app_status():
-    total = rep.get_db_status() + rep.get_files_status()
+async def get_app_status():
+    db_status = await rep.run_db(rep.get_db_status)
+    total = db_status + rep.get_files_status()
     
     system_down = ""    
-    if rep.get_db_status() == 0:
+    if db_status == 0:
         system_down += "Db"
     if rep.get_files_status() == 0:
         system_down += "Files"    
@@ -183,35 +265,102 @@ def get_app_status():
     else:
         return {"status":"Unknown","total":total}
 
+@app.get("/api/stats")
+def get_app_stats():
+    return {"pool":rep.get_pool_stats(),"cache":rep.get_cache_stats(),"counts":rep.get_counts_stats(),"context":rep.get_context_stats(),"sqlPlans":plan_cache.stats(),"router":router.stats() if router else None,"assistant":assistant_registry.stats(),"assistantFiles":file_sync.stats(),"threadCleanup":thread_cleanup.stats(),"images":image_store.stats(),"search":rag_agent.stats(),"chatbotContext":context_selector.stats() if context_selector else None,"coalescing":{"db":rep.get_flight_stats(),"completions":completion_flight.stats()},"scheduler":scheduler.stats()}
+
 #endregion
 
 #region: multiagent
-bot_agent = GPTAgent(settings, client)
-bot_agent.get_context_delegate = lambda: rep.get_top_customers_csv_as_text() + rep.get_top_products_csv_text()
+bot_agent = GPTAgent(settings, client, async_client)
+bot_agent.get_context_delegate = rep.get_context_text
+bot_agent.context_selector = context_selector
 
-sql_agent = SQLAgent(settings, client)
+sql_agent = SQLAgent(settings, client, async_client)
 sql_agent.get_context_delegate = lambda: rep.sql_schema
-
-bot_agent_registration = AgentRegistration(settings, client, "SalesIntent", "Answer questions related to customers, orders and products.", bot_agent)
-sql_bot_registration = AgentRegistration(settings, client, "SqlIntent", "Generate and process SQL statement.", sql_agent)
-assistant_agent = get_assistant_agent()
-assistant_registration = AgentRegistration(settings, client, "AssistantIntent", "Generate chart, bars, and graphs related customers, orders, and products.", assistant_agent)
-rag_registration = AgentRegistration(settings, client, "RagIntent", "Provide product maintenance and usage information.", rag_agent)
-
-proxy = AgentProxy(settings, client, [bot_agent_registration, sql_bot_registration,assistant_registration])
+sql_agent.plan_cache = plan_cache
+sql_agent.schema_selector = schema_selector
+
+bot_agent_registration = AgentRegistration(settings, client, "SalesIntent", "Answer questions related to customers, orders and products.", bot_agent,
+    examples=["Who are the top customers?", "Which products sold the most?", "How much did the top customer spend?",
+              "What city are most of the top customers from?", "Which sales person has the best customers?"])
+sql_bot_registration = AgentRegistration(settings, client, "SqlIntent", "Generate and process SQL statement.", sql_agent,
+    examples=["Generate a SQL statement to list the customers in Canada", "Write a query that returns the order details of a customer",
+              "List all customers in the United States", "Show all the orders with a line total over 1000"],
+    keywords=["sql", "query", "select statement"])
+# the registry hands the request to the current assistant, so a reset also applies to the multiagent
+get_assistant_agent()
+assistant_registration = AgentRegistration(settings, client, "AssistantIntent", "Generate chart, bars, and graphs related customers, orders, and products.", assistant_registry,
+    examples=["Create a bar chart of the top 10 customers", "Plot the total sales by country", "Generate a pie chart of the top products by category"],
+    keywords=["chart", "charts", "graph", "graphs", "plot", "bar", "bars", "pie", "histogram", "visualize"])
+rag_registration = AgentRegistration(settings, client, "RagIntent", "Provide product maintenance and usage information.", rag_agent,
+    examples=["How do I maintain the bike chain?", "How should I adjust the brakes?", "What is the recommended tire pressure?"],
+    keywords=["maintenance", "maintain", "repair", "warranty"])
+
+registered_agents = [bot_agent_registration, sql_bot_registration,assistant_registration]
+router = IntentRouter(registered_agents, threshold=float(os.getenv("ROUTER_THRESHOLD") or 0.35)) if (os.getenv("LOCAL_ROUTER") or "Yes") == "Yes" else None
+proxy = AgentProxy(settings, client, registered_agents, router=router, async_client=async_client)
 
 @app.post('/api/multiagent')
-def chatbot(request: ChatRequest):
-    results = proxy.process(request.user_name,request.user_id,request.input)
-    for result in results:
-        if result.role == "assistant":
-            sql_statement = result.content
-            row_and_cols= rep.sql_executor(sql_statement)
-            columns = row_and_cols['columns']
-            rows = row_and_cols['rows']
-            result.columns = columns
-            result.rows = rows
-    return results
+async def chatbot(request: ChatRequest):
+    results = await proxy.aprocess(request.user_name,request.user_id,request.input)
+    return await rep.run_db(execute_sql_results, results, request.input)
+
+@app.post('/api/multiagent/stream')
+def multiagent_stream(request: ChatRequest):
+    events = proxy.process_stream(request.user_name,request.user_id,request.input)
+    return StreamingResponse(to_sse(events, request.input, execute_sql=True), media_type="text/event-stream")
+#endregion
+
+#region: Batch
+BATCH_MODES = ("chatbot", "sqlbot", "rag")
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY") or 4)
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS") or 100)
+
+async def process_batch_request(mode: str, request: ChatRequest, context: str, context_tables: list) -> list:
+    """Processes one request of a batch like the route of its mode, with the context of the batch."""
+    if mode == "chatbot":
+        return await gpt_agent.aprocess(request.user_name,request.user_id,request.input,request.max_tokens,request.temperature,context=context,context_tables=context_tables)
+    if mode == "sqlbot":
+        results = await sql_agent.aprocess(request.user_name,request.user_id,request.input,request.max_tokens,request.temperature,context=context)
+        return await rep.run_db(execute_sql_results, results, request.input)
+    return await rag_agent.aprocess(request.user_name,request.user_id,request.input,request.max_tokens,request.temperature,context=context)
+
+@app.post('/api/batch')
+async def batch(request: BatchRequest):
+    """Runs the requests of a batch concurrently, at most BATCH_CONCURRENCY at a time, and streams
+    one NDJSON line per request as it completes: {"index", "input", "messages"} or {"index", "input", "error"}."""
+    if request.mode not in BATCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(BATCH_MODES)}")
+    if len(request.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"a batch can have at most {BATCH_MAX_REQUESTS} requests")
+
+    # every request of the batch sees the same context snapshot, the context selector included
+    context, context_tables = rep.sql_schema, None
+    if request.mode == "chatbot":
+        context, context_tables = await rep.run_db(rep.get_context_text_and_tables)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(index: int, chat_request: ChatRequest) -> dict:
+        async with semaphore:
+            try:
+                results = await process_batch_request(request.mode, chat_request, context, context_tables)
+                return {"index": index, "input": chat_request.input, "messages": [message.model_dump() for message in results]}
+            except Exception as e:
+                logger.error(f"Error processing batch request {index}: {str(e)}")
+                return {"index": index, "input": chat_request.input, "error": str(e)}
+
+    async def results():
+        tasks = [asyncio.ensure_future(run(index, chat_request)) for index, chat_request in enumerate(request.requests)]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield json.dumps(await next_result, default=str) + "\n"
+        finally:
+            # the client went away, stop the requests that did not start
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 #endregion
 
 #region: Static Files
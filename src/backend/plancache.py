@@ -0,0 +1,104 @@
+import re
+import time
+import hashlib
+import logging
+
+from kcvstore import KCVStore
+
+logger = logging.getLogger("repo")
+
+
+def normalize_question(question: str) -> str:
+    """Lower cases a question and strips punctuation and repeated whitespace."""
+    question = re.sub(r"[^\w\s']", " ", question.lower())
+    return " ".join(question.split())
+
+
+class SQLPlanCache:
+    """Caches the SQL generated for a question in the KCVStore SQLite file.
+    Entries are keyed by a fingerprint of the normalized question and the schema used
+    to generate them, expire after ttl seconds and the least recently used entries are
+    evicted above max_entries.
+    """
+    def __init__(self, store: KCVStore, max_entries: int = 1000, ttl: float = 7 * 24 * 3600):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        with self.store.lock:
+            self.store.conn.execute('''
+                CREATE TABLE IF NOT EXISTS sqlplancache (
+                    fingerprint TEXT PRIMARY KEY,
+                    question TEXT,
+                    sql TEXT,
+                    created REAL,
+                    last_used REAL,
+                    hits INTEGER DEFAULT 0
+                )
+            ''')
+            self.store.conn.commit()
+
+    @staticmethod
+    def fingerprint(question: str, context: str = None) -> str:
+        schema_hash = hashlib.sha256((context or "").encode('utf-8')).hexdigest()
+        return hashlib.sha256((schema_hash + "\n" + normalize_question(question)).encode('utf-8')).hexdigest()
+
+    def get(self, question: str, context: str = None) -> str:
+        """Returns the cached SQL for a question or None."""
+        key = self.fingerprint(question, context)
+        now = time.time()
+        with self.store.lock:
+            row = self.store.conn.execute(
+                'SELECT sql, created FROM sqlplancache WHERE fingerprint = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.store.conn.execute('DELETE FROM sqlplancache WHERE fingerprint = ?', (key,))
+                    self.store.conn.commit()
+                self.misses += 1
+                return None
+            self.store.conn.execute(
+                'UPDATE sqlplancache SET last_used = ?, hits = hits + 1 WHERE fingerprint = ?', (now, key))
+            self.store.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, question: str, sql: str, context: str = None):
+        """Stores the SQL generated for a question and evicts expired and least recently used entries."""
+        key = self.fingerprint(question, context)
+        now = time.time()
+        with self.store.lock:
+            self.store.conn.execute('''
+                INSERT OR REPLACE INTO sqlplancache (fingerprint, question, sql, created, last_used, hits)
+                VALUES (?, ?, ?, ?, ?, 0)
+            ''', (key, normalize_question(question), sql, now, now))
+            self.store.conn.execute('DELETE FROM sqlplancache WHERE created < ?', (now - self.ttl,))
+            self.store.conn.execute('''
+                DELETE FROM sqlplancache WHERE fingerprint IN (
+                    SELECT fingerprint FROM sqlplancache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+            self.store.conn.commit()
+
+    def delete(self, question: str, context: str = None):
+        """Removes the cached SQL for a question, used when the statement failed to execute."""
+        with self.store.lock:
+            self.store.conn.execute('DELETE FROM sqlplancache WHERE fingerprint = ?', (self.fingerprint(question, context),))
+            self.store.conn.commit()
+
+    def clear(self):
+        with self.store.lock:
+            self.store.conn.execute('DELETE FROM sqlplancache')
+            self.store.conn.commit()
+
+    def stats(self) -> dict:
+        with self.store.lock:
+            size = self.store.conn.execute('SELECT count(*) FROM sqlplancache').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'maxEntries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
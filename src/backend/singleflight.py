@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls.
+
+    The first caller for a key runs the function, callers that arrive while it is in flight
+    wait for it and get the same result or exception. Nothing is kept once the call returns,
+    caching is left to the caller.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self._executions = 0
+        self._coalesced = 0
+
+    def do(self, key, fn):
+        """Runs fn() once for all the threads that ask for the same key at the same time."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executions += 1
+            else:
+                self._coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, fn):
+        """Async version of do, fn() returns an awaitable. The shared call runs as a task,
+        so a caller that is cancelled does not cancel it for the others."""
+        key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                task = self._tasks[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self.__forget(key, task))
+                self._executions += 1
+            else:
+                self._coalesced += 1
+        return await asyncio.shield(task)
+
+    def __forget(self, key, task):
+        if not task.cancelled():
+            # marks the exception as retrieved when every caller went away
+            task.exception()
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'inFlight': len(self._calls) + len(self._tasks),
+                'executions': self._executions,
+                'coalesced': self._coalesced,
+            }
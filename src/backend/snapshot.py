@@ -0,0 +1,106 @@
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger("repo")
+
+
+class Snapshot:
+    """Holds the last result of a loader in memory and refreshes it on an interval from a background thread.
+    Readers never wait on the loader once the first value is available.
+    """
+    def __init__(self, name: str, loader, interval: float = 60.0):
+        self.name = name
+        self.loader = loader
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._value = None
+        self._loaded = False
+        self._refreshed_at = 0.0
+        self._refreshes = 0
+        self._failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Runs the loader and swaps in the new value. Concurrent refreshes are serialized."""
+        with self._refresh_lock:
+            value = self.loader()
+            with self._lock:
+                self._value = value
+                self._loaded = True
+                self._refreshed_at = time.time()
+                self._refreshes += 1
+            return value
+
+    def get(self):
+        """Returns the current value, loading it synchronously the first time."""
+        with self._lock:
+            if self._loaded:
+                return self._value
+        return self.refresh()
+
+    def __run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+                logger.warning(f"Error refreshing {self.name} snapshot: {str(e)}")
+
+    def start(self):
+        """Starts the background refresh thread."""
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self.__run, name=f"{self.name}-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'ageSeconds': round(time.time() - self._refreshed_at, 3) if self._loaded else None,
+                'interval': self.interval,
+                'refreshes': self._refreshes,
+                'failures': self._failures,
+            }
+
+
+class VersionedSnapshot(Snapshot):
+    """A Snapshot whose value is tagged with a content hash.
+    A refresh that produces the same hash keeps the current value and version.
+    """
+    def __init__(self, name: str, loader, interval: float = 60.0, hasher=None):
+        super().__init__(name, loader, interval)
+        self.hasher = hasher or (lambda value: hashlib.sha256(str(value).encode('utf-8')).hexdigest())
+        self.version = None
+        self._unchanged = 0
+
+    def refresh(self):
+        with self._refresh_lock:
+            value = self.loader()
+            version = self.hasher(value)
+            with self._lock:
+                self._refreshed_at = time.time()
+                self._refreshes += 1
+                if self._loaded and version == self.version:
+                    self._unchanged += 1
+                    return self._value
+                self._value = value
+                self.version = version
+                self._loaded = True
+            logger.info(f"{self.name} snapshot rebuilt, version {version[:12]}")
+            return value
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            stats['version'] = self.version
+            stats['unchanged'] = self._unchanged
+        return stats
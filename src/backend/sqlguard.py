@@ -0,0 +1,96 @@
+import re
+
+FORBIDDEN_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|drop|alter|create|truncate|exec|execute|grant|revoke|deny|backup|restore|shutdown|dbcc|into|waitfor|openrowset|opendatasource|openquery)\b",
+    re.IGNORECASE)
+LITERALS_AND_COMMENTS = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.DOTALL)
+SELECT_HEAD = re.compile(r"^\s*select\s+(?P<quantifier>(?:distinct|all)\s+)?(?P<top>top\b)?", re.IGNORECASE)
+TOP_COUNT = re.compile(r"top\s*(?:\(\s*(?P<paren>\d+)\s*\)|(?P<bare>\d+)(?![.\w]))(?P<percent>\s+percent\b)?", re.IGNORECASE)
+OFFSET_FETCH = re.compile(r"\boffset\s+\S+\s+rows?\b", re.IGNORECASE)
+SUBTREE_COST = re.compile(r'StatementSubTreeCost="([0-9.Ee+-]+)"')
+
+
+class SQLGuardError(Exception):
+    """Exception raised when a generated SQL statement is rejected by the guard."""
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self) -> str:
+        return self.msg
+
+
+def check_statement(sql_cmd: str) -> str:
+    """Validates that the statement is a single read only query.
+    args:
+        sql_cmd: the statement to check
+    returns:
+        the statement without the trailing semicolon and whitespace
+    """
+    sql_cmd = sql_cmd.strip().rstrip(";").strip()
+    if not sql_cmd:
+        raise SQLGuardError("Empty SQL statement")
+    code = LITERALS_AND_COMMENTS.sub(" ", sql_cmd)
+    if ";" in code:
+        raise SQLGuardError("Only a single SQL statement is allowed")
+    first_word = code.strip().split(None, 1)[0].lower()
+    if first_word not in ("select", "with"):
+        raise SQLGuardError("Only SELECT statements are allowed")
+    keyword = FORBIDDEN_KEYWORDS.search(code)
+    if keyword:
+        raise SQLGuardError(f"Keyword not allowed in generated SQL: {keyword.group(1).upper()}")
+    return sql_cmd
+
+
+def cap_top(sql_cmd: str, max_rows: int) -> str:
+    """Injects a TOP clause in the outer SELECT or lowers an existing one to max_rows.
+    Statements that cannot carry a TOP (CTEs, OFFSET/FETCH) and TOP clauses that are not
+    a plain row count (PERCENT, expressions) are returned unchanged and rely on the bounded fetch instead.
+    args:
+        sql_cmd: a statement that passed check_statement
+        max_rows: the maximum number of rows to return
+    returns:
+        the rewritten statement
+    """
+    if OFFSET_FETCH.search(LITERALS_AND_COMMENTS.sub(" ", sql_cmd)):
+        return sql_cmd
+    match = SELECT_HEAD.match(sql_cmd)
+    if match is None:
+        return sql_cmd
+    quantifier = match.group('quantifier') or ""
+    if match.group('top'):
+        top = TOP_COUNT.match(sql_cmd, match.start('top'))
+        # TOP ... PERCENT and expressions such as TOP (@n) are kept as they are,
+        # rewriting them would change the meaning of the query
+        if top is None or top.group('percent'):
+            return sql_cmd
+        if int(top.group('paren') or top.group('bare')) <= max_rows:
+            return sql_cmd
+        return sql_cmd[:top.start()] + f"TOP ({max_rows})" + sql_cmd[top.end():]
+    return f"SELECT {quantifier}TOP ({max_rows}) " + sql_cmd[match.end():]
+
+
+def parse_plan_cost(showplan_xml: str) -> float:
+    """Returns the highest estimated statement subtree cost in a showplan XML document."""
+    costs = [float(cost) for cost in SUBTREE_COST.findall(showplan_xml or "")]
+    return max(costs) if costs else 0.0
+
+
+def estimate_cost(conn, sql_cmd: str) -> float:
+    """Gets the estimated cost of a statement from SQL Server without running it.
+    args:
+        conn: a pymssql connection
+        sql_cmd: the statement to estimate
+    returns:
+        the estimated subtree cost
+    """
+    cursor = conn.cursor()
+    cursor.execute("SET SHOWPLAN_XML ON")
+    try:
+        cursor.execute(sql_cmd)
+        row = cursor.fetchone()
+        plan = ""
+        if row:
+            plan = list(row.values())[0] if isinstance(row, dict) else row[0]
+        return parse_plan_cost(plan)
+    finally:
+        cursor.execute("SET SHOWPLAN_XML OFF")
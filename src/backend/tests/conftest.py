@@ -0,0 +1,10 @@
+import os
+import sys
+
+# the backend modules are imported from the src/backend folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database.py reads its settings at import, the tests never open a connection
+for name in ("DB_HOST", "DB_USER", "DB_PASSWORD", "DB_DATABASE"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("DB_POOL_MIN", "0")
@@ -0,0 +1,40 @@
+import pytest
+
+import aisearch_standin
+from aisearch_standin import StandinHandler
+from agents import AgentSettings, RAGAgentAISearch
+
+
+@pytest.fixture
+def standin():
+    StandinHandler.requests = 0
+    StandinHandler.connections = 0
+    server = aisearch_standin.serve(port=0)
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def agent(standin):
+    settings = AgentSettings()
+    settings.aisearch_endpoint = standin
+    return RAGAgentAISearch(settings, client=object(), async_client=object())
+
+
+def test_searches_reuse_one_connection(agent):
+    questions = [f"How do I maintain the bike chain {number}?" for number in range(8)]
+    for question in questions:
+        hits = agent.search(question)
+        assert len(hits) == 3
+        assert hits[0]['@search.rerankerScore'] >= hits[-1]['@search.rerankerScore']
+    assert StandinHandler.requests == len(questions)
+    assert StandinHandler.connections == 1
+
+
+def test_repeated_query_is_a_cache_hit(agent):
+    first = agent.search("What tire pressure should I use?")
+    second = agent.search("what tire  pressure should I use?")
+    assert second == first
+    assert StandinHandler.requests == 1
+    assert agent.stats()['hits'] == 1
@@ -0,0 +1,50 @@
+import database
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.description = [(key,) for key in rows[0]]
+
+    def execute(self, sql_cmd, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, source):
+        self.source = source
+
+    def cursor(self):
+        return FakeCursor(self.source())
+
+
+class FakePool:
+    def __init__(self, source):
+        self.source = source
+
+    def connection(self):
+        pool = self
+
+        class Context:
+            def __enter__(self):
+                return FakeConnection(pool.source)
+
+            def __exit__(self, *args):
+                return False
+        return Context()
+
+
+def test_context_refresh_reads_past_the_query_cache(monkeypatch):
+    city = {'value': "Toronto"}
+    monkeypatch.setattr(database, "pool", FakePool(lambda: [{'Name': "Ann", 'City': city['value']}]))
+    database.cache.clear()
+    snapshot = database.VersionedSnapshot("context", database.build_context, 0)
+    assert "Toronto" in snapshot.get()['text']
+    # the grids are still served from the cache between refreshes
+    assert database.get_top_customers()['rows'][0]['City'] == "Toronto"
+    city['value'] = "Paris"
+    assert "Paris" in snapshot.refresh()['text']
+    database.cache.clear()
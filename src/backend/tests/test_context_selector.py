@@ -0,0 +1,52 @@
+from agents import ContextSelector
+
+
+def table(title: str, keys: list, rows: list) -> tuple:
+    return title, {'columns': [{'key': key} for key in keys], 'rows': rows}
+
+
+def tables() -> list:
+    customers = table("Top customers", ['FirstName', 'City', 'Total'],
+                      [{'FirstName': name, 'City': city, 'Total': total}
+                       for name, city, total in [("Ann", "Seattle", 900), ("Bob", "Toronto", 800), ("Eve", "Paris", 700)]])
+    products = table("Top products", ['Name', 'Category'],
+                     [{'Name': name, 'Category': category} for name, category in [("Road-150", "Road Bikes"), ("Helmet", "Helmets")]])
+    return [customers, products]
+
+
+def test_matching_rows_are_selected_within_the_budget():
+    selector = ContextSelector(tables, token_budget=30)
+    text = selector.select("Which customers are from Toronto?")
+    assert "Bob,Toronto,800" in text
+    assert "Top products" not in text
+
+
+def test_the_tables_named_by_the_question_fill_the_budget():
+    selector = ContextSelector(tables, token_budget=1000)
+    text = selector.select("list the products")
+    assert text == "Top products\nName,Category\nRoad-150,Road Bikes\nHelmet,Helmets\n"
+
+
+def test_full_context_mode_returns_the_context():
+    selector = ContextSelector(tables, full_context=True)
+    assert selector.select("Who is Ann?", context="full context") == "full context"
+
+
+def test_the_index_is_rebuilt_only_when_the_tables_change():
+    current = tables()
+    selector = ContextSelector(lambda: current)
+    assert "Paris" in selector.select("Paris customers")
+    first_index = selector._index
+    selector.select("Seattle customers")
+    assert selector._index is first_index
+
+    current = [table("Top customers", ['FirstName', 'City', 'Total'], [{'FirstName': "Zoe", 'City': "Lisbon", 'Total': 1}])]
+    assert "Lisbon" in selector.select("Lisbon customers")
+    assert selector._index is not first_index
+
+
+def test_explicit_tables_are_used_instead_of_get_tables():
+    def get_tables():
+        raise AssertionError("get_tables should not be called")
+    selector = ContextSelector(get_tables)
+    assert "Helmet" in selector.select("helmets", tables=tables())
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from dbpool import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.healthy = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(ConnectionPool):
+    def __init__(self, **kwargs):
+        self.opened = []
+        super().__init__({}, **kwargs)
+
+    def _connect(self):
+        conn = FakeConnection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+    @staticmethod
+    def _ping(conn) -> bool:
+        return conn.healthy
+
+
+def test_connections_are_reused():
+    pool = FakePool(min_size=1, max_size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(pool.opened) == 1
+
+
+def test_checkout_times_out_when_the_pool_is_exhausted():
+    pool = FakePool(min_size=0, max_size=1, timeout=0.1)
+    conn = pool.acquire()
+    start = time.monotonic()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    assert time.monotonic() - start >= 0.1
+    assert pool.stats()['timeouts'] == 1
+    pool.release(conn)
+
+
+def test_waiter_gets_the_released_connection():
+    pool = FakePool(min_size=0, max_size=1, timeout=5)
+    conn = pool.acquire()
+    threading.Timer(0.05, pool.release, args=(conn,)).start()
+    assert pool.acquire() is conn
+    assert pool.stats()['maxWaitMs'] > 0
+
+
+def test_unhealthy_idle_connection_is_replaced():
+    pool = FakePool(min_size=1, max_size=1, ping_interval=0)
+    stale = pool.opened[0]
+    stale.healthy = False
+    time.sleep(0.01)
+    conn = pool.acquire()
+    assert conn is not stale and stale.closed
+    assert pool.stats()['reconnects'] == 1
+    assert pool.stats()['size'] == 1
+
+
+def test_discarded_connection_frees_its_slot():
+    pool = FakePool(min_size=0, max_size=1, timeout=0.1)
+    conn = pool.acquire()
+    pool.release(conn, discard=True)
+    assert conn.closed
+    assert pool.acquire() is not conn
+    assert pool.stats()['size'] == 1
+
+
+def test_invalid_sizes_are_rejected():
+    with pytest.raises(ValueError):
+        FakePool(min_size=2, max_size=1)
@@ -0,0 +1,77 @@
+import itertools
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from filesync import FileSync
+from kcvstore import KCVStore
+
+
+class FakeFiles:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.uploaded = []
+        self.deleted = []
+
+    def create(self, file, purpose):
+        with self.lock:
+            self.uploaded.append(file.read())
+            return SimpleNamespace(id=f"file-{next(self.ids)}")
+
+    def delete(self, file_id):
+        with self.lock:
+            self.deleted.append(file_id)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = KCVStore(str(tmp_path / "store.db"))
+    yield store
+    store.close()
+
+
+def sync_and_wait(file_sync: FileSync, folder) -> list:
+    file_ids = file_sync.sync(str(folder))
+    # the superseded files are deleted in the background
+    file_sync._executor.submit(lambda: None).result()
+    return file_ids
+
+
+def test_only_new_and_changed_files_are_uploaded(tmp_path, store):
+    folder = tmp_path / "data"
+    folder.mkdir()
+    (folder / "customers.jsonl").write_text("a")
+    (folder / "products.jsonl").write_text("b")
+    client = SimpleNamespace(files=FakeFiles())
+    file_sync = FileSync(client, store, max_workers=1)
+
+    first = sync_and_wait(file_sync, folder)
+    assert sorted(client.files.uploaded) == [b"a", b"b"]
+    assert sync_and_wait(file_sync, folder) == first
+    assert len(client.files.uploaded) == 2
+
+    (folder / "products.jsonl").write_text("c")
+    second = sync_and_wait(file_sync, folder)
+    assert second[0] == first[0] and second[1] != first[1]
+    assert client.files.deleted == [first[1]]
+    assert file_sync.stats()['uploads'] == 3 and file_sync.stats()['deletes'] == 1
+
+
+def test_removed_files_are_deleted_and_clear_uploads_again(tmp_path, store):
+    folder = tmp_path / "data"
+    folder.mkdir()
+    (folder / "customers.jsonl").write_text("a")
+    (folder / "products.jsonl").write_text("b")
+    client = SimpleNamespace(files=FakeFiles())
+    file_sync = FileSync(client, store, max_workers=1)
+
+    first = sync_and_wait(file_sync, folder)
+    (folder / "products.jsonl").unlink()
+    assert sync_and_wait(file_sync, folder) == first[:1]
+    assert client.files.deleted == [first[1]]
+
+    file_sync.clear()
+    sync_and_wait(file_sync, folder)
+    assert len(client.files.uploaded) == 3
@@ -0,0 +1,44 @@
+import os
+import time
+
+from agents import ImageStore
+
+
+def test_repeated_images_are_stored_once(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=1000)
+    url = store.save(b"chart")
+    assert store.save(b"chart") == url
+    assert url.startswith("/images/") and os.path.exists(tmp_path / url[len("/images/"):])
+    assert store.stats()['writes'] == 1 and store.stats()['hits'] == 1
+
+
+def test_least_recently_used_images_are_evicted_over_the_budget(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=10)
+    first = store.save(b"aaaa")
+    time.sleep(0.01)
+    second = store.save(b"bbbb")
+    time.sleep(0.01)
+    store.save(b"aaaa")
+    time.sleep(0.01)
+    store.save(b"cccc")
+    assert not os.path.exists(tmp_path / second[len("/images/"):])
+    assert os.path.exists(tmp_path / first[len("/images/"):])
+    assert store.stats()['bytesStored'] == 8 and store.stats()['evictions'] == 1
+
+
+def test_an_image_larger_than_the_budget_is_kept(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=4)
+    store.save(b"aaaa")
+    url = store.save(b"a much larger chart")
+    assert os.path.exists(tmp_path / url[len("/images/"):])
+    assert store.stats()['files'] == 1
+
+
+def test_the_index_is_reloaded_and_expired_images_are_evicted(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=1000)
+    store.save(b"chart")
+    assert ImageStore(str(tmp_path), max_bytes=1000).stats()['bytesStored'] == 5
+    time.sleep(0.02)
+    reloaded = ImageStore(str(tmp_path), max_bytes=1000, max_age=0.01)
+    assert reloaded.stats()['files'] == 0
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".png")] == []
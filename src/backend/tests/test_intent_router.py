@@ -0,0 +1,54 @@
+import pytest
+
+from agents import AgentRegistration, AgentSettings, IntentRouter
+
+
+def registrations():
+    # the registrations of main.py, without the agents
+    settings = AgentSettings()
+    return [
+        AgentRegistration(settings, object(), "SalesIntent", "Answer questions related to customers, orders and products.", None,
+            examples=["Who are the top customers?", "Which products sold the most?", "How much did the top customer spend?",
+                      "What city are most of the top customers from?", "Which sales person has the best customers?"]),
+        AgentRegistration(settings, object(), "SqlIntent", "Generate and process SQL statement.", None,
+            examples=["Generate a SQL statement to list the customers in Canada", "Write a query that returns the order details of a customer",
+                      "List all customers in the United States", "Show all the orders with a line total over 1000"],
+            keywords=["sql", "query", "select statement"]),
+        AgentRegistration(settings, object(), "AssistantIntent", "Generate chart, bars, and graphs related customers, orders, and products.", None,
+            examples=["Create a bar chart of the top 10 customers", "Plot the total sales by country", "Generate a pie chart of the top products by category"],
+            keywords=["chart", "charts", "graph", "graphs", "plot", "bar", "bars", "pie", "histogram", "visualize"]),
+    ]
+
+
+@pytest.mark.parametrize("prompt,intent", [
+    ("Who are the top 5 customers?", "SalesIntent"),
+    ("Which products sold the most last year?", "SalesIntent"),
+    ("Write a SQL statement that counts the orders", "SqlIntent"),
+    ("List all customers in Germany", "SqlIntent"),
+    ("Draw a pie chart of sales by category", "AssistantIntent"),
+])
+def test_domain_prompts_are_routed_locally(prompt, intent):
+    assert IntentRouter(registrations()).route(prompt) == intent
+
+
+@pytest.mark.parametrize("prompt", [
+    "Write a poem about the sea",
+    "Write an email to my manager",
+    "Generate a haiku about spring",
+    "Create a story about a dragon",
+    "What are the best movies of all time?",
+    "Which city is the best to visit?",
+])
+def test_off_topic_prompts_fall_through_to_the_llm(prompt):
+    router = IntentRouter(registrations())
+    assert router.route(prompt) is None
+    # nothing is cached, the next call falls through again
+    assert router.route(prompt) is None
+    assert router.stats()['cacheHits'] == 0
+
+
+def test_llm_decisions_are_cached():
+    router = IntentRouter(registrations())
+    router.learn("Write a poem about the sea", "OtherAgent", 0.5)
+    assert router.route("write a poem about the sea!") == "OtherAgent"
+    assert router.stats()['cacheHits'] == 1
@@ -0,0 +1,30 @@
+from agents import AgentSettings, RAGAgentAISearch, VectorIndex
+
+WORDS = ["chain", "brake", "tire", "warranty"]
+
+
+def embed(texts: list[str]) -> list:
+    return [[float(word in text.lower()) for word in WORDS] + [1.0] for text in texts]
+
+
+def test_empty_hits_are_not_cached_and_sync_clears_the_cache(tmp_path):
+    docs = tmp_path / "rag_docs"
+    docs.mkdir()
+    index = VectorIndex(str(tmp_path / "index" / "rag_docs"), embed)
+    agent = RAGAgentAISearch(AgentSettings(), client=object(), async_client=object())
+    agent.retriever = index
+    index.on_change = agent.search_cache.clear
+
+    # nothing indexed yet, the question is asked again once the sync ran
+    assert agent.search("How do I clean the chain?") == []
+    (docs / "Maintenance.txt").write_text("Lubricate the chain every 200 miles.\nReplace worn brake pads.\n")
+    assert index.sync(str(docs))['changed']
+    hits = agent.search("How do I clean the chain?")
+    assert hits[0]['chunk'] == "Lubricate the chain every 200 miles."
+    assert agent.search("How do I clean the chain?") == hits
+
+    # a sync that changes the index drops the cached hits
+    (docs / "Maintenance.txt").write_text("Clean the chain with a degreaser.\nReplace worn brake pads.\n")
+    assert index.sync(str(docs))['changed']
+    assert agent.search("How do I clean the chain?")[0]['chunk'] == "Clean the chain with a degreaser."
+    assert not index.sync(str(docs))['changed']
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+import database
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.description = [(key,) for key in rows[0]] if rows else [("CustomerID",)]
+
+    def execute(self, sql_cmd, params=None):
+        self.sql_cmd = sql_cmd
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(list(self.rows))
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def acquire(self):
+        return FakeConnection(self.rows)
+
+    def release(self, conn, discard=False):
+        pass
+
+
+def test_cursor_round_trip():
+    values = ["O'Brien", "Zoë", 42]
+    token = database.__encode_cursor(values)
+    assert database.__decode_cursor(token, 3) == values
+
+
+@pytest.mark.parametrize("token", ["not a cursor", database.__encode_cursor([1, 2])])
+def test_invalid_cursor_is_rejected(token):
+    with pytest.raises(ValueError):
+        database.__decode_cursor(token, 3)
+
+
+def test_keyset_query_continues_after_the_cursor():
+    sql_cmd, params = database.__keyset_query("[SalesLT].[vOrderDetails]", database.ORDER_DETAIL_KEYS, 2, database.__encode_cursor([1, 10, 100]))
+    assert sql_cmd.startswith("select top (2) * from [SalesLT].[vOrderDetails]")
+    assert "([CustomerID] = %s and [SalesOrderID] = %s and [SalesOrderDetailID] > %s)" in sql_cmd
+    assert sql_cmd.endswith("order by [CustomerID],[SalesOrderID],[SalesOrderDetailID]")
+    assert params == (1, 1, 10, 1, 10, 100)
+
+
+def rows(count):
+    return [{'CustomerID': 1, 'SalesOrderID': 10, 'SalesOrderDetailID': number, 'ProductID': 7} for number in range(count)]
+
+
+def test_stream_page_ends_with_the_next_cursor(monkeypatch):
+    monkeypatch.setattr(database, "pool", FakePool(rows(2)))
+    lines = [json.loads(line) for line in "".join(database.stream_order_details(limit=2)).splitlines()]
+    assert lines[0]['columns'][0]['key'] == 'CustomerID'
+    assert len(lines) == 4
+    assert database.__decode_cursor(lines[-1]['next'], 3) == [1, 10, 1]
+
+
+def test_stream_last_page_has_no_next_cursor(monkeypatch):
+    monkeypatch.setattr(database, "pool", FakePool(rows(1)))
+    lines = [json.loads(line) for line in "".join(database.stream_order_details(limit=2)).splitlines()]
+    assert lines[-1] == {'next': None}
+
+
+def test_stream_without_limit_has_no_cursor_line(monkeypatch):
+    monkeypatch.setattr(database, "pool", FakePool(rows(3)))
+    lines = "".join(database.stream_order_details()).splitlines()
+    assert len(lines) == 4 and 'next' not in lines[-1]
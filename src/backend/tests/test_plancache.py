@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+from kcvstore import KCVStore
+from plancache import SQLPlanCache
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = KCVStore(str(tmp_path / "plans.db"))
+    yield store
+    store.close()
+
+
+def test_questions_are_normalized_and_keyed_by_schema(store):
+    cache = SQLPlanCache(store)
+    cache.set("Top 5 customers?", "SELECT TOP 5 * FROM vCustomers", "schema v1")
+    assert cache.get("top 5   CUSTOMERS", "schema v1") == "SELECT TOP 5 * FROM vCustomers"
+    assert cache.get("top 5 customers", "schema v2") is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_entries_expire_after_the_ttl(store):
+    cache = SQLPlanCache(store, ttl=0.05)
+    cache.set("top customers", "SELECT 1")
+    assert cache.get("top customers") == "SELECT 1"
+    time.sleep(0.06)
+    assert cache.get("top customers") is None
+    assert cache.stats()['size'] == 0
+
+
+def test_least_recently_used_entries_are_evicted(store):
+    cache = SQLPlanCache(store, max_entries=2)
+    cache.set("a", "SELECT 'a'")
+    time.sleep(0.01)
+    cache.set("b", "SELECT 'b'")
+    time.sleep(0.01)
+    cache.get("a")
+    cache.set("c", "SELECT 'c'")
+    assert cache.get("b") is None
+    assert cache.get("a") == "SELECT 'a'" and cache.get("c") == "SELECT 'c'"
+
+
+def test_deleted_entries_are_not_reused(store):
+    cache = SQLPlanCache(store)
+    cache.set("top customers", "SELECT 1", "schema")
+    cache.delete("top customers", "schema")
+    assert cache.get("top customers", "schema") is None
@@ -0,0 +1,33 @@
+import json
+import os
+
+from agents import AgentSettings, RAGAgentAISearch
+
+
+def customer(id: int, total: float) -> dict:
+    return {'CustomerID': id, 'FirstName': 'Ann', 'LastName': 'Lee', 'City': 'Seattle', 'StateProvince': 'Washington',
+            'CountryRegion': 'United States', 'Total': total}
+
+
+def product(id: int, quantity: float) -> dict:
+    return {'ProductId': id, 'category': 'Bikes', 'model': 'Road-150', 'description': 'A road bike', 'TotalQty': quantity}
+
+
+def test_docs_are_only_rewritten_when_the_rows_change(tmp_path):
+    agent = RAGAgentAISearch(AgentSettings(), client=object(), async_client=object())
+    folder = str(tmp_path)
+
+    manifest = agent.generate_docs([customer(1, 10.0), customer(2, 5.0)], [product(7, 3)], folder)
+    assert manifest['version'] == 1
+    assert manifest['files']['Customers.txt']['added'] == ['1', '2']
+    with open(os.path.join(folder, 'Customers.txt')) as f:
+        assert [json.loads(line)['CustomerID'] for line in f] == [1, 2]
+
+    manifest = agent.generate_docs([customer(1, 10.0), customer(2, 5.0)], [product(7, 3)], folder)
+    assert not manifest['files']['Customers.txt']['written']
+
+    manifest = agent.generate_docs([customer(1, 12.0)], [product(7, 3)], folder)
+    assert manifest['files']['Customers.txt']['changed'] == ['1']
+    assert manifest['files']['Customers.txt']['removed'] == ['2']
+    assert manifest['version'] == 3
+    assert sorted(os.listdir(folder)) == ['Customers.txt', 'Producs.txt', 'manifest.json']
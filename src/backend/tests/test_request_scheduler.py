@@ -0,0 +1,119 @@
+import time
+import asyncio
+import threading
+
+import httpx
+import pytest
+from openai import BadRequestError, RateLimitError
+
+from agents.RequestScheduler import ASSISTANT_PRIORITY, CHAT_PRIORITY, ROUTING_PRIORITY, RequestScheduler
+
+
+def api_error(error_class, status: int, headers: dict = None):
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "https://openai.test/"))
+    return error_class("error", response=response, body=None)
+
+
+def wait_for_depth(scheduler: RequestScheduler, depth: int):
+    while sum(scheduler.stats()['queueDepth'].values()) < depth:
+        time.sleep(0.01)
+
+
+def test_waiting_requests_are_admitted_by_priority():
+    scheduler = RequestScheduler(tpm=1000)
+    # drains the tokens bucket, the next requests wait about a minute for the refill
+    scheduler.admit(CHAT_PRIORITY, 1000)
+    order = []
+
+    def admit(priority):
+        scheduler.admit(priority, 10)
+        order.append(priority)
+
+    threads = []
+    for number, priority in enumerate([ASSISTANT_PRIORITY, CHAT_PRIORITY, ROUTING_PRIORITY]):
+        threads.append(threading.Thread(target=admit, args=(priority,)))
+        threads[-1].start()
+        wait_for_depth(scheduler, number + 1)
+    start = time.monotonic()
+    # the request used fewer tokens than estimated, the waiters are woken
+    scheduler.settle(1000, 0)
+    for thread in threads:
+        thread.join(5)
+    assert order == [ROUTING_PRIORITY, CHAT_PRIORITY, ASSISTANT_PRIORITY]
+    assert time.monotonic() - start < 1
+    assert scheduler.stats()['admitted'] == {'routing': 1, 'chat': 2, 'assistant': 1}
+
+
+def test_async_waiters_are_woken_by_priority():
+    scheduler = RequestScheduler(tpm=1000)
+    scheduler.admit(CHAT_PRIORITY, 1000)
+    order = []
+
+    async def admit(priority):
+        await scheduler.aadmit(priority, 10)
+        order.append(priority)
+
+    async def main():
+        tasks = []
+        for number, priority in enumerate([ASSISTANT_PRIORITY, CHAT_PRIORITY, ROUTING_PRIORITY]):
+            tasks.append(asyncio.ensure_future(admit(priority)))
+            while sum(scheduler.stats()['queueDepth'].values()) < number + 1:
+                await asyncio.sleep(0.01)
+        start = time.monotonic()
+        # settled from another thread, like a request that finished in the default executor
+        await asyncio.get_running_loop().run_in_executor(None, scheduler.settle, 1000, 0)
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) < 1
+    assert order == [ROUTING_PRIORITY, CHAT_PRIORITY, ASSISTANT_PRIORITY]
+
+
+def test_a_cancelled_waiter_leaves_the_queue():
+    scheduler = RequestScheduler(tpm=1000)
+    scheduler.admit(CHAT_PRIORITY, 1000)
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.aadmit(CHAT_PRIORITY, 10))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert scheduler.stats()['queueDepth'] == {'routing': 0, 'chat': 0, 'assistant': 0}
+
+
+@pytest.mark.parametrize("headers,delay", [({'retry-after-ms': '250'}, 0.25), ({'retry-after': '2'}, 2.0)])
+def test_rate_limited_requests_are_retried_after_the_retry_after_header(monkeypatch, headers, delay):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    scheduler = RequestScheduler(backoff=0.001)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise api_error(RateLimitError, 429, headers)
+        return "ok"
+
+    assert scheduler.call(CHAT_PRIORITY, 10, fn) == "ok"
+    assert sleeps == [delay]
+    assert scheduler.stats()['rateLimited'] == 1 and scheduler.stats()['retries'] == 1
+
+
+def test_retries_stop_after_max_retries_and_other_errors_are_raised(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    scheduler = RequestScheduler(max_retries=2, backoff=0.001)
+
+    def rate_limited():
+        raise api_error(RateLimitError, 429)
+    with pytest.raises(RateLimitError):
+        scheduler.call(CHAT_PRIORITY, 10, rate_limited)
+    assert scheduler.stats()['rateLimited'] == 3 and scheduler.stats()['retries'] == 2
+
+    def bad_request():
+        raise api_error(BadRequestError, 400)
+    with pytest.raises(BadRequestError):
+        scheduler.call(CHAT_PRIORITY, 10, bad_request)
+    assert scheduler.stats()['retries'] == 2
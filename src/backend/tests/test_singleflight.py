@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flight.do, "key", fn)
+        started.wait()
+        followers = [executor.submit(flight.do, "key", fn) for _ in range(3)]
+        results = [leader.result()] + [future.result() for future in followers]
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'inFlight': 0, 'executions': 1, 'coalesced': 3}
+
+
+def test_errors_are_raised_to_every_waiter_and_not_kept():
+    flight = SingleFlight("test")
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.do, "key", fail)
+        started.wait()
+        follower = executor.submit(flight.do, "key", fail)
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_async_calls_are_coalesced_and_errors_propagated():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError("boom")
+
+    async def main():
+        assert await asyncio.gather(*[flight.ado("key", fn) for _ in range(4)]) == ["result"] * 4
+        results = await asyncio.gather(*[flight.ado("error", fail) for _ in range(2)], return_exceptions=True)
+        assert all([isinstance(result, ValueError) for result in results])
+
+    asyncio.run(main())
+    assert len(calls) == 1
+    assert flight.stats() == {'inFlight': 0, 'executions': 2, 'coalesced': 4}
+
+
+def test_a_cancelled_waiter_does_not_cancel_the_shared_call():
+    flight = SingleFlight("test")
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        first = asyncio.ensure_future(flight.ado("key", fn))
+        second = asyncio.ensure_future(flight.ado("key", fn))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "result"
+
+    asyncio.run(main())
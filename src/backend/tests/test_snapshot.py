@@ -0,0 +1,51 @@
+import time
+
+from snapshot import Snapshot
+
+
+def test_first_get_loads_and_later_gets_reuse_the_value():
+    calls = []
+    snapshot = Snapshot("test", lambda: calls.append(1) or len(calls), interval=0)
+    assert snapshot.get() == 1
+    assert snapshot.get() == 1
+    assert snapshot.stats()['refreshes'] == 1
+
+
+def test_background_refresh_swaps_the_value():
+    values = iter(range(100))
+    snapshot = Snapshot("test", lambda: next(values), interval=0.02)
+    assert snapshot.get() == 0
+    snapshot.start()
+    time.sleep(0.1)
+    snapshot.stop()
+    assert snapshot.get() > 0
+
+
+def test_failed_refresh_keeps_the_last_value():
+    state = {'fail': False}
+
+    def loader():
+        if state['fail']:
+            raise RuntimeError("database down")
+        return "value"
+
+    snapshot = Snapshot("test", loader, interval=0.02)
+    snapshot.get()
+    state['fail'] = True
+    snapshot.start()
+    time.sleep(0.1)
+    snapshot.stop()
+    assert snapshot.get() == "value"
+    assert snapshot.stats()['failures'] > 0
+
+
+def test_versioned_snapshot_keeps_the_value_when_the_hash_is_unchanged():
+    from snapshot import VersionedSnapshot
+    values = iter([["a"], ["a"], ["b"]])
+    snapshot = VersionedSnapshot("test", lambda: next(values), interval=0)
+    first = snapshot.get()
+    version = snapshot.version
+    assert snapshot.refresh() is first
+    assert snapshot.version == version and snapshot.stats()['unchanged'] == 1
+    assert snapshot.refresh() == ["b"]
+    assert snapshot.version != version
@@ -0,0 +1,51 @@
+import pytest
+
+from sqlguard import SQLGuardError, check_statement, cap_top
+
+
+def test_check_statement_strips_the_trailing_semicolon():
+    assert check_statement("  SELECT * FROM vProducts; ") == "SELECT * FROM vProducts"
+    assert check_statement("WITH c AS (SELECT 1 AS n) SELECT n FROM c") == "WITH c AS (SELECT 1 AS n) SELECT n FROM c"
+
+
+@pytest.mark.parametrize("sql_cmd", [
+    "",
+    "SELECT 1; SELECT 2",
+    "UPDATE vProducts SET Name = 'x'",
+    "SELECT * INTO #copy FROM vProducts",
+    "SELECT 1 WAITFOR DELAY '00:00:05'",
+    "EXEC sp_who",
+])
+def test_check_statement_rejects_unsafe_statements(sql_cmd):
+    with pytest.raises(SQLGuardError):
+        check_statement(sql_cmd)
+
+
+def test_check_statement_ignores_keywords_in_literals_and_comments():
+    sql_cmd = "SELECT Name FROM vProducts WHERE Name = 'drop; delete' -- update"
+    assert check_statement(sql_cmd) == sql_cmd
+
+
+def test_cap_top_injects_a_top_clause():
+    assert cap_top("SELECT Name FROM vProducts", 100) == "SELECT TOP (100) Name FROM vProducts"
+    assert cap_top("select distinct Name FROM vProducts", 100) == "SELECT distinct TOP (100) Name FROM vProducts"
+
+
+def test_cap_top_lowers_a_larger_row_count():
+    assert cap_top("SELECT TOP 10 Name FROM vProducts", 100) == "SELECT TOP 10 Name FROM vProducts"
+    assert cap_top("SELECT TOP 5000 Name FROM vProducts", 100) == "SELECT TOP (100) Name FROM vProducts"
+    assert cap_top("SELECT TOP (5000) WITH TIES Name FROM vProducts ORDER BY Name", 100) == \
+        "SELECT TOP (100) WITH TIES Name FROM vProducts ORDER BY Name"
+
+
+@pytest.mark.parametrize("sql_cmd", [
+    "SELECT TOP 50 PERCENT Name FROM vProducts",
+    "SELECT TOP (10) PERCENT Name FROM vProducts",
+    "SELECT TOP 5.5 PERCENT Name FROM vProducts",
+    "SELECT TOP (@n) Name FROM vProducts",
+    "SELECT TOP ((SELECT COUNT(*) FROM vCustomers)) Name FROM vProducts",
+    "WITH c AS (SELECT Name FROM vProducts) SELECT Name FROM c",
+    "SELECT Name FROM vProducts ORDER BY Name OFFSET 10 ROWS FETCH NEXT 10 ROWS ONLY",
+])
+def test_cap_top_keeps_statements_it_cannot_rewrite(sql_cmd):
+    assert cap_top(sql_cmd, 100) == sql_cmd
@@ -0,0 +1,58 @@
+import time
+
+from ttlcache import TTLCache
+
+
+def test_entries_expire_after_their_ttl():
+    cache = TTLCache(max_size=4)
+    cache.set("short", 1, ttl=0.05)
+    cache.set("long", 2, ttl=10)
+    assert cache.get("short") == 1
+    time.sleep(0.06)
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_zero_ttl_is_not_cached():
+    cache = TTLCache()
+    cache.set("key", 1, ttl=0)
+    assert cache.get("key") is None
+
+
+def test_get_or_load_calls_the_loader_once():
+    cache = TTLCache()
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_load("key", lambda: calls.append(1) or "value", ttl=10) == "value"
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+
+
+def test_cached_none_is_a_hit():
+    cache = TTLCache()
+    calls = []
+    cache.get_or_load("key", lambda: calls.append(1), ttl=10)
+    cache.get_or_load("key", lambda: calls.append(1), ttl=10)
+    assert len(calls) == 1
+
+
+def test_delete_and_clear_invalidate():
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.delete("a")
+    assert cache.get("a") is None
+    cache.clear()
+    assert cache.get("b") is None
+    assert cache.stats()['invalidations'] == 2
@@ -172,7 +172,7 @@ const App = () => {
 
             data.forEach((msg: IResponse) => {
                 msgs.push({ role: msg.role, content: msg.content, imageUrl: null, mode: (msg.role === "assistant" ? settings.mode : null) })
-                if ((settings.mode === Mode.SqlBot || settings.mode === Mode.MultiAgent) && msg.role === 'assistant') {
+                if ((settings.mode === Mode.SqlBot || settings.mode === Mode.MultiAgent) && msg.role === 'assistant' && msg.is_sql) {
                     if (msg.rows) {
                         console.info(msg.rows)
                         if (msg.rows.length > 0) {
@@ -183,6 +183,11 @@ const App = () => {
                         }
 
                     }
+                    if (msg.error) {
+                        msgs.push({ role: 'assistant', content: `The SQL statement could not be run: ${msg.error}`, imageUrl: null, mode: Mode.SqlBot })
+                    } else if (msg.truncated) {
+                        msgs.push({ role: 'assistant', content: `Only the first ${msg.rows.length} rows are shown, ask a narrower question to see the rest`, imageUrl: null, mode: Mode.SqlBot })
+                    }
                 }
             })
 
@@ -20,11 +20,15 @@ export interface IResponse {
     content: string,
     columns: any[],
     rows: any[],
+    truncated?: boolean,
+    error?: string | null,
+    is_sql?: boolean,
 }
 
 export interface IGridColsRow {
     columns: any[],
-    rows: any[]
+    rows: any[],
+    next?: string | null
 }
 
 export interface ICounts {